@@ -18,13 +18,17 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import types
+import os
 import parser
 import re
+import bisect
+import difflib
 import inspect
 import math
 import copy
 import logging
 import decimal
+import time
 
 from gettext import gettext as _
 
@@ -36,11 +40,20 @@ except ImportError:
 
 from mathlib import MathLib
 from plotlib import Plot
+from lrucache import LRUCache
+from nametrie import NameTrie
+import vecfunctions
+import decimalmath
+import functions
 
 PLOTHELP = _(
 "plot(eqn, var=-a..b), plot the equation 'eqn' with the variable 'var' in the \
 range from a to b")
 
+PROFILEHELP = _(
+"profile(enable), turn profiling of calculations on (1) or off (0). \
+help(profile) shows where the time was spent.")
+
 class ParserError(Exception):
     """Parent class for exceptions raised by the parser."""
 
@@ -66,10 +79,12 @@ class ParserError(Exception):
 class ParseError(ParserError):
     """Class for error during parsing."""
 
-    def __init__(self, msg, start, eqn, end=None):
+    def __init__(self, msg, start, eqn=None, end=None):
         ParserError.__init__(self, msg, start, eqn, end)
 
     def __str__(self):
+        if self.eqn is None:
+            return ParserError.__str__(self)
         msg = _("Error at '%s', position: %d") % \
               (self.eqn[self._range[0] - 1 : self._range[1] - 1],
                self._range[0])
@@ -96,10 +111,12 @@ class WrongSyntaxError(ParserError):
 class RuntimeError(ParserError):
     """Class for error during executing."""
 
-    def __init__(self, msg, start, eqn, end=None):
-        ParserError.__init__(self, msg, start, end)
+    def __init__(self, msg, start, eqn=None, end=None):
+        ParserError.__init__(self, msg, start, eqn, end)
 
     def __str__(self):
+        if self.eqn is None:
+            return ParserError.__str__(self)
         msg = _("Error at '%s', position: %d") % \
               (self.eqn[self._range[0] - 1 : self._range[1] - 1],
                self._range[0])
@@ -107,17 +124,131 @@ class RuntimeError(ParserError):
             msg += ": %s" % (self._msg)
         return msg
 
+class BudgetError(RuntimeError):
+    """Class for evaluations aborted because they exceed a budget."""
+
+class UndefinedError(RuntimeError):
+    """Class for references to undefined variables or functions."""
+
+def _get_locale_key():
+    '''Return the settings that determine which translations gettext uses.'''
+    return tuple([os.environ.get(var, None) for var in \
+                  ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG')])
+
+class HelpIndex:
+    '''
+    Lookup structure for help topics in the current locale, built from a
+    dictionary of untranslated topic -> text. Topics can be found by their
+    name (translated or not), by prefix and by the words in their text.
+    '''
+
+    WORD_REGEXP = re.compile(r'\w+', re.UNICODE)
+
+    # Shorter words are not indexed
+    MIN_WORD_LENGTH = 3
+
+    def __init__(self, topics):
+        self._texts = {}
+        self._names = {}
+        self._words = {}
+
+        for (topic, text) in topics.iteritems():
+            text = _(text)
+            self._texts[topic] = text
+            self._names[topic] = topic
+            self._names[unicode(_(topic))] = topic
+            for word in self.get_words(text):
+                self._words.setdefault(word, set()).add(topic)
+
+        self._sorted_names = sorted(self._names.keys())
+
+    def get_words(self, text):
+        '''Return the set of (lower case) words in <text> to index.'''
+        if type(text) is types.StringType:
+            text = unicode(text, 'utf-8', 'replace')
+        return set([w.lower() for w in self.WORD_REGEXP.findall(text) \
+                    if len(w) >= self.MIN_WORD_LENGTH])
+
+    def get_names(self):
+        '''Return the sorted topic names, translated and untranslated.'''
+        return self._sorted_names
+
+    def get_text(self, name):
+        '''Return the translated text for topic <name>, or None.'''
+        topic = self._names.get(name, None)
+        if topic is None:
+            return None
+        return self._texts[topic]
+
+    def find_prefix(self, prefix):
+        '''Return the sorted topic names starting with <prefix>.'''
+        i = bisect.bisect_left(self._sorted_names, prefix)
+        ret = []
+        while i < len(self._sorted_names) and \
+                self._sorted_names[i].startswith(prefix):
+            ret.append(self._sorted_names[i])
+            i += 1
+        return ret
+
+    def search(self, query):
+        '''
+        Return the topics whose text contains words of <query>, the topics
+        matching most words first.
+        '''
+        counts = {}
+        for word in self.get_words(query):
+            for topic in self._words.get(word, ()):
+                counts[topic] = counts.get(topic, 0) + 1
+        ret = [(-n, topic) for (topic, n) in counts.iteritems()]
+        ret.sort()
+        return [topic for (n, topic) in ret]
+
+    def suggest(self, name, max_items=5):
+        '''
+        Return topic names similar to <name>: the names it is a prefix of,
+        then the closest names by spelling.
+        '''
+        ret = self.find_prefix(name)[:max_items]
+        for match in difflib.get_close_matches(name, self._sorted_names,
+                                               max_items, 0.6):
+            if match not in ret:
+                ret.append(match)
+        return ret[:max_items]
+
 class Helper:
+    '''
+    Help topics. Topics and texts are stored untranslated, topics shared by
+    all parsers (the plug-in documentation) are set with
+    set_shared_topics(). Lookups go through a HelpIndex, which is rebuilt
+    when topics are added or the locale changes.
+    '''
 
     def __init__(self, parent):
         self._parent = parent
         self._topics = {}
+        self._shared_topics = {}
+        self._index = None
+        self._index_key = None
         self.add_help('test',
             _('This is just a test topic, use help(index) for the index'))
 
     def add_help(self, topic, text):
-        self._topics[unicode(topic)] = _(text)
-        self._topics[unicode(_(topic))] = _(text)
+        self._topics[unicode(topic)] = text
+        self._index = None
+
+    def set_shared_topics(self, topics):
+        self._shared_topics = topics
+        self._index = None
+
+    def get_index(self):
+        '''Return the HelpIndex for the current locale.'''
+        key = _get_locale_key()
+        if self._index is None or key != self._index_key:
+            topics = dict(self._shared_topics)
+            topics.update(self._topics)
+            self._index = HelpIndex(topics)
+            self._index_key = key
+        return self._index
 
     def get_help(self, topic=None):
         if isinstance(topic, ast.Name):
@@ -127,12 +258,13 @@ class Helper:
         elif type(topic) not in (types.StringType, types.UnicodeType) or len(topic) == 0:
             return _("Use help(test) for help about 'test', or help(index) for the index")
 
+        index = self.get_index()
+
         # TRANS: This command is descriptive, so can be translated
         if topic in ('index', _('index'), 'topics', _('topics')):
             ret = _('Topics') + ': '
-            topics = self._topics.keys()
-            topics.append('index')
-            topics.sort()
+            topics = list(index.get_names())
+            bisect.insort(topics, u'index')
             ret += ', '.join(topics)
             return ret
 
@@ -143,6 +275,10 @@ class Helper:
             ret += ', '.join(variables)
             return ret
 
+        # TRANS: This command is descriptive, so can be translated
+        if topic in ('profile', _('profile')):
+            return self._parent.get_profile_text()
+
         # TRANS: This command is descriptive, so can be translated
         if topic in ('functions', _('functions')):
             ret = _('Functions') + ': '
@@ -150,25 +286,228 @@ class Helper:
             ret += ', '.join(functions)
             return ret
 
-        for (key, val) in self._topics.iteritems():
-            if topic == key or _(topic) == key:
-                return val
+        topic = unicode(topic)
+        text = index.get_text(topic)
+        if text is not None:
+            return text
+
+        # A unique prefix, e.g. 'facto' for 'factorize'
+        names = index.find_prefix(topic)
+        if len(names) == 1:
+            return index.get_text(names[0])
+        elif len(names) > 1:
+            return _("Topics starting with '%s': %s") % \
+                   (topic, ', '.join(names))
+
+        names = index.search(topic)
+        if len(names) > 0:
+            return _("Topics about '%s': %s") % (topic, ', '.join(names))
+
+        ret = _("No help about '%s' available, use help(index) for the index") % (topic)
+        names = index.suggest(topic)
+        if len(names) > 0:
+            ret += '. ' + _('Did you mean: %s?') % (', '.join(names))
+        return ret
+
+class PluginRegistry:
+    '''
+    Variables, functions and help texts of the plug-in modules. This is
+    collected once per process, see get_plugin_registry(), and shared by
+    all AstParser instances.
+
+    namespace: dictionary of plug-in variables and functions.
+    foldable: the values that may be folded into constants.
+    pure_funcs: functions whose result only depends on their arguments.
+    impure: the other names.
+    random_funcs: functions returning random values.
+    result_bits: dictionary of function -> result size estimator.
+    topics: help texts of the plug-in functions, untranslated.
+    '''
+
+    PLUGINS = ('functions', 'constants')
+
+    # Types of plug-in values that may be folded into a constant
+    FOLD_TYPES = (types.IntType, types.LongType, types.FloatType,
+                  types.BooleanType, types.ClassType)
+
+    def __init__(self):
+        self.namespace = {}
+        self.foldable = {}
+        pure_funcs = set()
+        self.impure = set()
+        random_funcs = set()
+        self.result_bits = {}
+        self.topics = {}
+
+        for plugin in self.PLUGINS:
+            try:
+                mod = __import__(plugin)
+            except Exception, e:
+                logging.error('Error loading plugin %s: %s', plugin, e)
+                continue
+
+            impure = getattr(mod, '_IMPURE_FUNCTIONS', ())
+            settings = getattr(mod, '_SETTINGS', ())
+            for name, item in vars(mod).iteritems():
+                if name.startswith('_') or name in settings or \
+                        type(item) is types.ModuleType:
+                    continue
+
+                name = unicode(name)
+                self.namespace[name] = item
+                if type(item) in self.FOLD_TYPES:
+                    self.foldable[name] = item
+                elif type(item) is types.FunctionType and name not in impure:
+                    self.foldable[name] = item
+                    pure_funcs.add(name)
+                else:
+                    self.impure.add(name)
+                if type(item) in (types.FunctionType, types.ClassType):
+                    if item.__doc__ is not None:
+                        self.topics[name] = item.__doc__
+
+            for name in getattr(mod, '_RANDOM_FUNCTIONS', ()):
+                random_funcs.add(unicode(name))
+            for name, func in getattr(mod, '_RESULT_BITS', {}).iteritems():
+                self.result_bits[getattr(mod, name)] = func
+
+        self.pure_funcs = frozenset(pure_funcs)
+        self.random_funcs = frozenset(random_funcs)
+
+_plugin_registry = None
+
+def get_plugin_registry():
+    '''Return the PluginRegistry, creating it on first use.'''
+    global _plugin_registry
+    if _plugin_registry is None:
+        _plugin_registry = PluginRegistry()
+    return _plugin_registry
+
+class _NotVectorizable(Exception):
+    """Raised when a tree can not be evaluated on arrays."""
+    pass
+
+class Const(ast.expr):
+    '''
+    Node holding a value computed while optimizing a parse tree.
+
+    used_vars: dictionary of names of folded constants and the offset where
+        they were used, so that evaluation can still report them.
+    folded: the node that was replaced, to fold it again when the values
+        of constants or the settings change.
+    '''
+
+    _fields = ('value',)
+    _attributes = ('lineno', 'col_offset', 'used_vars', 'folded')
+
+class Profiler:
+    '''
+    Call counts and cumulative time spent evaluating, per node type, per
+    called function and per label. Each entry is a [count, time] list that
+    is updated directly by the compiled closures.
+    '''
+
+    def __init__(self):
+        self._entries = {}
+
+    def get_entry(self, kind, name):
+        key = (kind, unicode(name))
+        entry = self._entries.get(key, None)
+        if entry is None:
+            entry = [0, 0.0]
+            self._entries[key] = entry
+        return entry
+
+    def wrap(self, func, kind, name):
+        '''Return closure <func> wrapped to update entry (kind, name).'''
+        entry = self.get_entry(kind, name)
+
+        def timed(state):
+            start = time.time()
+            try:
+                return func(state)
+            finally:
+                entry[0] += 1
+                entry[1] += time.time() - start
+
+        return timed
+
+    def reset(self):
+        for entry in self._entries.itervalues():
+            entry[0] = 0
+            entry[1] = 0.0
 
-        return _("No help about '%s' available, use help(index) for the index") % (topic)
+    def get_stats(self):
+        '''
+        Return a list of (kind, name, count, time) tuples, where kind is
+        'node', 'function' or 'label', sorted by decreasing time.
+        '''
+        stats = [(entry[1], kind, name, entry[0]) for \
+                 ((kind, name), entry) in self._entries.iteritems() \
+                 if entry[0] > 0]
+        stats.sort(reverse=True)
+        return [(kind, name, count, t) for (t, kind, name, count) in stats]
+
+    def format(self, max_items=10):
+        lines = []
+        for (kind, name, count, t) in self.get_stats()[:max_items]:
+            lines.append(_('%s %s: %d calls, %.3f ms') % \
+                         (kind, name, count, t * 1000))
+        return '\n'.join(lines)
 
 class EvalState:
     '''
     Evaluation state.
 
-    level: the current depth of recursion.
-    branch_vars: the variables used in this branch.
-    used_vars_ofs: dictionary of first offset where a variable is used.
+    branch_vars: the labels currently being evaluated, used to detect
+        recursion.
+    used_vars_ofs: dictionary of first offset where a variable is used in
+        the equation being evaluated.
+    steps: number of evaluation steps (operations, calls and labels) taken.
+    max_steps: maximum number of steps, or None.
+    deadline: time after which evaluation is aborted, or None.
     '''
 
-    def __init__(self):
-        self.level = 0
+    # Number of steps between checks of the budgets
+    CHECK_STEPS = 1000
+
+    def __init__(self, max_steps=None, max_time=None):
         self.branch_vars = []
         self.used_var_ofs = {}
+        self.set_budget(max_steps, max_time)
+
+    def set_budget(self, max_steps=None, max_time=None):
+        '''Reset the step counter and set the budgets for an evaluation.'''
+        self.steps = 0
+        self.next_check = 0
+        self.max_steps = max_steps
+        if max_time is not None:
+            self.deadline = time.time() + max_time
+        else:
+            self.deadline = None
+
+    def check(self, ofs):
+        '''
+        Raise a BudgetError at offset <ofs> if a budget is exceeded. Called
+        by the evaluation steps when steps reaches next_check.
+        '''
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise BudgetError(_('Calculation too complex'), ofs)
+        if self.deadline is not None and time.time() > self.deadline:
+            raise BudgetError(_('Calculation took too long'), ofs)
+
+        self.next_check = self.steps + self.CHECK_STEPS
+        if self.max_steps is not None:
+            self.next_check = min(self.next_check, self.max_steps + 1)
+
+    def charge(self, steps, ofs=0):
+        '''
+        Count <steps> steps that were taken outside the compiled closures,
+        e.g. for evaluating over an array, and check the budgets.
+        '''
+        self.steps += steps
+        if self.steps >= self.next_check:
+            self.check(ofs)
 
 class AstParser:
     '''
@@ -243,10 +582,64 @@ class AstParser:
         'False': False,
     }
 
+    # Maximum number of equations kept in the parse cache
+    PARSE_CACHE_SIZE = 512
+
+    # Fold constant subtrees of parsed equations
+    OPTIMIZE = True
+
+    # set_precision() uses floats up to this many digits, and calculates
+    # PRECISION_GUARD_DIGITS more digits than requested beyond that.
+    FLOAT_DIGITS = 15
+    PRECISION_GUARD_DIGITS = 3
+
+    # Constants that are replaced by Decimals by set_precision()
+    _PRECISE_CONSTANTS = {
+        u'pi': decimalmath.pi,
+        u'e': decimalmath.e,
+    }
+
+    # Evaluation budgets, None means unlimited: the number of steps, the
+    # time in seconds, the estimated size in bits of exact results of e.g.
+    # pow and factorial, and the depth of labels referring to labels whose
+    # results can not be cached.
+    MAX_STEPS = 1000000
+    MAX_TIME = 10.0
+    MAX_RESULT_BITS = 4000000
+    MAX_LABEL_DEPTH = 100
+
+    # Types of plug-in values that may be folded into a constant
+    _FOLD_TYPES = PluginRegistry.FOLD_TYPES
+
     def __init__(self, ml=None, pl=None):
         self._namespace = {}
-        self._immutable_vars = []
+        self._names_cache = {}
+        self._name_trie = None
+        self._completions = None
+        self._immutable_vars = set()
+        self._foldable_vars = {}
+        self._pure_funcs = frozenset()
+        self._impure_vars = set([u'help', u'plot', u'profile'])
+        self._random_funcs = frozenset()
+        self._result_bits = {}
+
+        # Profiling compiles trees with timing wrappers, which are stored
+        # under a different attribute than the normal closures.
+        self.profiler = Profiler()
+        self._profiling = False
+        self._compiled_attr = '_compiled'
+
+        # Dependency graph of labels: the names each label refers to and the
+        # labels referring to each name, plus cached label results.
+        self._label_deps = {}
+        self._label_dependents = {}
+        self._label_values = {}
+        self._label_cacheable = {}
         self._used_var_ofs = {}
+        self._parse_cache = LRUCache(self.PARSE_CACHE_SIZE)
+
+        # Values of the constants set by set_precision()
+        self._precise_values = {}
 
         if ml is None:
             self.ml = MathLib()
@@ -260,6 +653,7 @@ class AstParser:
 
         for key, val in self.BUILTIN_VARS.iteritems():
             self.set_var(key, val, immutable=True)
+            self._foldable_vars[unicode(key)] = val
 
         # Help manager
         self._helper = Helper(self)
@@ -273,6 +667,9 @@ class AstParser:
         self.set_var('plot', self.pl.plot, immutable=True)
         self._helper.add_help('plot', PLOTHELP)
 
+        self.set_var('profile', self._profile, immutable=True)
+        self._helper.add_help('profile', PROFILEHELP)
+
         self._load_plugins()
 
         # Redirect operations to registered functions
@@ -283,27 +680,19 @@ class AstParser:
             if type(val) is types.StringType:
                 self.BINOP_MAP[key] = self.get_var(val)
 
-    def _load_plugin_items(self, items):
-        for name, item in items:
-            if name.startswith('_') or type(item) is types.ModuleType:
-                continue
-
-            self.set_var(name, item)
-            if type(item) in (types.FunctionType, types.ClassType):
-                if item.__doc__ is not None:
-                    self._helper.add_help(name, item.__doc__)
-
     def _load_plugins(self):
-        plugins = ('functions', 'constants')
-        for plugin in plugins:
-            try:
-                exec('import %s' % plugin)
-                exec('_mod = %s' % plugin)
-                items = inspect.getmembers(_mod)
-                self._load_plugin_items(items)
-
-            except Exception, e:
-                logging.error('Error loading plugin: %s', e)
+        registry = get_plugin_registry()
+        for name, item in registry.namespace.iteritems():
+            if name not in self._immutable_vars:
+                self._namespace[name] = item
+        self._names_cache = {}
+        self._name_trie = None
+        self._foldable_vars.update(registry.foldable)
+        self._impure_vars.update(registry.impure)
+        self._pure_funcs = registry.pure_funcs
+        self._random_funcs = registry.random_funcs
+        self._result_bits = registry.result_bits
+        self._helper.set_shared_topics(registry.topics)
 
     def log_debug_info(self):
         logging.debug('Variables:')
@@ -320,20 +709,260 @@ class AstParser:
             logging.debug('    %s', op)
 
     def set_var(self, name, value, immutable=False):
-        '''Set variable <name> to <value>, which could be a function too.'''
+        '''
+        Set variable <name> to <value>, which could be a function too.
+
+        If <value> is a parse tree, <name> becomes a label that is evaluated
+        when referenced. A RuntimeError is raised if that would cause
+        recursion.
+        '''
         name = unicode(name)
         if name in self._immutable_vars:
             return False
-        self._namespace[unicode(name)] = value
+
+        if type(value) in (ast.Expression, ast.Expr):
+            deps = self._get_tree_names(value)
+            ofs = self._find_cycle(name, deps)
+            if ofs is not None:
+                raise RuntimeError(
+                    _('Can not assign label: will cause recursion'), ofs)
+        else:
+            deps = None
+        self._set_label_deps(name, deps)
+        self._invalidate_label(name)
+
+        old_value = self._namespace.get(name, None)
+        is_new = name not in self._namespace
+        self._namespace[name] = value
+        if self._names_cache:
+            self._names_cache = {}
+        if self._name_trie is not None and (is_new or \
+                type(old_value) is types.ClassType or \
+                type(value) is types.ClassType):
+            self._update_name_trie(name, old_value, value)
+
+        # A redefined plug-in value can no longer be folded, and cached
+        # trees and labels might contain the old one.
+        if name in self._foldable_vars and \
+                self._foldable_vars[name] is not value:
+            del self._foldable_vars[name]
+            self._parse_cache.clear()
+            self._refold_labels()
+
         if immutable:
-            self._immutable_vars.append(name)
+            self._immutable_vars.add(name)
         return True
 
+    def _get_tree_names(self, tree):
+        '''Return a dictionary of names used in <tree> and their offsets.'''
+
+        names = {}
+        def add(name, ofs):
+            name = unicode(name)
+            if name not in names or ofs < names[name]:
+                names[name] = ofs
+
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if type(node) is types.ListType:
+                stack.extend(node)
+                continue
+            elif not isinstance(node, ast.AST):
+                continue
+
+            if isinstance(node, ast.Name):
+                add(node.id, node.col_offset)
+            elif isinstance(node, Const) and node.used_vars:
+                for name, ofs in node.used_vars.iteritems():
+                    add(name, ofs)
+            for field in node._fields:
+                stack.append(getattr(node, field, None))
+
+        return names
+
+    def _find_cycle(self, name, deps):
+        '''
+        Return the offset of the first name in <deps> through which label
+        <name> would end up referring to itself, or None.
+        '''
+
+        # Walk backwards over everything that depends on <name>: usually
+        # little or nothing for a new label.
+        dependents = set()
+        stack = [name]
+        while stack:
+            item = stack.pop()
+            if item in dependents:
+                continue
+            dependents.add(item)
+            stack.extend(self._label_dependents.get(item, ()))
+
+        ret = None
+        for dep, ofs in deps.iteritems():
+            if dep in dependents and (ret is None or ofs < ret):
+                ret = ofs
+        return ret
+
+    def _set_label_deps(self, name, deps):
+        for dep in self._label_deps.pop(name, ()):
+            self._label_dependents[dep].discard(name)
+
+        if deps is not None:
+            self._label_deps[name] = set(deps.keys())
+            for dep in deps:
+                self._label_dependents.setdefault(dep, set()).add(name)
+
+    def _invalidate_label(self, name):
+        '''Drop cached results of <name> and all labels depending on it.'''
+
+        stack = [name]
+        visited = set()
+        while stack:
+            item = stack.pop()
+            if item in visited:
+                continue
+            visited.add(item)
+            self._label_values.pop(item, None)
+            self._label_cacheable.pop(item, None)
+            stack.extend(self._label_dependents.get(item, ()))
+
+    def _is_cacheable(self, name):
+        '''
+        Return whether the result of label <name> can be cached, which is not
+        the case when it depends on random or angle dependent functions.
+        '''
+
+        ret = self._label_cacheable.get(name, None)
+        if ret is not None:
+            return ret
+
+        ret = True
+        for dep in self._label_deps.get(name, ()):
+            if dep in self._impure_vars or \
+                    (dep in self._label_deps and not self._is_cacheable(dep)):
+                ret = False
+                break
+
+        self._label_cacheable[name] = ret
+        return ret
+
+    def get_tree_key(self, tree, exclude=()):
+        '''
+        Return a string identifying <tree> together with the current values
+        of the names it uses, including labels it refers to. Names in
+        <exclude> are left out. Returns None if the tree uses a random
+        function, so its result can not be reused.
+        '''
+
+        parts = [ast.dump(tree)]
+        seen = set([unicode(name) for name in exclude])
+        todo = [tree]
+        while todo:
+            names = self._get_tree_names(todo.pop()).keys()
+            names.sort()
+            for name in names:
+                if name in seen:
+                    continue
+                seen.add(name)
+                if name in self._random_funcs:
+                    return None
+
+                val = self._namespace.get(name, None)
+                if type(val) in (ast.Expression, ast.Expr):
+                    parts.append('%s=%s' % (name, ast.dump(val)))
+                    todo.append(val)
+                elif type(val) in (types.FunctionType, types.MethodType):
+                    parts.append('%s=%s' % (name, val.__name__))
+                else:
+                    parts.append('%s=%r' % (name, val))
+
+        return '\n'.join(parts)
+
+    def get_label_dependents(self, name):
+        '''Return the names of labels that refer to <name> directly.'''
+        return sorted(self._label_dependents.get(unicode(name), ()))
+
+    def get_label_cycle_ofs(self, name, tree):
+        '''
+        Return the offset in <tree> that would cause recursion if it was
+        assigned to label <name>, or None.
+        '''
+        return self._find_cycle(unicode(name), self._get_tree_names(tree))
+
+    def _eval_label_deps(self, name, state):
+        '''
+        Evaluate the uncached labels that label <name> refers to, directly or
+        indirectly, deepest first. Each of them then finds the labels it uses
+        in the cache, so that long chains of labels do not nest.
+        '''
+
+        order = []
+        seen = set([name])
+        stack = [(name, iter(self._label_deps.get(name, ())))]
+        while stack:
+            (item, deps) = stack[-1]
+            for dep in deps:
+                if dep not in seen and dep in self._label_deps and \
+                        dep not in self._label_values:
+                    seen.add(dep)
+                    stack.append((dep, iter(self._label_deps[dep])))
+                    break
+            else:
+                stack.pop()
+                order.append(item)
+
+        # The last item is <name> itself. Errors are left to the evaluation
+        # of <name>, which might not use the label with the error.
+        for dep in order[:-1]:
+            if not self._is_cacheable(dep):
+                continue
+            try:
+                self._eval_label(dep, self._namespace[dep], state)
+            except ParserError, e:
+                logging.debug('error in label %s: %r', dep, e)
+
+    def _eval_label(self, name, tree, state):
+        '''Evaluate label <name>, using the cached result if possible.'''
+
+        if name in self._label_values:
+            return self._label_values[name]
+
+        if not state.branch_vars:
+            self._eval_label_deps(name, state)
+
+        if self.MAX_LABEL_DEPTH is not None and \
+                len(state.branch_vars) >= self.MAX_LABEL_DEPTH:
+            raise BudgetError(_('Too many nested labels'), 0)
+
+        # Offsets of names used by the label refer to a different equation,
+        # so they are not recorded.
+        used_var_ofs = state.used_var_ofs
+        state.used_var_ofs = {}
+        state.branch_vars.append(name)
+        try:
+            val = self._get_compiled(tree)(state)
+        finally:
+            state.branch_vars.pop()
+            state.used_var_ofs = used_var_ofs
+
+        if val is not None and self._is_cacheable(name):
+            self._label_values[name] = val
+        return val
+
     def get_var(self, name):
         '''Return variable value, or None if non-existent.'''
         return self._namespace.get(unicode(name), None)
 
     def _get_names(self, start='', include_vars=True):
+        key = (start, include_vars)
+        ret = self._names_cache.get(key, None)
+        if ret is None:
+            ret = self._find_names(start, include_vars)
+            self._names_cache[key] = ret
+        return list(ret)
+
+    def _find_names(self, start, include_vars):
         ret = []
         for key, val in self._namespace.iteritems():
             if type(val) is types.ClassType:
@@ -357,14 +986,71 @@ class AstParser:
         ret.sort()
         return ret
 
+    # Ranks of names for completion: user variables and labels first
+    _RANK_USER = 0
+    _RANK_PLUGIN = 1
+    _RANK_MEMBER = 2
+
+    def _get_name_rank(self, name):
+        if name in self._immutable_vars or \
+                name in get_plugin_registry().namespace:
+            return self._RANK_PLUGIN
+        return self._RANK_USER
+
+    def _update_name_trie(self, name, old_value, value):
+        trie = self._name_trie
+        if type(old_value) is types.ClassType:
+            for member in dir(old_value):
+                trie.remove(u'%s.%s' % (name, member))
+        trie.add(name, self._get_name_rank(name))
+        if type(value) is types.ClassType:
+            for member in dir(value):
+                if not member.startswith('_'):
+                    trie.add(u'%s.%s' % (name, member), self._RANK_MEMBER)
+
+    def _get_completions(self, start):
+        '''
+        Return a (names, index) tuple with the names starting with <start>
+        and a dictionary of their positions. The last result is cached.
+        '''
+
+        if self._name_trie is None:
+            self._name_trie = NameTrie()
+            for (name, value) in self._namespace.iteritems():
+                self._update_name_trie(name, None, value)
+
+        version = self._name_trie.version
+        if self._completions is not None and \
+                self._completions[0] == (start, version):
+            return self._completions[1]
+
+        names = self._name_trie.find(unicode(start))
+        index = dict([(name, i) for (i, name) in enumerate(names)])
+        self._completions = ((start, version), (names, index))
+        return (names, index)
+
     def get_names(self, start=''):
-        '''Return a list with names of all defined variables/functions.'''
-        ret = []
-        for key, val in self._namespace.iteritems():
-            if key.startswith(start):
-                ret.append(key)
+        '''
+        Return a list with names of all defined variables/functions starting
+        with <start>, including class members such as physics.c. User
+        variables come first, then plug-in names and then members, each
+        ordered by length.
+        '''
+        return list(self._get_completions(start)[0])
 
-        return ret
+    def get_next_name(self, start, current=None):
+        '''
+        Return the name after <current> in get_names(<start>), for cycling
+        through completions, or the first name if <current> is not one of
+        them. Returns None if there are no completions.
+        '''
+        (names, index) = self._get_completions(start)
+        if len(names) == 0:
+            return None
+        i = index.get(current, None)
+        if i is None:
+            return names[0]
+        return names[(i + 1) % len(names)]
 
     def get_variable_names(self, start=''):
         '''Return a list with names of all defined variables.'''
@@ -375,7 +1061,7 @@ class AstParser:
         return self._get_names(start, include_vars=False)
 
     def add_help(self, topic, text):
-        self._help_topics[topic] = text
+        self._helper.add_help(topic, text)
 
     def get_diadic_operators(self):
         return self.DIADIC_OPS
@@ -386,150 +1072,433 @@ class AstParser:
     def get_pre_operators(self):
         return self.PRE_OPS
 
-    def _resolve_arg(self, func, index, arg, state):
-        funcarg = (func, index)
-        if funcarg in self._special_func_args:
-            val = self._special_func_args[funcarg]
-            if val == self._ARG_NODE:
-                return arg
-            if val == self._ARG_STRING:
-                if isinstance(arg, ast.Name):
-                    return arg.id
-                elif isinstance(arg, ast.Str):
-                    return arg.s
-                else:
-                    logging.error('Unable to resolve special arg %r', arg)
-        else:
-            return self._process_node(arg, state)
+    def _get_compiled(self, tree):
+        '''
+        Return the compiled closure for <tree>, compiling it on first use.
+        The closure is stored on the tree node itself, so trees that are
+        evaluated repeatedly (labels, plots) are only compiled once.
+        '''
+        func = getattr(tree, self._compiled_attr, None)
+        if func is None:
+            func = self.compile_tree(tree)
+            setattr(tree, self._compiled_attr, func)
+        return func
 
-    def _process_node(self, node, state, isfunc=False):
-        # Copy state, list objects will remain the same
-        state = copy.copy(state)
-        state.level += 1
-        ofs = getattr(node, 'col_offset', 0)
+    def compile_tree(self, node, isfunc=False):
+        '''
+        Compile an ast tree into a tree of closures. Every closure takes an
+        EvalState and returns the value of its node. Operator functions,
+        constants and special function arguments are bound at compile time,
+        variables are looked up in the namespace at evaluation time.
+
+        When profiling, every closure is wrapped to record its time.
+        '''
 
+        func = self._compile_node(node, isfunc)
+        if self._profiling and node is not None:
+            func = self.profiler.wrap(func, 'node', type(node).__name__)
+        return func
+
+    def _compile_node(self, node, isfunc):
         if node is None:
-            return None
+            return lambda state: None
 
         elif isinstance(node, ast.Expression):
-            return self._process_node(node.body, state)
+            return self.compile_tree(node.body)
 
         elif isinstance(node, ast.Expr):
-            return self._process_node(node.value, state)
+            return self.compile_tree(node.value)
 
         elif isinstance(node, ast.BinOp):
-            left = self._process_node(node.left, state)
-            right = self._process_node(node.right, state)
+            return self._compile_binop(node)
+
+        elif isinstance(node, ast.UnaryOp):
+            return self._compile_unaryop(node)
+
+        elif isinstance(node, ast.Compare):
+            return self._compile_compare(node)
+
+        elif isinstance(node, ast.Call):
+            return self._compile_call(node)
+
+        elif isinstance(node, ast.Num):
+            if type(node.n) == types.FloatType:
+                val = decimal.Decimal(str(node.n))
+            else:
+                val = node.n
+            return lambda state: val
+
+        elif isinstance(node, ast.Str):
+            val = node.s
+            return lambda state: val
+
+        elif isinstance(node, Const):
+            return self._compile_const(node)
+
+        elif isinstance(node, ast.Tuple):
+            elts = [self.compile_tree(i) for i in node.elts]
+            return lambda state: tuple([f(state) for f in elts])
+
+        elif isinstance(node, ast.Name):
+            return self._compile_name(node, isfunc)
+
+        elif isinstance(node, ast.Attribute):
+            return self._compile_attribute(node)
+
+        logging.debug('Unknown node: %r', repr(node))
+        return lambda state: None
+
+    def _compile_const(self, node):
+        val = node.value
+        used_vars = getattr(node, 'used_vars', None)
+        if not used_vars:
+            return lambda state: val
+
+        def const(state):
+            used = state.used_var_ofs
+            for name, ofs in used_vars.iteritems():
+                if name not in used or ofs < used[name]:
+                    used[name] = ofs
+            return val
+
+        return const
+
+    def _is_too_large(self, func, args):
+        '''
+        Return whether the estimated result of func(*args) exceeds
+        MAX_RESULT_BITS.
+        '''
+        try:
+            estimate = self._result_bits.get(func, None)
+        except TypeError:
+            return False
+        if estimate is None or self.MAX_RESULT_BITS is None:
+            return False
+
+        try:
+            bits = estimate(*args)
+        except Exception:
+            # Leave reporting invalid arguments to the function itself
+            return False
+        return bits is not None and bits > self.MAX_RESULT_BITS
+
+    def _compile_binop(self, node):
+        func = self.BINOP_MAP[type(node.op)]
+        left_func = self.compile_tree(node.left)
+        right_func = self.compile_tree(node.right)
+        ofs = node.right.col_offset - 1
+        check_size = func in self._result_bits
+
+        def binop(state):
+            left = left_func(state)
+            right = right_func(state)
             if left is None or right is None:
                 return None
-            func = self.BINOP_MAP[type(node.op)]
+
+            state.steps += 1
+            if state.steps >= state.next_check:
+                state.check(ofs)
+            if check_size and self._is_too_large(func, (left, right)):
+                raise BudgetError(_('Result too large'), ofs)
+
             try:
                 return func(left, right)
             except Exception, e:
-                raise RuntimeError(str(e), node.right.col_offset - 1)
+                raise RuntimeError(str(e), ofs)
 
-        elif isinstance(node, ast.UnaryOp):
-            operand = self._process_node(node.operand, state)
+        return binop
+
+    def _compile_unaryop(self, node):
+        func = self.UNARYOP_MAP[type(node.op)]
+        operand_func = self.compile_tree(node.operand)
+
+        def unaryop(state):
+            operand = operand_func(state)
             if operand is None:
                 return None
-            func = self.UNARYOP_MAP[type(node.op)]
             return func(operand)
 
-        elif isinstance(node, ast.Compare):
-            left = self._process_node(node.left, state)
-            right = self._process_node(node.comparators[0], state)
-            func = self.CMPOP_MAP[type(node.ops[0])]
-            return func(left, right)
+        return unaryop
+
+    def _compile_compare(self, node):
+        func = self.CMPOP_MAP[type(node.ops[0])]
+        left_func = self.compile_tree(node.left)
+        right_func = self.compile_tree(node.comparators[0])
+        return lambda state: func(left_func(state), right_func(state))
+
+    def _compile_special_arg(self, kind, arg):
+        if kind == self._ARG_NODE:
+            return lambda state: arg
+        if kind == self._ARG_STRING:
+            if isinstance(arg, ast.Name):
+                val = arg.id
+            elif isinstance(arg, ast.Str):
+                val = arg.s
+            else:
+                logging.error('Unable to resolve special arg %r', arg)
+                val = None
+            return lambda state: val
 
-        elif isinstance(node, ast.Call):
-            func = self._process_node(node.func, state, isfunc=True)
+    def _compile_call(self, node):
+        func_func = self.compile_tree(node.func, isfunc=True)
+        ofs = getattr(node, 'col_offset', 0)
+
+        # Special arguments only apply to immutable functions (help, plot),
+        # so they can be resolved now.
+        special = None
+        if isinstance(node.func, ast.Name) and \
+                unicode(node.func.id) in self._immutable_vars:
+            special = self.get_var(node.func.id)
+
+        arg_funcs = []
+        for i, arg in enumerate(node.args):
+            kind = self._special_func_args.get((special, i), None)
+            if kind is not None:
+                arg_funcs.append(self._compile_special_arg(kind, arg))
+            else:
+                arg_funcs.append(self.compile_tree(arg))
+
+        kwarg_funcs = [(kw.arg, self.compile_tree(kw.value)) \
+                       for kw in node.keywords]
+
+        entry = None
+        if self._profiling and isinstance(node.func, ast.Name):
+            entry = self.profiler.get_entry('function', node.func.id)
+
+        def call(state):
+            func = func_func(state)
             if func is None:
                 return None
 
-            args = [self._resolve_arg(func, i, node.args[i], state) \
-                    for i in range(len(node.args))]
+            args = [f(state) for f in arg_funcs]
 
             kwargs = {}
-            for i in range(len(node.keywords)):
-                key = node.keywords[i].arg
-                val = self._process_node(node.keywords[i].value, state)
+            for key, val_func in kwarg_funcs:
+                val = val_func(state)
                 if key is None or val is None:
                     return None
                 kwargs[key] = val
 
+            state.steps += 1
+            if state.steps >= state.next_check:
+                state.check(ofs)
+            if self._is_too_large(func, args):
+                raise BudgetError(_('Result too large'), ofs)
+
             try:
-                ret = func(*args, **kwargs)
-                return ret
+                if entry is None:
+                    return func(*args, **kwargs)
+                start = time.time()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    entry[0] += 1
+                    entry[1] += time.time() - start
             except Exception, e:
-                msg = str(e)
-                raise RuntimeError(msg, ofs)
+                raise RuntimeError(str(e), ofs)
 
-        elif isinstance(node, ast.Num):
-            if type(node.n) == types.FloatType:
-                val = decimal.Decimal(str(node.n))
-                return val
-            return node.n
+        return call
 
-        elif isinstance(node, ast.Str):
-            return node.s
+    def _compile_name(self, node, isfunc):
+        name = node.id
+        ofs = getattr(node, 'col_offset', 0)
 
-        elif isinstance(node, ast.Tuple):
-            list = [self._process_node(i, state) for i in node.elts]
-            return tuple(list)
+        if not isfunc and name in ('help', _('help')):
+            get_help = self._helper.get_help
+            return lambda state: get_help()
 
-        elif isinstance(node, ast.Name):
-            if not isfunc and node.id in ('help', _('help')):
-                return self._helper.get_help()
-
-            elif node.id in self._namespace:
-                if not isfunc:
-                    # Check whether variable was already used in this branch
-                    if node.id in state.branch_vars:
-                        raise RuntimeError(_('Recursion detected'), ofs)
-                    state.branch_vars = copy.copy(state.branch_vars)
-
-                    # Update where variable is first used
-                    if node.id not in state.used_var_ofs.keys():
-                        state.used_var_ofs[node.id] = node.col_offset
-                    elif node.col_offset < state.used_var_ofs[node.id]:
-                        state.used_var_ofs[node.id] = node.col_offset
+        namespace = self._namespace
+        entry = None
+        if self._profiling and not isfunc:
+            entry = self.profiler.get_entry('label', name)
+        if isfunc:
+            msg = _("Function '%s' not defined") % (name)
+        else:
+            msg = _("Variable '%s' not defined") % (name)
 
-                var = self.get_var(node.id)
+        def lookup(state):
+            try:
+                var = namespace[name]
+            except KeyError:
+                raise UndefinedError(msg, ofs, end=ofs + len(name))
+
+            if not isfunc:
+                # Check whether variable was already used in this branch
+                if name in state.branch_vars:
+                    raise RuntimeError(_('Recursion detected'), ofs)
+
+                # Update where variable is first used
+                used = state.used_var_ofs
+                if name not in used or ofs < used[name]:
+                    used[name] = ofs
+
+            if type(var) not in (ast.Expression, ast.Expr):
+                return var
+
+            state.steps += 1
+            if state.steps >= state.next_check:
+                state.check(ofs)
+
+            try:
+                if entry is None:
+                    return self._eval_label(name, var, state)
+                start = time.time()
                 try:
-                    if type(var) is ast.Expression:
-                        return self._process_node(var.body, state)
-                    elif type(var) is ast.Expr:
-                        return self._process_node(var.value, state)
-                    else:
-                        return var
-                except ParserError, e:
-                    logging.debug('error: %r', e)
-                    e.set_range(ofs, ofs + len(node.id))
-                    raise e
+                    return self._eval_label(name, var, state)
+                finally:
+                    entry[0] += 1
+                    entry[1] += time.time() - start
+            except ParserError, e:
+                logging.debug('error: %r', e)
+                e.set_range(ofs, ofs + len(name))
+                raise e
+
+        return lookup
+
+    def _compile_attribute(self, node):
+        parent_func = self.compile_tree(node.value)
+        attr = node.attr
+        ofs = getattr(node, 'col_offset', 0)
 
-            else:
-                if isfunc:
-                    msg = _("Function '%s' not defined") % (node.id)
-                else:
-                    msg = _("Variable '%s' not defined") % (node.id)
-                raise RuntimeError(msg, ofs, ofs + len(node.id))
+        def attribute(state):
+            parent = parent_func(state)
+            if not parent:
+                return None
+            try:
+                return parent.__dict__[attr]
+            except Exception, e:
+                msg = _("Attribute '%s' does not exist") % attr
+                raise RuntimeError(msg, ofs, end=ofs + len(attr))
 
-        elif isinstance(node, ast.Attribute):
-            parent = self._process_node(node.value, state)
-            if parent:
+        return attribute
+
+    def _get_compiled_vector(self, tree, var):
+        '''
+        Return the closure compiled by _compile_vector() for <tree> and
+        <var>, or None if the tree can not be vectorized. As with
+        _get_compiled(), the result is stored on the tree.
+        '''
+
+        cache = getattr(tree, '_compiled_vector', None)
+        if cache is None:
+            cache = {}
+            tree._compiled_vector = cache
+        if var not in cache:
+            try:
+                cache[var] = self._compile_vector(tree, var)
+            except _NotVectorizable, e:
+                logging.debug('Unable to vectorize %r: %s', tree, e)
+                cache[var] = None
+        return cache[var]
+
+    def _compile_vector(self, node, var):
+        '''
+        Compile an ast tree into a closure that takes an array of values for
+        variable <var> and returns an array of results. Names are looked up
+        when the closure is called, so that it can be reused.
+        '''
+
+        if isinstance(node, ast.Expression):
+            return self._compile_vector(node.body, var)
+
+        elif isinstance(node, ast.Expr):
+            return self._compile_vector(node.value, var)
+
+        elif isinstance(node, (ast.Num, Const)):
+            isconst, val = self._get_const(node)
+            if type(val) in (types.StringType, types.UnicodeType):
+                raise _NotVectorizable('string constant')
+            val = float(val)
+            return lambda x: val
+
+        elif isinstance(node, ast.Name):
+            name = node.id
+            if name == var:
+                return lambda x: x
+
+            def lookup(x):
+                val = self.get_var(name)
+                if type(val) in (ast.Expression, ast.Expr):
+                    func = self._get_compiled_vector(val, var)
+                    if func is None:
+                        raise _NotVectorizable('label %s' % name)
+                    return func(x)
                 try:
-                    val = parent.__dict__[node.attr]
-                    return val
-                except Exception, e:
-                    msg = _("Attribute '%s' does not exist") % node.value
-                    raise RuntimeError(msg, ofs, ofs + len(node.value))
+                    return float(val)
+                except Exception:
+                    raise _NotVectorizable('variable %s' % name)
+            return lookup
 
+        elif isinstance(node, ast.BinOp):
+            func = vecfunctions.OPERATORS.get(self.BINOP_MAP[type(node.op)])
+            if func is None:
+                raise _NotVectorizable('operator %r' % node.op)
+            left = self._compile_vector(node.left, var)
+            right = self._compile_vector(node.right, var)
+            return lambda x: func(left(x), right(x))
+
+        elif isinstance(node, ast.UnaryOp):
+            operand = self._compile_vector(node.operand, var)
+            if isinstance(node.op, ast.USub):
+                return lambda x: vecfunctions.numpy.negative(operand(x))
+            elif isinstance(node.op, ast.UAdd):
+                return operand
+            raise _NotVectorizable('operator %r' % node.op)
+
+        elif isinstance(node, ast.Compare):
+            func = self.CMPOP_MAP[type(node.ops[0])]
+            left = self._compile_vector(node.left, var)
+            right = self._compile_vector(node.comparators[0], var)
+            return lambda x: func(left(x), right(x))
+
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or len(node.args) != 1 or \
+                    len(node.keywords) > 0:
+                raise _NotVectorizable('call')
+            name = node.func.id
+            arg = self._compile_vector(node.args[0], var)
+
+            def call(x):
+                func = vecfunctions.FUNCTIONS.get(self.get_var(name))
+                if func is None:
+                    raise _NotVectorizable('function %s' % name)
+                return func(arg(x))
+            return call
+
+        raise _NotVectorizable('node %r' % node)
+
+    def evaluate_vector(self, tree, var, values):
+        '''
+        Evaluate <tree> for all <values> of variable <var> at once, using
+        NumPy. Returns an array of floats, or None if NumPy is not available
+        or the tree can not be evaluated this way. Invalid results, e.g.
+        outside the domain of a function, are nan or inf.
+        '''
+
+        if not vecfunctions.HAVE_NUMPY:
             return None
 
-        else:
-            logging.debug('Unknown node: %r', repr(node))
+        func = self._get_compiled_vector(tree, var)
+        if func is None:
+            return None
 
-        return None
+        numpy = vecfunctions.numpy
+        try:
+            values = numpy.asarray(values, dtype=float)
+            olderr = numpy.seterr(all='ignore')
+            try:
+                ret = func(values)
+            finally:
+                numpy.seterr(**olderr)
+            ret = numpy.asarray(ret, dtype=float)
+        except Exception, e:
+            logging.debug('Unable to vectorize %r: %s', tree, e)
+            return None
+
+        # Results that do not depend on <var> are scalars
+        if ret.shape != values.shape:
+            ret = ret + numpy.zeros(values.shape)
+        return ret
 
     def walk_replace_node(self, node, func, level=0):
         '''
@@ -542,6 +1511,11 @@ class AstParser:
         items only.
         '''
 
+        # The tree is about to change, drop its compiled closures
+        for attr in ('_compiled', '_compiled_profile', '_compiled_vector'):
+            if hasattr(node, attr):
+                delattr(node, attr)
+
         if hasattr(node, '_fields') and node._fields is not None:
             for field in node._fields:
                 fieldval = getattr(node, field)
@@ -550,15 +1524,40 @@ class AstParser:
                 if ret is not None:
                     setattr(node, field, ret)
 
+    def copy_tree(self, node):
+        '''
+        Return a copy of an ast tree that can be changed without affecting
+        the original, e.g. one that is shared through the parse cache.
+        '''
+
+        if type(node) is types.ListType:
+            return [self.copy_tree(i) for i in node]
+        if not isinstance(node, ast.AST):
+            return node
+
+        ret = type(node)()
+        for field in node._fields:
+            if hasattr(node, field):
+                setattr(ret, field, self.copy_tree(getattr(node, field)))
+        for attr in node._attributes:
+            if hasattr(node, attr):
+                setattr(ret, attr, getattr(node, attr))
+        return ret
+
     def replace_variable(self, tree, var, replacement):
-        '''Replace ast.Name of name <var> with <replacement>.'''
+        '''
+        Replace ast.Name of name <var> with <replacement>. The tree is
+        copied first, the modified copy is returned.
+        '''
 
         def func(node, **kwargs):
             if isinstance(node, ast.Name) and node.id == var:
                 return replacement
             return None
 
+        tree = self.copy_tree(tree)
         self.walk_replace_node(tree, func)
+        return tree
 
     def print_tree(self, tree):
         '''Print an ast tree.'''
@@ -590,9 +1589,251 @@ class AstParser:
     def parse_symbolic(self, tree):
         '''
         Reduce an abstract syntax tree until it contains only numbers and
-        unresolved symbols.
+        unresolved symbols. The tree is copied first, the reduced copy is
+        returned.
         '''
+        tree = self.copy_tree(tree)
         self.walk_replace_node(tree, self._parse_func)
+        return tree
+
+    def _count_nodes(self, node):
+        if type(node) is types.ListType:
+            return sum([self._count_nodes(i) for i in node])
+        if not isinstance(node, ast.AST):
+            return 0
+
+        count = 0
+        if isinstance(node, ast.expr):
+            count = 1
+        for field in node._fields:
+            count += self._count_nodes(getattr(node, field, None))
+        return count
+
+    def _get_const(self, node):
+        '''Return (True, value) if <node> is a constant, (False, None) if not.'''
+        if isinstance(node, Const):
+            return True, node.value
+        elif isinstance(node, ast.Num):
+            if type(node.n) == types.FloatType:
+                return True, decimal.Decimal(str(node.n))
+            return True, node.n
+        return False, None
+
+    def _make_const(self, node, value, *children):
+        '''Return a Const node for <value> replacing <node>.'''
+        ret = Const()
+        ret.value = value
+        ret.folded = node
+        ret.used_vars = {}
+        for child in children:
+            used_vars = getattr(child, 'used_vars', None)
+            if used_vars:
+                ret.used_vars.update(used_vars)
+        return ast.copy_location(ret, node)
+
+    def _fold_children(self, node):
+        for field in node._fields:
+            val = getattr(node, field, None)
+            if type(val) is types.ListType:
+                setattr(node, field, [self._fold(i) for i in val])
+            elif isinstance(val, ast.AST):
+                setattr(node, field, self._fold(val))
+
+    def _fold(self, node):
+        '''Fold constant subtrees of <node>, return the replacement node.'''
+
+        if isinstance(node, ast.Call):
+            return self._fold_call(node)
+        elif not isinstance(node, ast.AST) or isinstance(node, Const):
+            return node
+
+        self._fold_children(node)
+
+        if isinstance(node, ast.BinOp):
+            return self._fold_binop(node)
+
+        elif isinstance(node, ast.UnaryOp):
+            isconst, operand = self._get_const(node.operand)
+            if isconst:
+                func = self.UNARYOP_MAP[type(node.op)]
+                return self._fold_value(node, func, (operand,), node.operand)
+
+        elif isinstance(node, ast.Compare):
+            isleft, left = self._get_const(node.left)
+            isright, right = self._get_const(node.comparators[0])
+            if isleft and isright:
+                func = self.CMPOP_MAP[type(node.ops[0])]
+                return self._fold_value(node, func, (left, right),
+                                        node.left, node.comparators[0])
+
+        elif isinstance(node, ast.Name):
+            name = unicode(node.id)
+            if name in self._foldable_vars and name not in self._pure_funcs:
+                ret = self._make_const(node, self._foldable_vars[name])
+                ret.used_vars[name] = node.col_offset
+                return ret
+
+        elif isinstance(node, ast.Attribute):
+            isconst, parent = self._get_const(node.value)
+            if isconst and type(parent) is types.ClassType:
+                val = parent.__dict__.get(node.attr, None)
+                if type(val) in self._FOLD_TYPES:
+                    return self._make_const(node, val, node.value)
+
+        return node
+
+    def _fold_value(self, node, func, args, *children):
+        '''
+        Return a Const node with the result of func(*args), or <node> if that
+        fails; the error will then be reported during evaluation.
+        '''
+        try:
+            val = func(*args)
+        except Exception, e:
+            logging.debug('Not folding %r: %s', node, e)
+            return node
+        if val is None:
+            return node
+        return self._make_const(node, val, *children)
+
+    # Mult/Div chains (a op1 c1) op2 c2 are rewritten to a op3 (c1 op4 c2)
+    _REASSOCIATE_MAP = {
+        (ast.Mult, ast.Mult): (ast.Mult, ast.Mult, False),
+        (ast.Mult, ast.Div): (ast.Mult, ast.Div, False),
+        (ast.Div, ast.Mult): (ast.Mult, ast.Div, True),
+        (ast.Div, ast.Div): (ast.Div, ast.Mult, False),
+    }
+
+    def _fold_binop(self, node):
+        isleft, left = self._get_const(node.left)
+        isright, right = self._get_const(node.right)
+        if isleft and isright:
+            func = self.BINOP_MAP[type(node.op)]
+            if self._is_too_large(func, (left, right)):
+                return node
+            return self._fold_value(node, func, (left, right),
+                                    node.left, node.right)
+
+        if not isright or not isinstance(node.left, ast.BinOp):
+            return node
+        key = (type(node.left.op), type(node.op))
+        if key not in self._REASSOCIATE_MAP:
+            return node
+        isinner, inner = self._get_const(node.left.right)
+        if not isinner:
+            return node
+
+        outer_op, const_op, swap = self._REASSOCIATE_MAP[key]
+        if swap:
+            args = (right, inner)
+        else:
+            args = (inner, right)
+        const = self._fold_value(node.right, self.BINOP_MAP[const_op], args,
+                                 node.left.right, node.right)
+        if not isinstance(const, Const):
+            return node
+
+        ret = ast.BinOp()
+        ret.left = node.left.left
+        ret.op = outer_op()
+        ret.right = const
+        return ast.copy_location(ret, node)
+
+    def _fold_call(self, node):
+        # Arguments that are passed as a string must stay a name
+        special = None
+        if isinstance(node.func, ast.Name) and \
+                unicode(node.func.id) in self._immutable_vars:
+            special = self.get_var(node.func.id)
+        for i, arg in enumerate(node.args):
+            kind = self._special_func_args.get((special, i), None)
+            if kind != self._ARG_STRING:
+                node.args[i] = self._fold(arg)
+        for kw in node.keywords:
+            kw.value = self._fold(kw.value)
+
+        if not isinstance(node.func, ast.Name) or \
+                unicode(node.func.id) not in self._pure_funcs or \
+                unicode(node.func.id) not in self._foldable_vars or \
+                getattr(node, 'starargs', None) is not None or \
+                getattr(node, 'kwargs', None) is not None:
+            return node
+
+        args = []
+        for arg in node.args:
+            isconst, val = self._get_const(arg)
+            if not isconst:
+                return node
+            args.append(val)
+        kwargs = {}
+        for kw in node.keywords:
+            isconst, val = self._get_const(kw.value)
+            if not isconst:
+                return node
+            kwargs[kw.arg] = val
+
+        func = self._foldable_vars[unicode(node.func.id)]
+        if self._is_too_large(func, args):
+            return node
+        children = list(node.args) + [kw.value for kw in node.keywords]
+        return self._fold_value(node, lambda *a: func(*a, **kwargs),
+                                args, *children)
+
+    def _unfold_tree(self, node):
+        '''
+        Return a copy of <node> in which the Const nodes are replaced by the
+        nodes they were folded from.
+        '''
+
+        if type(node) is types.ListType:
+            return [self._unfold_tree(i) for i in node]
+        if not isinstance(node, ast.AST):
+            return node
+        if isinstance(node, Const) and \
+                getattr(node, 'folded', None) is not None:
+            return self._unfold_tree(node.folded)
+
+        ret = type(node)()
+        for field in node._fields:
+            if hasattr(node, field):
+                setattr(ret, field, self._unfold_tree(getattr(node, field)))
+        for attr in node._attributes:
+            if hasattr(node, attr):
+                setattr(ret, attr, getattr(node, attr))
+        return ret
+
+    def _refold_labels(self):
+        '''
+        Fold the trees of all labels again, after the values of constants or
+        the settings that folding depends on changed.
+        '''
+
+        for name in self._label_deps.keys():
+            tree = self._namespace.get(name, None)
+            if type(tree) not in (ast.Expression, ast.Expr):
+                continue
+            tree = self._unfold_tree(tree)
+            if self.OPTIMIZE:
+                tree, removed = self.optimize_tree(tree)
+            self._namespace[name] = tree
+            self._invalidate_label(name)
+
+    def optimize_tree(self, tree):
+        '''
+        Fold constant subtrees of <tree> into Const nodes: arithmetic on
+        numbers, plug-in constants such as pi and physics.c, and calls to
+        pure plug-in functions with constant arguments. Variables, Ans,
+        random functions and functions depending on the angle setting are
+        left alone.
+
+        The tree is changed in place. Returns the optimized tree and the
+        number of nodes that were removed.
+        '''
+
+        before = self._count_nodes(tree)
+        tree = self._fold(tree)
+        removed = before - self._count_nodes(tree)
+        return tree, removed
 
     def _preprocess_eqn(self, eqn):
         eqn = unicode(eqn)
@@ -607,8 +1848,38 @@ class AstParser:
     def parse(self, eqn):
         '''
         Parse an equation and return a parse tree.
+
+        Parse trees and errors are cached per equation string. The returned
+        tree is shared with the cache and should not be changed in place,
+        use copy_tree() to get a private copy.
         '''
 
+        key = unicode(eqn)
+        entry = self._parse_cache.get(key)
+        if entry is None:
+            try:
+                tree = self._parse(eqn)
+                if self.OPTIMIZE:
+                    tree, removed = self.optimize_tree(tree)
+                    logging.debug('Optimizer removed %d nodes', removed)
+                entry = (tree, None)
+            except ParserError, e:
+                entry = (None, e)
+            self._parse_cache.set(key, entry)
+
+        tree, error = entry
+        if error is not None:
+            raise error
+        return tree
+
+    def get_parse_cache_stats(self):
+        '''Return hit, miss and eviction counters of the parse cache.'''
+        return self._parse_cache.get_stats()
+
+    def clear_parse_cache(self):
+        self._parse_cache.clear()
+
+    def _parse(self, eqn):
         eqn = self._preprocess_eqn(eqn)
         logging.debug('Parsing preprocessed equation: %r', eqn)
 
@@ -629,25 +1900,133 @@ class AstParser:
         if isinstance(tree, ast.Module):
             if len(tree.body) != 1:
                 msg = _("Multiple statements not supported")
-                raise ParseError(msg)
+                raise ParseError(msg, 0, eqn)
             return tree.body[0]
 
         return tree
 
-    def evaluate(self, eqn):
+    def set_profiling(self, enable):
+        '''
+        Turn profiling on or off. Turning it on clears the collected data,
+        which is available from the profiler attribute.
+        '''
+        enable = bool(enable)
+        if enable and not self._profiling:
+            self.profiler.reset()
+        self._profiling = enable
+        if enable:
+            self._compiled_attr = '_compiled_profile'
+        else:
+            self._compiled_attr = '_compiled'
+
+    def is_profiling(self):
+        return self._profiling
+
+    def get_profile_text(self):
+        '''Return a description of the profile for help(profile).'''
+        if self._profiling:
+            ret = _('Profiling is on, use profile(0) to turn it off.')
+        else:
+            ret = _('Profiling is off, use profile(1) to turn it on.')
+        stats = self.profiler.format()
+        if len(stats) > 0:
+            ret += '\n' + stats
+        return ret
+
+    def _profile(self, enable=None):
+        if enable is not None:
+            self.set_profiling(enable)
+        return self.get_profile_text()
+
+    def set_division_mode(self, exact, bit_limit):
+        '''
+        Set whether division of integers always gives an exact Rational
+        (functions.exact_division), and the number of bits after which a
+        Rational is approximated by a Decimal (None for no limit).
+
+        Cached parse trees and label values computed with the old settings
+        are dropped, and the constants in labels are folded again.
+        '''
+
+        functions.exact_division.value = bool(exact)
+        functions.rational_bit_limit.value = bit_limit
+        self.clear_parse_cache()
+        self._label_values.clear()
+        self._refold_labels()
+
+    def set_precision(self, digits):
+        '''
+        Calculate the elementary functions as Decimals to <digits>
+        significant digits (functions.precision), or with floats if
+        <digits> is None or at most FLOAT_DIGITS. The constants pi and e
+        become Decimals of the same precision, unless they were redefined.
+
+        Cached parse trees and label values are dropped, as in
+        set_division_mode().
+        '''
+
+        var = functions.precision
+        if digits is None or digits <= self.FLOAT_DIGITS:
+            prec = None
+        else:
+            prec = digits + self.PRECISION_GUARD_DIGITS
+        if prec == var.value:
+            return
+        var.value = prec
+
+        # Operators on Decimals use the precision of the current context
+        decimal.getcontext().prec = max(prec or 0,
+                                        decimal.DefaultContext.prec)
+
+        registry = get_plugin_registry()
+        for name, func in self._PRECISE_CONSTANTS.iteritems():
+            old = self._precise_values.get(name, registry.namespace.get(name))
+            if old is None or self._namespace.get(name, None) is not old:
+                continue
+            if prec is None:
+                value = registry.namespace[name]
+                self._precise_values.pop(name, None)
+            else:
+                value = func(prec)
+                self._precise_values[name] = value
+            self._namespace[name] = value
+            self._foldable_vars[name] = value
+
+        self.clear_parse_cache()
+        self._label_values.clear()
+        self._refold_labels()
+
+    def new_eval_state(self):
+        '''
+        Return an EvalState with the budgets MAX_STEPS and MAX_TIME, to share
+        them between several calls of evaluate().
+        '''
+        return EvalState(self.MAX_STEPS, self.MAX_TIME)
+
+    def evaluate(self, eqn, state=None):
         '''
         Evaluate an equation or parse tree.
+
+        Evaluation is aborted with a BudgetError if it exceeds one of the
+        budgets MAX_STEPS, MAX_TIME, MAX_RESULT_BITS or MAX_LABEL_DEPTH.
+        If an EvalState from new_eval_state() is passed as <state>, the
+        steps and time of earlier evaluations with it count as well.
         '''
 
         if type(eqn) in (types.StringType, types.UnicodeType):
             eqn = self.parse(eqn)
 
-        state = EvalState()
+        if state is None:
+            state = self.new_eval_state()
+        else:
+            state.used_var_ofs = {}
+        ret = self._evaluate_tree(eqn, state)
+        self._used_var_ofs = state.used_var_ofs
+        return ret
+
+    def _evaluate_tree(self, tree, state):
         try:
-            if isinstance(eqn, ast.Expression):
-                ret = self._process_node(eqn.body, state)
-            else:
-                ret = self._process_node(eqn, state)
+            ret = self._get_compiled(tree)(state)
         except (RuntimeError, ParserError), e:
             raise e
         except Exception, e:
@@ -655,13 +2034,41 @@ class AstParser:
             msg = _('Internal error')
             raise ParseError(msg, 0)
 
-        self._used_var_ofs = state.used_var_ofs
-
         if type(ret) is types.FunctionType:
             return ret()
         else:
             return ret
 
+    def evaluate_many(self, equations, assign_labels=True):
+        '''
+        Evaluate a sequence of equations, given as (label, equation) pairs,
+        and yield a (label, result) pair for each of them in order. If an
+        equation can not be parsed or evaluated, the result is the
+        ParserError instead.
+
+        If <assign_labels> is True, every successful equation with a label
+        is assigned to that label and its result to Ans, just like entering
+        the lines one by one in the activity.
+        '''
+
+        state = EvalState()
+        for label, eqn in equations:
+            state.used_var_ofs = {}
+            state.set_budget(self.MAX_STEPS, self.MAX_TIME)
+            try:
+                tree = self.parse(eqn)
+                res = self._evaluate_tree(tree, state)
+                if assign_labels:
+                    if label:
+                        self.set_var(label, tree)
+                    self.set_var('Ans', res)
+            except ParserError, e:
+                res = e
+
+            yield label, res
+
+        self._used_var_ofs = state.used_var_ofs
+
     def parse_and_eval(self, eqn):
         '''
         Parse and evaluate an equation.
@@ -676,7 +2083,8 @@ class AstParser:
     def get_last_used_vars(self):
         '''
         Return the variables that were accessed during the last evaluation
-        of an equation tree.
+        of an equation tree. Variables only used by labels that the equation
+        refers to are not included.
         '''
         return self._used_var_ofs.keys()
 
@@ -702,10 +2110,10 @@ if __name__ == '__main__':
     print 'Tree before:'
     p.print_tree(tree)
 #    p.set_var('apples', 123)
-    p.parse_symbolic(tree)
+    tree = p.parse_symbolic(tree)
 #    num = ast.Num()
 #    num.n = 123
-#    p.replace_variable(tree, 'apples', num)
+#    tree = p.replace_variable(tree, 'apples', num)
     print 'Tree after:'
     p.print_tree(tree)
 
@@ -0,0 +1,459 @@
+# benchmark.py, microbenchmarks for the parser and function library
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Microbenchmarks for AstParser, functions.py, MathLib, Rational and
+decimalmath.
+
+    python benchmark.py [options] [pattern ...]
+
+Every benchmark reports the best time per call over a number of repeats.
+Results can be saved as a JSON baseline with --save, and compared with a
+baseline using --compare; benchmarks that got slower by more than the
+threshold are flagged and make the exit status 1.
+'''
+
+import sys
+import time
+import re
+import platform
+import optparse
+
+try:
+    import json
+except ImportError:
+    json = None
+
+from decimal import Decimal
+
+from mathlib import MathLib
+from astparser import AstParser
+from rational import Rational
+import functions
+import decimalmath
+import intmath
+
+# Format version of saved baselines
+BASELINE_VERSION = 1
+
+# Registered benchmarks: list of (name, setup function). The setup function
+# returns the function to time, which takes no arguments.
+BENCHMARKS = []
+
+def benchmark(name):
+    '''Decorator registering a setup function as benchmark <name>.'''
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+def _new_parser():
+    return AstParser(MathLib())
+
+# Expression classes for parse and evaluate benchmarks. The arithmetic is
+# done on variables, constant expressions are folded when parsing.
+EXPRESSIONS = {
+    'int': 'a*34+b-78*(9+c)',
+    'decimal': 'a*2+b/7-c*(a+b)',
+    'rational': '(a+b)*5/11-c',
+    'trig': 'sin(x)+cos(x)*tan(x/2)',
+    'nested': '((((((((((x+1)*2)+1)*2)+1)*2)+1)*2)+1)*2)+1',
+    'call': 'sqrt(abs(x-10))+exp(x/10)+ln(x)',
+}
+
+# Variables for the evaluate benchmarks, x = 3 if not listed
+EXPRESSION_VARS = {
+    'int': {'a': 12, 'b': 56, 'c': 10},
+    'decimal': {'a': Decimal('1.5'), 'b': Decimal('3.125'),
+                'c': Decimal('0.001')},
+    'rational': {'a': Rational(1, 3), 'b': Rational(2, 7),
+                 'c': Rational(3, 13)},
+}
+
+def _add_expression_benchmarks():
+    for (kind, eqn) in EXPRESSIONS.iteritems():
+        def parse_setup(eqn=eqn):
+            p = _new_parser()
+            def run():
+                p.clear_parse_cache()
+                p.parse(eqn)
+            return run
+        benchmark('parse.%s' % kind)(parse_setup)
+
+        def eval_setup(eqn=eqn, kind=kind):
+            p = _new_parser()
+            for (name, val) in EXPRESSION_VARS.get(kind, {'x': 3}).items():
+                p.set_var(name, val)
+            tree = p.parse(eqn)
+            return lambda: p.evaluate(tree)
+        benchmark('evaluate.%s' % kind)(eval_setup)
+
+_add_expression_benchmarks()
+
+@benchmark('parse.cached')
+def _parse_cached():
+    p = _new_parser()
+    eqn = EXPRESSIONS['trig']
+    return lambda: p.parse(eqn)
+
+@benchmark('evaluate.string')
+def _evaluate_string():
+    p = _new_parser()
+    p.set_var('x', 3)
+    eqn = EXPRESSIONS['trig']
+    return lambda: p.evaluate(eqn)
+
+@benchmark('evaluate.label_chain')
+def _evaluate_label_chain():
+    # Changing x invalidates all cached label values
+    p = _new_parser()
+    p.set_var('x', 1)
+    p.set_var('a0', p.parse('x+1'))
+    for i in range(1, 50):
+        p.set_var('a%d' % i, p.parse('a%d*2-x' % (i - 1)))
+    tree = p.parse('a49+1')
+    def run():
+        p.set_var('x', 1)
+        p.evaluate(tree)
+    return run
+
+@benchmark('evaluate.label_cached')
+def _evaluate_label_cached():
+    p = _new_parser()
+    p.set_var('a0', p.parse('1+1'))
+    for i in range(1, 50):
+        p.set_var('a%d' % i, p.parse('a%d*2' % (i - 1)))
+    tree = p.parse('a49+1')
+    return lambda: p.evaluate(tree)
+
+def _add_function_benchmarks():
+    d1 = Decimal('1.2345678')
+    d2 = Decimal('7.654321')
+    r1 = Rational(3, 7)
+    r2 = Rational(5, 11)
+    cases = (
+        ('add.int', functions.add, (1234, 5678)),
+        ('add.decimal', functions.add, (d1, d2)),
+        ('add.float', functions.add, (1.25, 3.5)),
+        ('mul.int', functions.mul, (1234, 5678)),
+        ('mul.decimal', functions.mul, (d1, d2)),
+        ('div.int', functions.div, (1234, 5678)),
+        ('div.decimal', functions.div, (d1, d2)),
+        ('div.rational', functions.div, (r1, r2)),
+        ('div.float', functions.div, (1.25, 3.5)),
+        ('pow.int', functions.pow, (3, 40)),
+        ('pow.decimal', functions.pow, (d1, d2)),
+        ('shift_left.int', functions.shift_left, (1234, 10)),
+        ('sqrt', functions.sqrt, (d2,)),
+        ('sin', functions.sin, (d1,)),
+        ('factorial.100', functions.factorial, (100,)),
+        ('factorize', functions.factorize, (1234567,)),
+        ('gcd', functions.gcd, (123456789, 987654321)),
+    )
+    for (name, func, args) in cases:
+        def setup(func=func, args=args):
+            return lambda: func(*args)
+        benchmark('functions.%s' % name)(setup)
+
+_add_function_benchmarks()
+
+def _add_format_benchmarks():
+    values = (
+        ('int', 1234567890123),
+        ('decimal', Decimal('3.14159265358979323846')),
+        ('small', Decimal('0.000012345678')),
+        ('rational', Rational(22, 7)),
+    )
+    for digits in (9, 30):
+        for (kind, val) in values:
+            def setup(val=val, digits=digits):
+                ml = MathLib()
+                ml.set_digit_limit(digits)
+                return lambda: ml.format_number(val)
+            benchmark('format.%s.digits%d' % (kind, digits))(setup)
+
+    for base in (2, 16):
+        def setup(base=base):
+            ml = MathLib()
+            ml.set_integer_base(base)
+            return lambda: ml.format_number(1234567890123)
+        benchmark('format.int.base%d' % base)(setup)
+
+_add_format_benchmarks()
+
+def _add_rational_benchmarks():
+    r1 = Rational(355, 113)
+    r2 = Rational(-22, 7)
+    cases = (
+        ('add', lambda: r1 + r2),
+        ('sub', lambda: r1 - r2),
+        ('mul', lambda: r1 * r2),
+        ('div', lambda: r1 / r2),
+        ('pow', lambda: r1 ** 5),
+        ('add_int', lambda: r1 + 3),
+        ('float', lambda: float(r1)),
+    )
+    for (name, func) in cases:
+        benchmark('rational.%s' % name)(lambda func=func: func)
+
+@benchmark('rational.harmonic')
+def _rational_harmonic():
+    # Long chain of additions with growing denominators: 1/1 + ... + 1/200
+    terms = [Rational(1, k) for k in range(1, 201)]
+    def run():
+        total = Rational(0, 1)
+        for r in terms:
+            total = total + r
+        return total
+    return run
+
+@benchmark('functions.harmonic')
+def _functions_harmonic():
+    # The same sum as computed by the parser's operators
+    add, div = functions.add, functions.div
+    def run():
+        total = 0
+        for k in xrange(1, 201):
+            total = add(total, div(1, k))
+        return total
+    return run
+
+_add_rational_benchmarks()
+
+def _add_decimalmath_benchmarks():
+    # The precision used for 30 shown digits
+    prec = 30 + AstParser.PRECISION_GUARD_DIGITS
+    x = Decimal('1.2345678')
+    y = Decimal('7.654321')
+    cases = (
+        ('exp', decimalmath.exp, (x, prec)),
+        ('ln', decimalmath.ln, (y, prec)),
+        ('sqrt', decimalmath.sqrt, (y, prec)),
+        ('power', decimalmath.power, (x, y, prec)),
+        ('sin', decimalmath.sin, (x, prec)),
+        ('sin.large', decimalmath.sin, (Decimal('1234567.89'), prec)),
+        ('atan', decimalmath.atan, (x, prec)),
+        ('asin', decimalmath.asin, (Decimal('0.45678'), prec)),
+        ('pi', decimalmath.pi, (prec,)),
+        ('exp.100', decimalmath.exp, (x, 100)),
+    )
+    for (name, func, args) in cases:
+        def setup(func=func, args=args):
+            return lambda: func(*args)
+        benchmark('decimalmath.%s' % name)(setup)
+
+_add_decimalmath_benchmarks()
+
+def _factorial_loop(n):
+    # The linear loop that functions.factorial() used before the prime swing
+    ret = 1
+    for i in xrange(2, n + 1):
+        ret *= i
+    return ret
+
+def _add_factorial_benchmarks():
+    for n in (100, 1000, 10000, 100000):
+        def swing_setup(n=n):
+            return lambda: functions.factorial(n)
+        benchmark('factorial.swing.%d' % n)(swing_setup)
+
+        def loop_setup(n=n):
+            return lambda: _factorial_loop(n)
+        benchmark('factorial.loop.%d' % n)(loop_setup)
+
+    for (n, k) in ((1000, 500), (100000, 50000), (10 ** 12, 20)):
+        def binomial_setup(n=n, k=k):
+            return lambda: functions.binomial(n, k)
+        benchmark('binomial.%d.%d' % (n, k))(binomial_setup)
+
+    def format_setup():
+        ml = MathLib()
+        val = functions.factorial(100000)
+        return lambda: ml.format_number(val)
+    benchmark('format.factorial.100000')(format_setup)
+
+_add_factorial_benchmarks()
+
+def _add_factorize_benchmarks():
+    cases = (
+        ('7digits', 1234567),
+        ('18digits', 1000000007 * 999999937),
+        ('30digits', 123456789012345678901234567890),
+        ('prime', 2 ** 89 - 1),
+    )
+    for (name, n) in cases:
+        def setup(n=n):
+            def run():
+                intmath.clear_factor_cache()
+                functions.factorize(n)
+            return run
+        benchmark('factorize.%s' % name)(setup)
+
+    @benchmark('factorize.cached')
+    def _factorize_cached():
+        n = 1000000007 * 999999937
+        return lambda: functions.factorize(n)
+
+    @benchmark('is_prime.18digits')
+    def _is_prime():
+        return lambda: functions.is_prime(10 ** 18 + 9)
+
+_add_factorize_benchmarks()
+
+def time_function(func, repeat=5, min_time=0.1):
+    '''
+    Return the best time per call of <func> in seconds. The number of calls
+    per repeat is increased until a repeat takes at least <min_time>.
+    '''
+
+    number = 1
+    while True:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        t = time.time() - start
+        if t >= min_time or number >= 1000000:
+            break
+        if t > 0:
+            number = max(number * 2, int(number * min_time * 1.2 / t))
+        else:
+            number *= 10
+
+    best = t
+    for i in xrange(repeat - 1):
+        start = time.time()
+        for i in xrange(number):
+            func()
+        best = min(best, time.time() - start)
+    return best / number
+
+def run_benchmarks(patterns=None, repeat=5, min_time=0.1, out=None):
+    '''
+    Run the benchmarks whose names match one of the regular expressions in
+    <patterns> (all if None), return a dictionary of name -> seconds per
+    call.
+    '''
+
+    if patterns:
+        regexps = [re.compile(p) for p in patterns]
+    results = {}
+    for (name, setup) in BENCHMARKS:
+        if patterns and not [r for r in regexps if r.search(name)]:
+            continue
+        func = setup()
+        results[name] = time_function(func, repeat, min_time)
+        if out is not None:
+            out.write('%-32s %12.2f us\n' % (name, results[name] * 1e6))
+            out.flush()
+    return results
+
+def save_baseline(fn, results):
+    data = {
+        'version': BASELINE_VERSION,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+    }
+    f = open(fn, 'w')
+    json.dump(data, f, indent=1, sort_keys=True)
+    f.close()
+
+def load_baseline(fn):
+    f = open(fn, 'r')
+    data = json.load(f)
+    f.close()
+    if data.get('version', None) != BASELINE_VERSION:
+        raise ValueError('Unsupported baseline version in %s' % fn)
+    return data['results']
+
+def compare_results(results, baseline, threshold):
+    '''
+    Compare <results> with <baseline>. Returns a list of
+    (name, baseline time, time, ratio, regression) tuples, where regression
+    is True if the time increased by more than <threshold> (0.1 = 10%).
+    '''
+
+    ret = []
+    for name in sorted(results.keys()):
+        if name not in baseline:
+            continue
+        ratio = results[name] / baseline[name]
+        ret.append((name, baseline[name], results[name], ratio,
+                    ratio > 1.0 + threshold))
+    return ret
+
+def main(argv=None):
+    usage = 'usage: %prog [options] [pattern ...]'
+    op = optparse.OptionParser(usage=usage,
+            description='Run the benchmarks matching the given regular '
+                        'expressions, or all of them.')
+    op.add_option('-s', '--save', metavar='FILE',
+            help='save the results as baseline FILE')
+    op.add_option('-c', '--compare', metavar='FILE',
+            help='compare with baseline FILE and flag regressions')
+    op.add_option('-t', '--threshold', type='float', default=10.0,
+            metavar='PCT', help='slowdown in percent that is flagged as a '
+                                'regression (default: %default)')
+    op.add_option('-r', '--repeat', type='int', default=5,
+            help='number of repeats, the best is used (default: %default)')
+    op.add_option('-m', '--min-time', type='float', default=0.1,
+            metavar='SECONDS', help='minimum time per repeat '
+                                    '(default: %default)')
+    op.add_option('-l', '--list', action='store_true', default=False,
+            help='list the benchmarks')
+    (opts, args) = op.parse_args(argv)
+
+    if opts.list:
+        for (name, setup) in BENCHMARKS:
+            print name
+        return 0
+
+    if (opts.save or opts.compare) and json is None:
+        op.error('baselines require python 2.6 or later')
+
+    baseline = None
+    if opts.compare:
+        baseline = load_baseline(opts.compare)
+
+    results = run_benchmarks(args, opts.repeat, opts.min_time, sys.stdout)
+
+    if opts.save:
+        save_baseline(opts.save, results)
+
+    if baseline is None:
+        return 0
+
+    print
+    print '%-32s %12s %12s %8s' % ('benchmark', 'baseline', 'current', 'ratio')
+    regressions = 0
+    for (name, old, new, ratio, regression) in \
+            compare_results(results, baseline, opts.threshold / 100.0):
+        if regression:
+            flag = 'REGRESSION'
+            regressions += 1
+        else:
+            flag = ''
+        print '%-32s %9.2f us %9.2f us %7.2fx %s' % \
+              (name, old * 1e6, new * 1e6, ratio, flag)
+
+    if regressions > 0:
+        print '%d regression(s) above %.0f%%' % (regressions, opts.threshold)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
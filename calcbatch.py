@@ -0,0 +1,300 @@
+# calcbatch.py, evaluate equations from the command line
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Evaluate equations without the user interface, one per line, read from
+files or stdin:
+
+    python calcbatch.py [options] [file ...]
+
+Lines of the form 'label: equation' assign the result to a label, just
+like in the activity; empty lines and lines starting with '#' are skipped.
+Input is processed as a stream, so memory use does not depend on its
+length.
+'''
+
+import sys
+import time
+import math
+import re
+import optparse
+
+import logging
+_logger = logging.getLogger('CalcBatch')
+
+try:
+    import json
+except ImportError:
+    json = None
+
+from mathlib import MathLib
+from astparser import AstParser, ParserError
+import functions
+
+LABEL_REGEXP = re.compile(r'^\s*([^\W\d]\w*)\s*:(.*)$', re.UNICODE)
+
+class LatencyHistogram:
+    '''
+    Histogram of latencies with logarithmic buckets, BUCKETS_PER_DECADE per
+    factor 10 starting at MIN_TIME. Percentiles are accurate to the bucket
+    width (about 12%) and memory use is constant.
+    '''
+
+    MIN_TIME = 1e-7
+    BUCKETS_PER_DECADE = 20
+    DECADES = 10
+
+    def __init__(self):
+        self._buckets = [0] * (self.BUCKETS_PER_DECADE * self.DECADES + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, t):
+        self.count += 1
+        self.total += t
+        self.max = max(self.max, t)
+        if t <= self.MIN_TIME:
+            i = 0
+        else:
+            i = int(math.log10(t / self.MIN_TIME) * self.BUCKETS_PER_DECADE)
+            i = min(i + 1, len(self._buckets) - 1)
+        self._buckets[i] += 1
+
+    def percentile(self, pct):
+        '''Return the upper bound of the bucket containing percentile <pct>.'''
+        if self.count == 0:
+            return 0.0
+        needed = math.ceil(self.count * pct / 100.0)
+        seen = 0
+        for i, n in enumerate(self._buckets):
+            seen += n
+            if seen >= needed:
+                upper = self.MIN_TIME * 10 ** (float(i) / self.BUCKETS_PER_DECADE)
+                return min(upper, self.max)
+        return self.max
+
+class BatchEvaluator:
+    '''
+    Evaluate a stream of lines with one AstParser and write the results in
+    'text' or 'json' (one object per line) format.
+    '''
+
+    def __init__(self, out, format='text', parser=None):
+        if parser is None:
+            parser = AstParser(MathLib())
+        self.parser = parser
+        self.ml = parser.ml
+        self.out = out
+        self.format = format
+
+        self.lines = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+        self._start_time = None
+        self._inputs = None
+
+    def _equations(self, lines):
+        '''Generate (label, equation) pairs, remembering the input.'''
+        for (lineno, line) in lines:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+
+            m = LABEL_REGEXP.match(line)
+            if m is not None:
+                label, eqn = m.group(1), m.group(2).strip()
+            else:
+                label, eqn = None, line
+
+            self._inputs = (lineno, eqn)
+            self._start_time = time.time()
+            yield (label, eqn)
+
+    def format_result(self, res):
+        if isinstance(res, ParserError):
+            return unicode(str(res), 'utf-8')
+        ret = self.ml.format_number(res)
+        if type(ret) is str:
+            ret = unicode(ret, 'utf-8')
+        return ret
+
+    def write_result(self, lineno, label, eqn, res, t):
+        is_error = isinstance(res, ParserError)
+        text = self.format_result(res)
+        if self.format == 'json':
+            obj = {
+                'line': lineno,
+                'label': label,
+                'equation': eqn,
+                'time': t,
+            }
+            if is_error:
+                obj['error'] = text
+                obj['range'] = res.get_range()
+            else:
+                obj['result'] = text
+            line = json.dumps(obj)
+        else:
+            if label is not None:
+                eqn = u'%s: %s' % (label, eqn)
+            if is_error:
+                line = u'%s ! %s' % (eqn, text)
+            else:
+                line = u'%s = %s' % (eqn, text)
+
+        self.out.write(line.encode('utf-8') + '\n')
+
+    def process(self, lines):
+        '''
+        Evaluate <lines>, an iterable of (line number, text) pairs, and
+        write the results.
+        '''
+
+        results = self.parser.evaluate_many(self._equations(lines))
+        for (label, res) in results:
+            t = time.time() - self._start_time
+            lineno, eqn = self._inputs
+            self.lines += 1
+            if isinstance(res, ParserError):
+                self.errors += 1
+            self.latency.add(t)
+            self.write_result(lineno, label, eqn, res, t)
+
+    def get_stats(self):
+        '''Return a dictionary with counts, throughput and latencies.'''
+        h = self.latency
+        stats = {
+            'lines': self.lines,
+            'errors': self.errors,
+            'eval_time': h.total,
+            'mean': 0.0,
+            'p50': h.percentile(50),
+            'p90': h.percentile(90),
+            'p99': h.percentile(99),
+            'max': h.max,
+            'lines_per_sec': 0.0,
+        }
+        if h.count > 0:
+            stats['mean'] = h.total / h.count
+        if h.total > 0:
+            stats['lines_per_sec'] = h.count / h.total
+        return stats
+
+def _read_lines(f):
+    '''Generate (line number, text) pairs from file <f> as they come in.'''
+    lineno = 0
+    for line in iter(f.readline, ''):
+        lineno += 1
+        yield (lineno, unicode(line, 'utf-8', 'replace'))
+
+def _print_stats(stats, wall_time, out):
+    out.write('lines: %d, errors: %d\n' % (stats['lines'], stats['errors']))
+    out.write('wall time: %.3f s, evaluation time: %.3f s, %.1f lines/s\n' % \
+              (wall_time, stats['eval_time'], stats['lines_per_sec']))
+    out.write('latency: mean %.1f us, p50 %.1f us, p90 %.1f us, ' \
+              'p99 %.1f us, max %.1f us\n' % \
+              tuple([stats[k] * 1e6 for k in \
+                     ('mean', 'p50', 'p90', 'p99', 'max')]))
+
+def main(argv=None):
+    usage = 'usage: %prog [options] [file ...]'
+    op = optparse.OptionParser(usage=usage,
+            description='Evaluate equations, one per line, from the given '
+                        'files or stdin. Use "label: equation" to assign '
+                        'a label.')
+    op.add_option('-f', '--format', choices=('text', 'json'), default='text',
+            help='output format: text or json (one object per line)')
+    op.add_option('-o', '--output', metavar='FILE',
+            help='write results to FILE instead of stdout')
+    op.add_option('-d', '--digits', type='int',
+            help='number of digits in results, above %d the functions '
+                 'are calculated to that precision' % AstParser.FLOAT_DIGITS)
+    op.add_option('-a', '--angle', choices=('deg', 'rad'),
+            help='angle unit: deg or rad')
+    op.add_option('-e', '--exact', action='store_true', default=False,
+            help='divide integers of any size exactly, giving fractions')
+    op.add_option('-b', '--rational-bits', type='int', metavar='BITS',
+            help='approximate fractions with more than BITS bits in '
+                 'numerator or denominator, 0 for no limit (default: %d)' % \
+                 functions.rational_bit_limit.value)
+    op.add_option('-t', '--max-time', type='float', metavar='SECONDS',
+            help='abort an equation after SECONDS, 0 for no limit')
+    op.add_option('-s', '--stats', action='store_true', default=False,
+            help='print throughput and latency statistics to stderr')
+    op.add_option('-v', '--verbose', action='store_true', default=False,
+            help='show debug output')
+    (opts, args) = op.parse_args(argv)
+
+    if opts.format == 'json' and json is None:
+        op.error('json output requires python 2.6 or later')
+
+    if opts.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    ml = MathLib()
+    if opts.digits is not None:
+        ml.set_digit_limit(opts.digits)
+    if opts.angle == 'deg':
+        functions.angle_scaling.value = MathLib.ANGLE_DEG
+    elif opts.angle == 'rad':
+        functions.angle_scaling.value = MathLib.ANGLE_RAD
+
+    parser = AstParser(ml)
+    if opts.digits is not None:
+        parser.set_precision(opts.digits)
+    if opts.exact or opts.rational_bits is not None:
+        bit_limit = functions.rational_bit_limit.value
+        if opts.rational_bits is not None:
+            bit_limit = opts.rational_bits or None
+        parser.set_division_mode(opts.exact, bit_limit)
+    if opts.max_time is not None:
+        parser.MAX_TIME = opts.max_time or None
+
+    if opts.output is not None:
+        out = open(opts.output, 'w')
+    else:
+        out = sys.stdout
+
+    batch = BatchEvaluator(out, opts.format, parser)
+    start = time.time()
+    try:
+        if len(args) == 0:
+            batch.process(_read_lines(sys.stdin))
+        for fn in args:
+            f = open(fn, 'r')
+            try:
+                batch.process(_read_lines(f))
+            finally:
+                f.close()
+    except KeyboardInterrupt:
+        pass
+    wall_time = time.time() - start
+
+    if out is not sys.stdout:
+        out.close()
+
+    if opts.stats:
+        _print_stats(batch.get_stats(), wall_time, sys.stderr)
+
+    if batch.errors > 0:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
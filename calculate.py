@@ -44,6 +44,7 @@ from layout import CalcLayout
 from mathlib import MathLib
 from astparser import AstParser, ParserError, RuntimeError
 from svgimage import SVGImage
+from evalworker import EvalWorker, HAVE_MULTIPROCESSING, is_svg
 
 from decimal import Decimal
 from rational import Rational
@@ -241,12 +242,16 @@ class Equation:
         eqnstr = '%s\n' % str(self.equation)
         self.append_with_superscript_tags(buf, eqnstr, tagsmall)
 
-        resstr = self.ml.format_number(self.result)
-        if len(resstr) > 30:
-            restag = tagsmall
+        if isinstance(self.result, ParserError):
+            buf.insert_with_tags(buf.get_end_iter(), str(self.result),
+                    tagsmall)
         else:
-            restag = tagbig
-        self.append_with_superscript_tags(buf, resstr, restag)
+            resstr = self.ml.format_number(self.result)
+            if len(resstr) > 30:
+                restag = tagsmall
+            else:
+                restag = tagbig
+            self.append_with_superscript_tags(buf, resstr, restag)
 
         buf.apply_tag(tagcolor, buf.get_start_iter(), buf.get_end_iter())
 
@@ -295,6 +300,7 @@ class Calculate(ShareableActivity):
         'Home': lambda o: o.text_entry.set_position(0),
         'End': lambda o: o.text_entry.set_position(len(o.text_entry.get_text())),
         'Tab': lambda o: o.tab_complete(),
+        'Escape': lambda o: o.cancel_process(),
     }
 
     CTRL_KEYMAP = {
@@ -313,6 +319,12 @@ class Calculate(ShareableActivity):
 
     IDENTIFIER_CHARS = u"0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_ "
 
+    # Characters of names to complete, including members like physics.c
+    NAME_CHARS = u"0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_."
+
+    # Evaluate equations in a separate process
+    USE_WORKER = True
+
     def __init__(self, handle):
         ShareableActivity.__init__(self, handle)
 
@@ -320,6 +332,17 @@ class Calculate(ShareableActivity):
         
         self.ml = MathLib()
         self.parser = AstParser(self.ml)
+        plot_dir = os.path.join(activity.get_activity_root(), 'data', 'plots')
+        self.parser.pl.cache.set_directory(plot_dir)
+
+        self.worker = None
+        self._pending_eqn = None
+        if self.USE_WORKER and HAVE_MULTIPROCESSING:
+            try:
+                self.worker = EvalWorker(self.ml, self._process_async_cb,
+                                         plot_dir=plot_dir)
+            except (OSError, IOError), e:
+                _logger.warning('Unable to start worker process: %s', e)
 
         # These will result in 'Ans <operator character>' being inserted
         self._chars_ans_diadic = [op[0] for op in self.parser.get_diadic_operators()]
@@ -362,11 +385,13 @@ class Calculate(ShareableActivity):
 
     def cleanup_cb(self, arg):
         _logger.debug('Cleaning up...')
+        if self.worker is not None:
+            self.worker.stop()
 
     def equation_pressed_cb(self, eqn):
         """Callback for when an equation box is clicked"""
 
-        if isinstance(eqn.result, SVGImage):
+        if isinstance(eqn.result, (SVGImage, ParserError)):
             return True
 
         if len(eqn.label) > 0:
@@ -405,7 +430,8 @@ class Calculate(ShareableActivity):
         self.old_eqs = []
         self.showing_version = 0
 
-    def add_equation(self, eq, prepend=False, drawlasteq=False, tree=None):
+    def add_equation(self, eq, prepend=False, drawlasteq=False, tree=None,
+                     tree_eqn=None):
         """
         Insert equation in the history list and set variable if assignment.
         Input:
@@ -415,7 +441,33 @@ class Calculate(ShareableActivity):
             buffer to be added to the history next time an equation is added.
             tree: the parsed tree, this will be used to set the label variable
             so that the equation can be used symbolicaly.
+            tree_eqn: the equation that tree was parsed from, if it is not
+            eq.equation.
+        Returns False if the label could not be assigned. The error then
+        replaces the result of <eq>; with drawlasteq the equation is not
+        added, so that the caller can show the error instead.
             """
+
+        # Assign the label before drawing, so that an error, e.g. recursion
+        # caused by an equation from a buddy, is shown instead of the result.
+        has_label = eq.label is not None and len(eq.label) > 0
+        if has_label:
+            if tree_eqn is None:
+                tree_eqn = eq.equation
+            try:
+                if tree is None:
+                    tree = self.parser.parse(tree_eqn)
+                self.parser.set_var(eq.label, tree)
+            except ParserError, e:
+                _logger.error('Unable to set label %s: %s', eq.label, e)
+                eq.result = e
+                if drawlasteq:
+                    return False
+                has_label = False
+            else:
+                if self.worker is not None:
+                    self.worker.set_var(eq.label, tree_eqn, is_eqn=True)
+
         if eq.equation is not None and len(eq.equation) > 0:
             if prepend:
                 self.old_eqs.insert(0, eq)
@@ -445,73 +497,143 @@ class Calculate(ShareableActivity):
         else:
             self.layout.add_equation(w, own, prepend=not prepend)
 
-        if eq.label is not None and len(eq.label) > 0:
+        if has_label:
             w = self.create_var_textview(eq.label, eq.result)
             if w is not None:
                 self.layout.add_variable(eq.label, w)
 
-            if tree is None:
-                tree = self.parser.parse(eq.equation)
-            self.parser.set_var(eq.label, tree)
+        return not isinstance(eq.result, ParserError)
+
+    def set_var(self, name, value):
+        """Set variable in the parser and in the worker process."""
+
+        self.parser.set_var(name, value)
+        if self.worker is not None:
+            if isinstance(value, SVGImage):
+                value = value.get_svg_data()
+            self.worker.set_var(name, value)
 
-    # FIXME: to be implemented
-    def process_async(self, eqn):
+    def get_ans_equation(self, s):
+        """
+        If the previous answer was inserted in equation <s>, return the
+        equation with it replaced by LastEqn to get a (more) exact result.
+        """
+
+        if not self.ans_inserted:
+            return None
+        ansvar = self.format_insert_ans()
+        pos = s.find(ansvar)
+        if len(ansvar) > 6 and pos != -1:
+            s2 = s.replace(ansvar, 'LastEqn')
+            _logger.debug('process(): replacing previous answer %r: %r', ansvar, s2)
+            return s2
+        return None
+
+    def process_async(self, eqn, label):
         """Parse and process an equation asynchronously."""
 
+        if self.worker.is_busy():
+            _logger.debug('process_async(): still busy, ignoring %r', eqn)
+            return False
+
+        s2 = self.get_ans_equation(eqn)
+        req_id = self.worker.evaluate(eqn, label, s2)
+        if req_id is None:
+            return False
+        self._pending_eqn = (req_id, eqn, label, s2)
+        return True
+
+    def _process_async_cb(self, req_id, res):
+        if self._pending_eqn is None or self._pending_eqn[0] != req_id:
+            return
+        (req_id, s, label, s2) = self._pending_eqn
+        self._pending_eqn = None
+
+        _logger.debug('Result: %r', res)
+        if s2 is not None and not isinstance(res, ParserError) and \
+                not is_svg(res):
+            self.show_result(s, label, res, tree_eqn=s2)
+        else:
+            self.show_result(s, label, res)
+
+    def cancel_process(self):
+        """Cancel the equation being processed asynchronously, if any."""
+
+        if self.worker is None or not self.worker.cancel():
+            return False
+        _logger.debug('Cancelled processing %r', self._pending_eqn[1])
+        self._pending_eqn = None
+        return True
+
     def process(self):
         """Parse the equation entered and show the result"""
 
         s = unicode(self.text_entry.get_text())
         label = unicode(self.label_entry.get_text())
+        if self.worker is not None:
+            return self.process_async(s, label)
+
         _logger.debug('process(): parsing %r, label: %r', s, label)
+        tree = None
         try:
             tree = self.parser.parse(s)
             res = self.parser.evaluate(tree)
         except ParserError, e:
             res = e
-            self.showing_error = True
-
-        if type(res) == types.StringType and res.find('</svg>') > -1:
-            res = SVGImage(data=res)
 
         _logger.debug('Result: %r', res)
 
         # Check whether assigning this label would cause recursion
         if not isinstance(res, ParserError) and len(label) > 0:
-            lastpos = self.parser.get_var_used_ofs(label)
+            lastpos = self.parser.get_label_cycle_ofs(label, tree)
             if lastpos is not None:
                 res = RuntimeError(_('Can not assign label: will cause recursion'),
                         lastpos)
 
 # If parsing went ok, see if we have to replace the previous answer
 # to get a (more) exact result
-        if self.ans_inserted and not isinstance(res, ParserError) \
-                and not isinstance(res, SVGImage):
-            ansvar = self.format_insert_ans()
-            pos = s.find(ansvar)
-            if len(ansvar) > 6 and pos != -1:
-                s2 = s.replace(ansvar, 'LastEqn')
-                _logger.debug('process(): replacing previous answer %r: %r', ansvar, s2)
+        s2 = self.get_ans_equation(s)
+        if s2 is not None and not isinstance(res, ParserError) \
+                and not is_svg(res):
+            try:
                 tree = self.parser.parse(s2)
                 res = self.parser.evaluate(tree)
+            except ParserError, e:
+                res = e
+
+        return self.show_result(s, label, res, tree=tree, tree_eqn=s2)
+
+    def show_result(self, s, label, res, tree=None, tree_eqn=None):
+        """Show the result of equation <s> and assign it to <label>."""
+
+        if is_svg(res):
+            res = SVGImage(data=res)
 
         eqn = Equation(label, s, res, self.color, self.get_owner_id(), ml=self.ml)
 
+        # Assigning the label can still fail, e.g. with a buddy's label
+        if not isinstance(res, ParserError) and \
+                not self.add_equation(eqn, drawlasteq=True, tree=tree,
+                                      tree_eqn=tree_eqn):
+            res = eqn.result
+
         if isinstance(res, ParserError):
+            self.showing_error = True
             self.set_error_equation(eqn)
         else:
-            self.add_equation(eqn, drawlasteq=True, tree=tree)
             self.send_message("add_eq", value=str(eqn))
 
-            self.parser.set_var('Ans', eqn.result)
+            self.set_var('Ans', eqn.result)
 
             # Setting LastEqn to the parse tree would certainly be faster,
             # however, it introduces recursion problems
-            self.parser.set_var('LastEqn', eqn.result)
+            self.set_var('LastEqn', eqn.result)
 
             self.showing_error = False
             self.ans_inserted = False
-            self.text_entry.set_text(u'')
+            # Keep the text if it was edited while processing
+            if unicode(self.text_entry.get_text()) == s:
+                self.text_entry.set_text(u'')
             self.label_entry.set_text(u'')
 
         return res is not None
@@ -554,6 +676,7 @@ class Calculate(ShareableActivity):
         return w
     
     def clear(self):
+        self.cancel_process()
         self.text_entry.set_text(u'')
         self.text_entry.grab_focus()
         return True
@@ -681,31 +804,24 @@ class Calculate(ShareableActivity):
         else:
             end_ofs = sel[0]
         start_ofs = end_ofs - 1
-        while start_ofs > 0 and str[start_ofs - 1] in self.IDENTIFIER_CHARS:
+        while start_ofs > 0 and str[start_ofs - 1] in self.NAME_CHARS:
             start_ofs -= 1
         if end_ofs - start_ofs <= 0:
             return False
         partial_name = str[start_ofs:end_ofs]
         _logger.debug('tab-completing %s...', partial_name)
 
-# Lookup matching variables
-        vars = self.parser.get_names(start=partial_name)
-        if len(vars) == 0:
-            return False
-
-# Nothing selected, select first match
+# Lookup next matching variable, the first one if nothing is selected yet
         if len(sel) == 0:
-            name = vars[0]
-            self.text_entry.set_text(str[:start_ofs] + name + str[end_ofs:])
-
-# Select next matching variable
+            name = self.parser.get_next_name(partial_name)
+            sel_end = end_ofs
         else:
             full_name = str[start_ofs:sel[1]]
-            if full_name not in vars:
-                name = vars[0]
-            else:
-                name = vars[(vars.index(full_name) + 1) % len(vars)]
-            self.text_entry.set_text(str[:start_ofs] + name + str[sel[1]:])
+            name = self.parser.get_next_name(partial_name, full_name)
+            sel_end = sel[1]
+        if name is None:
+            return False
+        self.text_entry.set_text(str[:start_ofs] + name + str[sel_end:])
 
         self.text_entry.set_position(start_ofs + len(name))
         self.text_entry.select_region(end_ofs, start_ofs + len(name))
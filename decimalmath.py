@@ -0,0 +1,613 @@
+# decimalmath.py, elementary functions on Decimals at a given precision
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Elementary functions computed to <prec> significant digits. Arguments are
+Decimals or integers, results are Decimals rounded to <prec> digits.
+
+The series are summed with fixed-point integers: a value v is represented
+by the integer v * 2**w for a number of bits w that is somewhat larger than
+the requested precision. Arguments are first reduced to a small range
+(multiples of ln 2 for exp, of pi/2 for the trigonometric functions, powers
+of two and ten for ln), where a Taylor series converges quickly.
+
+The constants pi, ln 2 and ln 10 are kept at the highest precision computed
+so far and lower precisions are derived from that by shifting, so repeated
+calls at the same precision only pay for the series.
+'''
+
+import math
+from decimal import Decimal, Context
+
+from gettext import gettext as _
+
+from intmath import bit_length as _bit_length, isqrt as _isqrt
+
+# Bits carried beyond the requested precision in fixed-point calculations
+_GUARD_BITS = 24
+
+# Digits carried beyond the requested precision in Decimal calculations
+_GUARD_DIGITS = 5
+
+_LOG2_10 = math.log(10, 2)
+
+# exp() of larger arguments does not fit the exponent range of a Decimal
+_MAX_EXP_ARG = Decimal('2.3e9')
+
+# Reducing an angle needs pi to as many digits as the angle has before the
+# decimal point, so larger angles are refused.
+MAX_ANGLE_DIGITS = 10000
+
+# Number of times the argument of atan() is halved before summing the series
+_ATAN_HALVINGS = 3
+
+# Shifts up to this many bits are converted to Decimal exactly
+_MAX_EXACT_SHIFT = 4000
+
+_contexts = {}
+
+def get_context(prec):
+    '''Return a shared Decimal context with precision <prec>.'''
+    ctx = _contexts.get(prec, None)
+    if ctx is None:
+        ctx = Context(prec=prec)
+        _contexts[prec] = ctx
+    return ctx
+
+def _working_bits(prec):
+    return int(prec * _LOG2_10) + _GUARD_BITS
+
+def _magnitude_bits(x):
+    '''Return the number of bits in the integer part of abs(x), plus 2.'''
+    adj = x.adjusted()
+    if adj < 0:
+        return 2
+    return int((adj + 1) * _LOG2_10) + 3
+
+def _small_bits(x):
+    '''Return the number of leading zero bits after the point of abs(x).'''
+    adj = x.adjusted()
+    if adj >= 0:
+        return 0
+    return int(-adj * _LOG2_10)
+
+def _to_decimal(x):
+    if isinstance(x, Decimal):
+        if not x.is_finite():
+            raise ValueError(_('Invalid argument'))
+        return x
+    elif isinstance(x, (int, long)):
+        return Decimal(x)
+    raise TypeError(_('Invalid argument'))
+
+def _to_fixed(x, w, scale=0):
+    '''Return <x> * 10**<scale> as a fixed-point integer with <w> bits.'''
+    (sign, digits, exp) = x.as_tuple()
+    man = int(''.join(map(str, digits)))
+    exp += scale
+    if exp >= 0:
+        man = (man * 10 ** exp) << w
+    else:
+        man = (man << w) // 10 ** -exp
+    if sign:
+        return -man
+    return man
+
+def _from_fixed(man, shift, prec):
+    '''Return man / 2**shift as a Decimal rounded to <prec> digits.'''
+    ctx = get_context(prec)
+    if shift <= 0:
+        if -shift <= _MAX_EXACT_SHIFT:
+            return ctx.plus(Decimal(man << -shift))
+    elif shift <= _MAX_EXACT_SHIFT:
+        # man / 2**shift == man * 5**shift / 10**shift
+        return ctx.scaleb(Decimal(man * 5 ** shift), -shift)
+
+    # Far out of range, the power of two is calculated approximately
+    ctx2 = get_context(prec + _GUARD_DIGITS + len(str(abs(shift))))
+    scale = ctx2.power(Decimal(2), -shift)
+    return ctx.plus(ctx2.multiply(Decimal(man), scale))
+
+def _atan_inv(n, w):
+    '''Return atan(1 / n) for integer n > 1, with <w> bits.'''
+    x = (1 << w) // n
+    total = x
+    n2 = n * n
+    k = 3
+    while x:
+        x //= n2
+        total -= x // k
+        x //= n2
+        total += x // (k + 2)
+        k += 4
+    return total
+
+def _atanh_inv(n, w):
+    '''Return atanh(1 / n) for integer n > 1, with <w> bits.'''
+    x = (1 << w) // n
+    total = x
+    n2 = n * n
+    k = 3
+    while x:
+        x //= n2
+        total += x // k
+        k += 2
+    return total
+
+def _pi_fixed(w):
+    # Machin: pi / 4 = 4 * atan(1 / 5) - atan(1 / 239)
+    w += 8
+    return (16 * _atan_inv(5, w) - 4 * _atan_inv(239, w)) >> 8
+
+def _ln2_fixed(w):
+    # ln(2) = 2 * atanh(1 / 3)
+    w += 8
+    return (2 * _atanh_inv(3, w)) >> 8
+
+def _ln10_fixed(w):
+    # ln(10) = 3 * ln(2) + ln(5 / 4) = 6 * atanh(1 / 3) + 2 * atanh(1 / 9)
+    w += 8
+    return (6 * _atanh_inv(3, w) + 2 * _atanh_inv(9, w)) >> 8
+
+_CONSTANT_FUNCS = {
+    'pi': _pi_fixed,
+    'ln2': _ln2_fixed,
+    'ln10': _ln10_fixed,
+}
+
+# Name -> (bits, value) of the most precise constant calculated so far
+_constants = {}
+
+def _constant(name, w):
+    '''Return constant <name> as a fixed-point integer with <w> bits.'''
+    (cw, val) = _constants.get(name, (0, 0))
+    if cw < w:
+        cw = w + 32
+        val = _CONSTANT_FUNCS[name](cw)
+        _constants[name] = (cw, val)
+    return val >> (cw - w)
+
+# (name, prec) -> Decimal
+_decimal_constants = {}
+
+def pi(prec):
+    '''Return pi with <prec> digits.'''
+    ret = _decimal_constants.get(('pi', prec), None)
+    if ret is None:
+        w = _working_bits(prec)
+        ret = _from_fixed(_constant('pi', w), w, prec)
+        _decimal_constants[('pi', prec)] = ret
+    return ret
+
+def ln2(prec):
+    '''Return ln(2) with <prec> digits.'''
+    ret = _decimal_constants.get(('ln2', prec), None)
+    if ret is None:
+        w = _working_bits(prec)
+        ret = _from_fixed(_constant('ln2', w), w, prec)
+        _decimal_constants[('ln2', prec)] = ret
+    return ret
+
+def e(prec):
+    '''Return e with <prec> digits.'''
+    ret = _decimal_constants.get(('e', prec), None)
+    if ret is None:
+        ret = exp(1, prec)
+        _decimal_constants[('e', prec)] = ret
+    return ret
+
+def _exp_fixed(x, wp):
+    '''
+    Return (man, shift) so that exp(x) = man / 2**shift, with <wp>
+    significant bits.
+    '''
+
+    # x = k * ln(2) + r with 0 <= r < ln(2), and exp(r) is computed as
+    # exp(r / 2**s) ** (2**s) to make the series short.
+    s = int(math.sqrt(wp))
+    w = wp + s + 8
+    mag = _magnitude_bits(x)
+    xw = w + mag
+    xf = _to_fixed(x, xw)
+    ln2f = _constant('ln2', xw)
+    k = xf // ln2f
+    r = (xf - k * ln2f) >> (mag + s)
+
+    one = 1 << w
+    total = one
+    term = one
+    n = 1
+    while term:
+        term = (term * r >> w) // n
+        total += term
+        n += 1
+    for i in xrange(s):
+        total = total * total >> w
+    return (total, w - k)
+
+def exp(x, prec):
+    '''Return e**x with <prec> digits.'''
+    x = _to_decimal(x)
+    if not x:
+        return Decimal(1)
+    if x > _MAX_EXP_ARG:
+        raise OverflowError(_('Result too large'))
+    if x < -_MAX_EXP_ARG:
+        return Decimal(0)
+    (man, shift) = _exp_fixed(x, _working_bits(prec))
+    return _from_fixed(man, shift, prec)
+
+def _ln_near_one(xf, w):
+    '''Return ln(x) for fixed-point <xf> with <w> bits, x close to 1.'''
+
+    # ln(x) = 2 * atanh(z) with z = (x - 1) / (x + 1)
+    one = 1 << w
+    z = ((xf - one) << w) // (xf + one)
+    neg = z < 0
+    if neg:
+        z = -z
+    z2 = z * z >> w
+    total = z
+    term = z
+    k = 3
+    while term:
+        term = term * z2 >> w
+        total += term // k
+        k += 2
+    if neg:
+        return -2 * total
+    return 2 * total
+
+_DECIMAL_QUARTER = Decimal('0.25')
+
+def _ln_fixed(x, wp):
+    '''
+    Return (man, w) so that ln(x) = man / 2**w, for Decimal x > 0, with
+    <wp> significant bits.
+    '''
+
+    # Only the magnitude of x - 1 is needed
+    d = get_context(3).subtract(x, 1)
+    if d.copy_abs() < _DECIMAL_QUARTER:
+        # Close to 1 ln(x) is about x - 1, so more bits are needed
+        w = wp + _small_bits(d) + 4
+        return (_ln_near_one(_to_fixed(x, w), w), w)
+
+    # x = m * 2**b * 10**e with 1/sqrt(2) <= m <= sqrt(2)
+    e10 = x.adjusted()
+    w = wp + _bit_length(e10) + 8
+    mf = _to_fixed(x, w, -e10)
+    b = _bit_length(mf) - w - 1
+    if b > 0:
+        mf >>= b
+    if mf * mf > 2 << (2 * w):
+        mf >>= 1
+        b += 1
+    ret = _ln_near_one(mf, w)
+    if b:
+        ret += b * _constant('ln2', w)
+    if e10:
+        ret += e10 * _constant('ln10', w)
+    return (ret, w)
+
+def ln(x, prec):
+    '''Return the natural logarithm of x > 0 with <prec> digits.'''
+    x = _to_decimal(x)
+    if x <= 0:
+        raise ValueError(_('Logarithm(x) only defined for x > 0'))
+    if x == 1:
+        return Decimal(0)
+    (man, w) = _ln_fixed(x, _working_bits(prec))
+    return _from_fixed(man, w, prec)
+
+def log10(x, prec):
+    '''Return the base 10 logarithm of x > 0 with <prec> digits.'''
+    x = _to_decimal(x)
+    if x <= 0:
+        raise ValueError(_('Logarithm(x) only defined for x > 0'))
+
+    # Exact for powers of ten
+    (sign, digits, exp) = x.as_tuple()
+    if digits[0] == 1 and not any(digits[1:]):
+        return Decimal(exp + len(digits) - 1)
+
+    (man, w) = _ln_fixed(x, _working_bits(prec) + 4)
+    return _from_fixed((man << w) // _constant('ln10', w), w, prec)
+
+def sqrt(x, prec):
+    '''Return the square root of x >= 0 with <prec> digits.'''
+    x = _to_decimal(x)
+    if x < 0:
+        raise ValueError(_('Square root only defined for x >= 0'))
+    return get_context(prec).sqrt(x)
+
+def power(x, y, prec):
+    '''Return x**y for x > 0, or x = 0 and y > 0, with <prec> digits.'''
+    x = _to_decimal(x)
+    y = _to_decimal(y)
+    if x <= 0:
+        if x == 0 and y > 0:
+            return Decimal(0)
+        raise ValueError(_('Power only defined for x > 0'))
+    if x == 1 or not y:
+        return Decimal(1)
+
+    # The absolute error of y * ln(x) becomes the relative error of the
+    # result, so ln(x) needs as many extra digits as y * ln(x) has before
+    # the decimal point. abs(ln(x)) < 3 * (abs(x.adjusted()) + 1)
+    extra = max(0, y.adjusted() + 1) + len(str(3 * (abs(x.adjusted()) + 1)))
+    prec2 = prec + _GUARD_DIGITS + extra
+    return exp(get_context(prec2).multiply(y, ln(x, prec2)), prec)
+
+def _sincos_fixed(x, wp):
+    '''
+    Return (s, c, q, w): the sine and cosine of x reduced to the interval
+    [-pi/4, pi/4] as fixed-point integers with <w> bits, and the quadrant
+    q. Both have <wp> significant bits.
+    '''
+
+    if x.adjusted() >= MAX_ANGLE_DIGITS:
+        raise ValueError(_('Angle too large'))
+
+    # x = k * pi/2 + r. If x is close to a multiple of pi/2, r has fewer
+    # significant bits than the calculation, which is repeated with more.
+    mag = _magnitude_bits(x)
+    w = wp + _small_bits(x) + 4
+    while True:
+        xw = w + mag
+        xf = _to_fixed(x, xw)
+        p = _constant('pi', xw)
+        k = (4 * xf + p) // (2 * p)
+        r = (2 * xf - k * p) >> (mag + 1)
+        missing = wp - _bit_length(r)
+        if missing <= 0:
+            break
+        w += missing + 8
+
+    a = r
+    if a < 0:
+        a = -a
+    a2 = a * a >> w
+
+    sin = a
+    term = a
+    n = 2
+    while term:
+        term = (term * a2 >> w) // (n * (n + 1))
+        sin -= term
+        term = (term * a2 >> w) // ((n + 2) * (n + 3))
+        sin += term
+        n += 4
+
+    one = 1 << w
+    cos = one
+    term = one
+    n = 1
+    while term:
+        term = (term * a2 >> w) // (n * (n + 1))
+        cos -= term
+        term = (term * a2 >> w) // ((n + 2) * (n + 3))
+        cos += term
+        n += 4
+
+    if r < 0:
+        sin = -sin
+    return (sin, cos, k % 4, w)
+
+def sin(x, prec):
+    '''Return the sine of x (in radians) with <prec> digits.'''
+    x = _to_decimal(x)
+    if not x:
+        return x
+    (s, c, q, w) = _sincos_fixed(x, _working_bits(prec))
+    return _from_fixed((s, c, -s, -c)[q], w, prec)
+
+def cos(x, prec):
+    '''Return the cosine of x (in radians) with <prec> digits.'''
+    x = _to_decimal(x)
+    if not x:
+        return Decimal(1)
+    (s, c, q, w) = _sincos_fixed(x, _working_bits(prec))
+    return _from_fixed((c, -s, -c, s)[q], w, prec)
+
+def tan(x, prec):
+    '''Return the tangent of x (in radians) with <prec> digits.'''
+    x = _to_decimal(x)
+    if not x:
+        return x
+    (s, c, q, w) = _sincos_fixed(x, _working_bits(prec))
+    if q & 1:
+        (s, c) = (c, -s)
+    return _from_fixed((s << w) // c, w, prec)
+
+def _atan_fixed(x, wp):
+    '''Return (man, w): atan(x) = man / 2**w, with <wp> significant bits.'''
+
+    w = wp + _small_bits(x) + 8
+    one = 1 << w
+    a = _to_fixed(x.copy_abs(), w)
+    big = a > one
+    if big:
+        a = (one << w) // a
+
+    # atan(t) = 2 * atan(t / (1 + sqrt(1 + t**2)))
+    for i in xrange(_ATAN_HALVINGS):
+        a = (a << w) // (one + _isqrt((one << w) + a * a))
+
+    a2 = a * a >> w
+    total = a
+    term = a
+    k = 3
+    while term:
+        term = term * a2 >> w
+        total -= term // k
+        term = term * a2 >> w
+        total += term // (k + 2)
+        k += 4
+    total <<= _ATAN_HALVINGS
+
+    if big:
+        total = (_constant('pi', w) >> 1) - total
+    if x < 0:
+        total = -total
+    return (total, w)
+
+def atan(x, prec):
+    '''Return the arc tangent of x in radians with <prec> digits.'''
+    x = _to_decimal(x)
+    if not x:
+        return x
+    (man, w) = _atan_fixed(x, _working_bits(prec))
+    return _from_fixed(man, w, prec)
+
+def _exact_context(prec, x):
+    '''
+    Return a context in which 1 - x and 1 + x are exact, with at least
+    <prec> digits plus guard digits.
+    '''
+    return get_context(prec + _GUARD_DIGITS + max(0, -x.as_tuple()[2]) +
+                       max(0, x.adjusted()))
+
+def asin(x, prec):
+    '''Return the arc sine of -1 <= x <= 1 in radians with <prec> digits.'''
+    x = _to_decimal(x)
+    if x.copy_abs() > 1:
+        raise ValueError(_('asin(x) only defined for -1 <= x <= 1'))
+    if not x:
+        return x
+    if x.copy_abs() == 1:
+        ctx = get_context(prec)
+        return ctx.divide(ctx.multiply(pi(prec + _GUARD_DIGITS), x), 2)
+
+    # asin(x) = atan(x / sqrt((1 - x) * (1 + x)))
+    ctx = _exact_context(prec, x)
+    y = ctx.multiply(ctx.subtract(1, x), ctx.add(1, x))
+    y = ctx.divide(x, ctx.sqrt(y))
+    return atan(y, prec)
+
+def acos(x, prec):
+    '''Return the arc cosine of -1 <= x <= 1 in radians with <prec> digits.'''
+    x = _to_decimal(x)
+    if x.copy_abs() > 1:
+        raise ValueError(_('acos(x) only defined for -1 <= x <= 1'))
+    if x == 1:
+        return Decimal(0)
+    if x == -1:
+        return pi(prec)
+
+    # acos(x) = 2 * atan(sqrt((1 - x) / (1 + x)))
+    ctx = _exact_context(prec, x)
+    y = ctx.sqrt(ctx.divide(ctx.subtract(1, x), ctx.add(1, x)))
+    (man, w) = _atan_fixed(y, _working_bits(prec))
+    return _from_fixed(man, w - 1, prec)
+
+def sinh(x, prec):
+    '''Return the hyperbolic sine of x with <prec> digits.'''
+    x = _to_decimal(x)
+    if not x:
+        return x
+
+    # exp(x) - exp(-x) cancels for small x
+    prec2 = prec + _GUARD_DIGITS + max(0, -x.adjusted())
+    ctx = get_context(prec2)
+    ex = exp(x.copy_abs(), prec2)
+    ret = ctx.divide(ctx.subtract(ex, ctx.divide(1, ex)), 2)
+    if x < 0:
+        ret = ret.copy_negate()
+    return get_context(prec).plus(ret)
+
+def cosh(x, prec):
+    '''Return the hyperbolic cosine of x with <prec> digits.'''
+    x = _to_decimal(x)
+    prec2 = prec + _GUARD_DIGITS
+    ctx = get_context(prec2)
+    ex = exp(x.copy_abs(), prec2)
+    return get_context(prec).plus(
+            ctx.divide(ctx.add(ex, ctx.divide(1, ex)), 2))
+
+def tanh(x, prec):
+    '''Return the hyperbolic tangent of x with <prec> digits.'''
+    x = _to_decimal(x)
+    if not x:
+        return x
+
+    # 1 - tanh(x) is about 2 * exp(-2x)
+    if x.copy_abs() > prec * 2:
+        return Decimal(x > 0 and 1 or -1)
+
+    # tanh(x) = (exp(2x) - 1) / (exp(2x) + 1), which cancels for small x
+    prec2 = prec + _GUARD_DIGITS + max(0, -x.adjusted())
+    ctx = get_context(prec2)
+    ex = exp(ctx.multiply(x.copy_abs(), 2), prec2)
+    ret = ctx.divide(ctx.subtract(ex, 1), ctx.add(ex, 1))
+    if x < 0:
+        ret = ret.copy_negate()
+    return get_context(prec).plus(ret)
+
+def asinh(x, prec):
+    '''Return the inverse hyperbolic sine of x with <prec> digits.'''
+    x = _to_decimal(x)
+    if not x:
+        return x
+
+    a = x.copy_abs()
+    if a.adjusted() > prec + _GUARD_DIGITS:
+        # sqrt(x**2 + 1) is x to the used precision
+        ret = get_context(prec + _GUARD_DIGITS).add(
+                ln(a, prec + _GUARD_DIGITS), ln2(prec + _GUARD_DIGITS))
+    else:
+        # asinh(x) = ln(x + sqrt(x**2 + 1)), more digits for small x
+        prec2 = prec + _GUARD_DIGITS + max(0, -x.adjusted())
+        ctx = get_context(prec2)
+        y = ctx.add(a, ctx.sqrt(ctx.add(ctx.multiply(a, a), 1)))
+        ret = ln(y, prec2)
+    if x < 0:
+        ret = ret.copy_negate()
+    return get_context(prec).plus(ret)
+
+def acosh(x, prec):
+    '''Return the inverse hyperbolic cosine of x >= 1 with <prec> digits.'''
+    x = _to_decimal(x)
+    if x < 1:
+        raise ValueError(_('acosh(x) only defined for x >= 1'))
+    if x == 1:
+        return Decimal(0)
+
+    if x.adjusted() > prec + _GUARD_DIGITS:
+        return get_context(prec).add(
+                ln(x, prec + _GUARD_DIGITS), ln2(prec + _GUARD_DIGITS))
+
+    # acosh(x) = ln(x + sqrt((x - 1) * (x + 1))), close to 1 the result is
+    # about sqrt(2 * (x - 1)).
+    ctx = _exact_context(prec, x)
+    d = ctx.subtract(x, 1)
+    ctx = get_context(ctx.prec + max(0, -d.adjusted()))
+    y = ctx.add(x, ctx.sqrt(ctx.multiply(d, ctx.add(x, 1))))
+    return ln(y, prec)
+
+def atanh(x, prec):
+    '''Return the inverse hyperbolic tangent of -1 < x < 1, <prec> digits.'''
+    x = _to_decimal(x)
+    if x.copy_abs() >= 1:
+        raise ValueError(_('atanh(x) only defined for -1 < x < 1'))
+    if not x:
+        return x
+
+    # atanh(x) = ln((1 + x) / (1 - x)) / 2
+    ctx = _exact_context(prec, x)
+    ctx = get_context(ctx.prec + max(0, -x.adjusted()))
+    y = ctx.divide(ctx.add(1, x), ctx.subtract(1, x))
+    return get_context(prec).divide(ln(y, ctx.prec), 2)
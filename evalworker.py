@@ -0,0 +1,309 @@
+# evalworker.py, evaluate equations in a separate process
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import pickle
+from gettext import gettext as _
+
+import logging
+_logger = logging.getLogger('EvalWorker')
+
+try:
+    import multiprocessing
+    HAVE_MULTIPROCESSING = True
+except ImportError:
+    multiprocessing = None
+    HAVE_MULTIPROCESSING = False
+
+import gobject
+
+import functions
+from mathlib import MathLib
+from astparser import AstParser, ParserError, ParseError, RuntimeError, \
+        BudgetError, UndefinedError, WrongSyntaxError
+
+def is_svg(res):
+    return type(res) == str and res.find('</svg>') > -1
+
+# Parser errors are sent as tuples, they can contain references to the
+# parser itself.
+_ERROR_CLASSES = {
+    'ParseError': ParseError,
+    'RuntimeError': RuntimeError,
+    'BudgetError': BudgetError,
+    'UndefinedError': UndefinedError,
+}
+
+def _pack_error(e):
+    return (e.__class__.__name__, e._msg, e.get_range(), e.eqn,
+            getattr(e, 'help_text', None))
+
+def _unpack_error(data):
+    (name, msg, (start, end), eqn, help_text) = data
+    if name == 'WrongSyntaxError':
+        e = WrongSyntaxError(start=start, end=end)
+        e.help_text = help_text
+    else:
+        cls = _ERROR_CLASSES.get(name, RuntimeError)
+        e = cls(msg, start, eqn, end)
+    return e
+
+def _apply_settings(parser, ml, settings):
+    functions.angle_scaling.value = settings['angle_scaling']
+    if ml.digit_limit != settings['digit_limit']:
+        ml.set_digit_limit(settings['digit_limit'])
+        parser.set_precision(settings['digit_limit'])
+    if functions.exact_division.value != settings['exact_division'] or \
+            functions.rational_bit_limit.value != \
+            settings['rational_bit_limit']:
+        parser.set_division_mode(settings['exact_division'],
+                                 settings['rational_bit_limit'])
+
+def _worker_set_var(parser, name, value, is_eqn):
+    try:
+        if is_eqn:
+            value = parser.parse(value)
+        parser.set_var(name, value)
+    except ParserError, e:
+        _logger.error('Unable to set %s in worker: %s', name, e)
+
+def _worker_evaluate(parser, ml, req_id, eqn, label, alt_eqn, settings):
+    _apply_settings(parser, ml, settings)
+    try:
+        tree = parser.parse(eqn)
+        res = parser.evaluate(tree)
+
+        # Check whether assigning this label would cause recursion
+        if len(label) > 0:
+            lastpos = parser.get_label_cycle_ofs(label, tree)
+            if lastpos is not None:
+                raise RuntimeError(
+                        _('Can not assign label: will cause recursion'),
+                        lastpos)
+
+        if alt_eqn is not None and not is_svg(res):
+            res = parser.evaluate(parser.parse(alt_eqn))
+    except ParserError, e:
+        return ('error', req_id, _pack_error(e))
+
+    return ('result', req_id, res)
+
+def _worker_main(conn, plot_dir):
+    '''Main loop of the worker process.'''
+
+    ml = MathLib()
+    parser = AstParser(ml)
+    if plot_dir is not None:
+        parser.pl.cache.set_directory(plot_dir)
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+
+        if msg[0] == 'set_var':
+            _worker_set_var(parser, *msg[1:])
+        elif msg[0] == 'eval':
+            ret = _worker_evaluate(parser, ml, *msg[1:])
+            try:
+                conn.send(ret)
+            except (pickle.PicklingError, TypeError):
+                conn.send(('result', ret[1], unicode(ret[2])))
+        elif msg[0] == 'quit':
+            break
+
+    conn.close()
+
+class EvalWorker:
+    '''
+    Evaluates equations in a separate process that has its own AstParser,
+    so that long computations do not block the user interface. Results are
+    delivered from the gobject main loop as <result_cb>(req_id, result),
+    where result is a ParserError if evaluation failed.
+
+    Only one equation is evaluated at a time. It can be cancelled, and is
+    aborted if it takes longer than TIMEOUT seconds; in both cases the
+    worker process is killed and restarted. Variables set with set_var()
+    are replayed in the new process, so the label namespace stays the same
+    as in the user interface.
+    '''
+
+    TIMEOUT = 30
+
+    def __init__(self, ml, result_cb, plot_dir=None):
+        self._ml = ml
+        self._result_cb = result_cb
+        self._plot_dir = plot_dir
+
+        # name -> (sequence number, value, is_eqn)
+        self._vars = {}
+        self._var_seq = 0
+
+        self._process = None
+        self._conn = None
+        self._watch_id = None
+        self._timeout_id = None
+        self._pending = None
+        self._next_id = 0
+
+        self.start()
+
+    def start(self):
+        '''Start the worker process and restore the variables.'''
+
+        (conn, child_conn) = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_worker_main,
+                args=(child_conn, self._plot_dir))
+        self._process.daemon = True
+        self._process.start()
+        child_conn.close()
+
+        self._conn = conn
+        self._watch_id = gobject.io_add_watch(conn.fileno(),
+                gobject.IO_IN | gobject.IO_HUP, self._io_cb)
+        _logger.debug('Started worker process %d', self._process.pid)
+
+        variables = [(seq, name, value, is_eqn) for \
+                (name, (seq, value, is_eqn)) in self._vars.iteritems()]
+        variables.sort()
+        for (seq, name, value, is_eqn) in variables:
+            self._send(('set_var', name, value, is_eqn))
+
+    def stop(self):
+        '''Kill the worker process, dropping the equation being evaluated.'''
+
+        if self._process is None:
+            return
+
+        self._remove_timeout()
+        if self._watch_id is not None:
+            gobject.source_remove(self._watch_id)
+            self._watch_id = None
+
+        self._conn.close()
+        self._conn = None
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join(1)
+        self._process = None
+        self._pending = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def is_busy(self):
+        return self._pending is not None
+
+    def _send(self, msg):
+        try:
+            self._conn.send(msg)
+        except (pickle.PicklingError, TypeError), e:
+            _logger.error('Unable to send %s to worker: %s', msg[0], e)
+            return False
+        return True
+
+    def set_var(self, name, value, is_eqn=False):
+        '''
+        Set variable <name> in the worker. If <is_eqn> is True, value is an
+        equation that is parsed and assigned as a label.
+        '''
+
+        self._var_seq += 1
+        self._vars[name] = (self._var_seq, value, is_eqn)
+        self._send(('set_var', name, value, is_eqn))
+
+    def evaluate(self, eqn, label=u'', alt_eqn=None):
+        '''
+        Start evaluating <eqn> and return the request id, or None if the
+        worker is busy. If evaluation succeeds and <alt_eqn> is given, the
+        result of <alt_eqn> is returned instead.
+        '''
+
+        if self._pending is not None:
+            return None
+
+        self._next_id += 1
+        settings = {
+            'angle_scaling': functions.angle_scaling.value,
+            'digit_limit': self._ml.digit_limit,
+            'exact_division': functions.exact_division.value,
+            'rational_bit_limit': functions.rational_bit_limit.value,
+        }
+        if not self._send(('eval', self._next_id, eqn, label, alt_eqn,
+                           settings)):
+            return None
+
+        self._pending = self._next_id
+        self._timeout_id = gobject.timeout_add(self.TIMEOUT * 1000,
+                self._timeout_cb)
+        return self._pending
+
+    def cancel(self):
+        '''Cancel the pending evaluation, returns False if there was none.'''
+
+        if self._pending is None:
+            return False
+
+        _logger.debug('Cancelling request %d', self._pending)
+        self.restart()
+        return True
+
+    def _remove_timeout(self):
+        if self._timeout_id is not None:
+            gobject.source_remove(self._timeout_id)
+            self._timeout_id = None
+
+    def _finish(self, req_id, res):
+        if req_id != self._pending:
+            return
+        self._pending = None
+        self._remove_timeout()
+        self._result_cb(req_id, res)
+
+    def _timeout_cb(self):
+        self._timeout_id = None
+        req_id = self._pending
+        _logger.warning('Request %d timed out, restarting worker', req_id)
+        self.restart()
+        self._result_cb(req_id,
+                RuntimeError(_('Calculation took too long'), 0))
+        return False
+
+    def _io_cb(self, fd, cond):
+        msg = None
+        if cond & gobject.IO_IN:
+            try:
+                msg = self._conn.recv()
+            except (EOFError, IOError):
+                pass
+
+        if msg is None:
+            # The worker died
+            self._watch_id = None
+            req_id = self._pending
+            _logger.error('Worker process exited unexpectedly')
+            self.restart()
+            if req_id is not None:
+                self._result_cb(req_id,
+                        RuntimeError(_('Calculation failed'), 0))
+            return False
+
+        if msg[0] == 'error':
+            self._finish(msg[1], _unpack_error(msg[2]))
+        else:
+            self._finish(msg[1], msg[2])
+        return True
@@ -25,11 +25,18 @@
 import types
 import math
 import random
-from decimal import Decimal as _Decimal
-from rational import Rational as _Rational
+import operator
+from decimal import Decimal as _Decimal, ROUND_FLOOR as _ROUND_FLOOR, \
+        ROUND_CEILING as _ROUND_CEILING, ROUND_HALF_UP as _ROUND_HALF_UP
+from rational import Rational as _Rational, gcd as _gcd
+import decimalmath as _dm
+import intmath as _intmath
 
 from gettext import gettext as _
 
+# round() is redefined below
+_builtin_round = round
+
 # List of functions to allow translating the function names.
 _FUNCTIONS = [
     _('add'),
@@ -42,10 +49,12 @@ _FUNCTIONS = [
     _('atanh'),
     _('and'),
     _('b10bin'),
+    _('binomial'),
     _('ceil'),
     _('cos'),
     _('cosh'),
     _('div'),
+    _('divisors'),
     _('gcd'),
     _('exp'),
     _('factorial'),
@@ -54,9 +63,11 @@ _FUNCTIONS = [
     _('floor'),
     _('inv'),
     _('is_int'),
+    _('is_prime'),
     _('ln'),
     _('log10'),
     _('mul'),
+    _('nextprime'),
     _('or'),
     _('rand_float'),
     _('rand_int'),
@@ -69,9 +80,82 @@ _FUNCTIONS = [
     _('square'),
     _('tan'),
     _('tanh'),
+    _('totient'),
     _('xor'),
     ]    
 
+# Functions returning random values.
+_RANDOM_FUNCTIONS = [
+    'rand_float',
+    'rand_int',
+    ]
+
+# Functions whose result does not only depend on their arguments, either
+# because they are random or because they depend on the angle setting.
+# These are never evaluated while optimizing a parse tree.
+_IMPURE_FUNCTIONS = _RANDOM_FUNCTIONS + [
+    'acos',
+    'asin',
+    'atan',
+    'cos',
+    'sin',
+    'sinc',
+    'tan',
+    ]
+
+def _log2(x):
+    x = abs(long(x))
+    if x < 2:
+        return 0
+    return math.log(x, 2)
+
+def _factorial_bits(n):
+    if type(n) not in (types.IntType, types.LongType) or n < 3:
+        return None
+    # Stirling: log2(n!) ~= n * log2(n / e)
+    return n * (math.log(n, 2) - math.log(math.e, 2)) + _log2(n)
+
+def _binomial_bits(n, k):
+    if type(n) not in (types.IntType, types.LongType) or \
+            type(k) not in (types.IntType, types.LongType) or \
+            k <= 0 or k >= n:
+        return None
+    # log2(C(n, k)) <= n * H(k / n), H being the binary entropy
+    p = float(k) / n
+    return -n * (p * math.log(p, 2) + (1 - p) * math.log(1 - p, 2))
+
+def _pow_bits(x, y):
+    if isinstance(y, _Rational) and not is_int(y):
+        # Fractional exponents give an exact result for perfect powers
+        if y <= 1:
+            return None
+        scale = float(y)
+    elif not is_int(y) or y <= 1:
+        return None
+    else:
+        scale = long(y)
+    if isinstance(x, _Rational):
+        return max(_log2(x.n), _log2(x.d)) * scale
+    elif is_int(x):
+        return _log2(x) * scale
+    return None
+
+def _shift_left_bits(x, y):
+    if not is_int(x) or not is_int(y) or y <= 0 or x == 0:
+        return None
+    return _log2(x) + long(y)
+
+# Estimates of the number of bits in the result of functions that can build
+# huge integers, used to refuse a calculation before it is started. They
+# return None if the result is not an exact integer or fraction.
+_RESULT_BITS = {
+    'binomial': _binomial_bits,
+    'fac': _factorial_bits,
+    'factorial': _factorial_bits,
+    'pow': _pow_bits,
+    'shift_left': _shift_left_bits,
+    }
+
 def _d(val):
     '''Return a _Decimal object.'''
 
@@ -79,6 +163,8 @@ def _d(val):
         return val
     elif type(val) in (types.IntType, types.LongType):
         return _Decimal(val)
+    elif isinstance(val, _Rational):
+        return val.to_decimal()
     elif type(val) == types.StringType:
         d = _Decimal(val)
         return d.normalize()
@@ -100,24 +186,288 @@ class ClassValue:
 
 angle_scaling = ClassValue(1.0)
 
+# Number of significant digits to which the elementary functions are
+# calculated as Decimals, or None to use floats.
+precision = ClassValue(None)
+
+# Division of two integers gives an exact Rational if both are smaller than
+# _RATIONAL_CUTOFF, or of any size if exact_division is True. A Rational
+# result whose numerator or denominator has more than rational_bit_limit
+# bits (None for no limit) is replaced by a Decimal approximation, so that
+# long calculations with fractions do not slow down without bound.
+exact_division = ClassValue(False)
+rational_bit_limit = ClassValue(4096)
+
+# Settings that are changed through AstParser, they are not plug-in
+# variables that the user can see or redefine.
+_SETTINGS = [
+    'exact_division',
+    'precision',
+    'rational_bit_limit',
+    ]
+
+_RATIONAL_CUTOFF = 1000000000000
+
+# rational_bit_limit.value and the corresponding value 2**bits
+_bit_limit = [None, None]
+
+def _limit_rational(x):
+    bits = rational_bit_limit.value
+    if bits is None:
+        return x
+    if bits != _bit_limit[0]:
+        _bit_limit[:] = [bits, 1L << bits]
+    limit = _bit_limit[1]
+    n = x.n
+    if x.d < limit and n < limit and -n < limit:
+        return x
+    return x.to_decimal()
+
+def _make_rational_op(op):
+    '''Return <op> with rational_bit_limit applied to Rational results.'''
+    def handler(x, y):
+        ret = op(x, y)
+        if type(ret) is _Rational:
+            return _limit_rational(ret)
+        return ret
+    return handler
+
+# Arithmetic operators dispatch on the types of both operands: the handler
+# for a (type(x), type(y)) pair is looked up in a table per operator. On a
+# miss, a resolver picks the handler for that pair once and stores it, so
+# the coercion rules are only evaluated for new combinations of types.
+# Pairs without a fast path use the generic implementation, which accepts
+# any values.
+
+_INT_TYPES = (types.IntType, types.LongType)
+_NATIVE_TYPES = (types.IntType, types.LongType, types.FloatType)
+# Types that Rational operators accept
+_RATIONAL_OPERAND_TYPES = (_Rational, types.IntType, types.LongType,
+                           types.FloatType, _Decimal)
+# Exponents and bases for which Rational.__pow__ is exact or returns a
+# Decimal; float powers keep using the generic implementation
+_RATIONAL_POW_TYPES = (_Rational, types.IntType, types.LongType, _Decimal)
+
+def _resolve_handler(table, resolve, x, y):
+    key = (type(x), type(y))
+    handler = resolve(key[0], key[1])
+    table[key] = handler
+    return handler
+
+def _make_arith_resolver(op, generic):
+    '''
+    Return a resolver for add, sub and mul: native numbers and Decimals
+    combined with integers use the operator directly, as do Rationals,
+    which handle the other number types themselves. All other pairs are
+    converted by <generic>.
+    '''
+    rational_op = _make_rational_op(op)
+
+    def resolve(tx, ty):
+        if tx in _NATIVE_TYPES and ty in _NATIVE_TYPES:
+            return op
+        if (tx is _Decimal or tx in _INT_TYPES) and \
+                (ty is _Decimal or ty in _INT_TYPES):
+            return op
+        if (tx is _Rational and ty in _RATIONAL_OPERAND_TYPES) or \
+                (ty is _Rational and tx in _RATIONAL_OPERAND_TYPES):
+            return rational_op
+        return generic
+    return resolve
+
+def _add_generic(x, y):
+    if isinstance(x, _Decimal) or isinstance(y, _Decimal):
+        x = _d(x)
+        y = _d(y)
+    return x + y
+
+def _sub_generic(x, y):
+    if isinstance(x, _Decimal) or isinstance(y, _Decimal):
+        x = _d(x)
+        y = _d(y)
+    return x - y
+
+def _mul_generic(x, y):
+    if isinstance(x, _Decimal) or isinstance(y, _Decimal):
+        x = _d(x)
+        y = _d(y)
+    return x * y
+
+def _div_generic(x, y):
+    if y == 0 or y == 0.0:
+        raise ValueError(_('Can not divide by zero'))
+
+    if is_int(x) and is_int(y) and (exact_division.value or \
+            (float(abs(x)) < _RATIONAL_CUTOFF and \
+             float(abs(y)) < _RATIONAL_CUTOFF)):
+        return _limit_rational(_Rational(x, y))
+
+    if isinstance(x, _Decimal) or isinstance(y, _Decimal):
+        x = _d(x)
+        y = _d(y)
+
+    return x / y
+
+def _div_int(x, y):
+    if y == 0:
+        raise ValueError(_('Can not divide by zero'))
+    if -_RATIONAL_CUTOFF < x < _RATIONAL_CUTOFF and \
+            -_RATIONAL_CUTOFF < y < _RATIONAL_CUTOFF:
+        return _Rational(x, y)
+    if exact_division.value:
+        return _limit_rational(_Rational(x, y))
+    return _Decimal(x) / _Decimal(y)
+
+def _div_float(x, y):
+    if y == 0.0:
+        raise ValueError(_('Can not divide by zero'))
+    if x.is_integer() and abs(x) < _RATIONAL_CUTOFF and \
+            y.is_integer() and abs(y) < _RATIONAL_CUTOFF:
+        return _Rational(x, y)
+    return x / y
+
+def _div_rational(x, y):
+    if not y:
+        raise ValueError(_('Can not divide by zero'))
+    ret = x / y
+    if type(ret) is _Rational:
+        return _limit_rational(ret)
+    return ret
+
+def _resolve_div(tx, ty):
+    if tx in _INT_TYPES and ty in _INT_TYPES:
+        return _div_int
+    if tx is types.FloatType and ty is types.FloatType:
+        return _div_float
+    if (tx is _Rational and ty in _RATIONAL_OPERAND_TYPES) or \
+            (ty is _Rational and tx in _RATIONAL_OPERAND_TYPES):
+        return _div_rational
+    return _div_generic
+
+def _pow_generic(x, y):
+    if is_int(y):
+        if is_int(x):
+            return long(x) ** int(y)
+        elif hasattr(x, '__pow__'):
+            return x ** y
+        else:
+            return float(x) ** int(y)
+    else:
+        prec = precision.value
+        if prec is not None:
+            return _dm.power(_d(x), _d(y), prec)
+        if isinstance(x, _Decimal) or isinstance(y, _Decimal):
+            x = _d(x)
+            y = _d(y)
+        return _d(math.pow(float(x), float(y)))
+
+def _pow_int(x, y):
+    return long(x) ** y
+
+_pow_rational = _make_rational_op(operator.pow)
+
+def _resolve_pow(tx, ty):
+    if tx in _INT_TYPES and ty in _INT_TYPES:
+        return _pow_int
+    if (tx is _Rational and ty in _RATIONAL_POW_TYPES) or \
+            (ty is _Rational and tx in _RATIONAL_POW_TYPES):
+        return _pow_rational
+    return _pow_generic
+
+def _make_shift_resolver(op):
+    def generic(x, y):
+        if is_int(x) and is_int(y):
+            return op(int(x), int(y))
+        else:
+            raise ValueError(_('Bitwise operations only apply to integers'))
+
+    def resolve(tx, ty):
+        if tx in _INT_TYPES and ty in _INT_TYPES:
+            return op
+        return generic
+    return resolve
+
+_ADD_HANDLERS = {}
+_SUB_HANDLERS = {}
+_MUL_HANDLERS = {}
+_DIV_HANDLERS = {}
+_POW_HANDLERS = {}
+_SHIFT_LEFT_HANDLERS = {}
+_SHIFT_RIGHT_HANDLERS = {}
+
+_resolve_add = _make_arith_resolver(operator.add, _add_generic)
+_resolve_sub = _make_arith_resolver(operator.sub, _sub_generic)
+_resolve_mul = _make_arith_resolver(operator.mul, _mul_generic)
+_resolve_shift_left = _make_shift_resolver(operator.lshift)
+_resolve_shift_right = _make_shift_resolver(operator.rshift)
+
+def _decimal_angle_scaling(prec):
+    '''Return angle_scaling.value as a Decimal, None for radians.'''
+    scaling = angle_scaling.value
+    if scaling == 1:
+        return None
+    elif scaling == math.pi / 180:
+        return _dm.get_context(prec).divide(_dm.pi(prec), 180)
+    else:
+        return _d(scaling)
+
 def _scale_angle(x):
-    return x * angle_scaling.value
+    prec = precision.value
+    if prec is None:
+        return float(x) * angle_scaling.value
+
+    x = _d(x)
+    scaling = _decimal_angle_scaling(prec)
+    if scaling is None:
+        return x
+    return _dm.get_context(prec).multiply(x, scaling)
 
 def _inv_scale_angle(x):
-    return x / angle_scaling.value
+    prec = precision.value
+    if prec is None:
+        return x / angle_scaling.value
+
+    scaling = _decimal_angle_scaling(prec)
+    if scaling is None:
+        return x
+    return _dm.get_context(prec).divide(x, scaling)
+
+def _to_integral(x, rounding):
+    '''Return <x> rounded to an integer exactly.'''
+    if is_int(x):
+        return long(x)
+    if isinstance(x, _Rational):
+        (n, d) = (x.n, x.d)
+        if rounding == _ROUND_FLOOR:
+            return n // d
+        elif rounding == _ROUND_CEILING:
+            return -(-n // d)
+        elif n < 0:
+            return -((d - 2 * n) // (2 * d))
+        else:
+            return (2 * n + d) // (2 * d)
+    return long(_d(x).to_integral_value(rounding=rounding))
 
 def abs(x):
+    if precision.value is not None and type(x) is not types.FloatType:
+        return operator.abs(x)
     return math.fabs(x)
 abs.__doc__ = _(
 'abs(x), return absolute value of x, which means -x for x < 0')
 
 def acos(x):
+    prec = precision.value
+    if prec is not None:
+        return _inv_scale_angle(_dm.acos(_d(x), prec))
     return _inv_scale_angle(math.acos(x))
 acos.__doc__ = _(
 'acos(x), return the arc cosine of x. This is the angle for which the cosine \
 is x. Defined for -1 <= x < 1')
 
 def acosh(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.acosh(_d(x), prec)
     return math.acosh(x)
 acosh.__doc__ = _(
 'acosh(x), return the arc hyperbolic cosine of x. This is the value y for \
@@ -129,31 +479,43 @@ And.__doc__ = _(
 'And(x, y), logical and. Returns True if x and y are True, else returns False')
 
 def add(x, y):
-    if isinstance(x, _Decimal) or isinstance(y, _Decimal):
-        x = _d(x)
-        y = _d(y)
-    return x + y
+    handler = _ADD_HANDLERS.get((type(x), type(y)), None)
+    if handler is None:
+        handler = _resolve_handler(_ADD_HANDLERS, _resolve_add, x, y)
+    return handler(x, y)
 add.__doc__ = _('add(x, y), return x + y')
 
 def asin(x):
+    prec = precision.value
+    if prec is not None:
+        return _inv_scale_angle(_dm.asin(_d(x), prec))
     return _inv_scale_angle(math.asin(x))
 asin.__doc__ = _(
 'asin(x), return the arc sine of x. This is the angle for which the sine is x. \
 Defined for -1 <= x <= 1')
 
 def asinh(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.asinh(_d(x), prec)
     return math.asinh(x)
 asinh.__doc__ = _(
 'asinh(x), return the arc hyperbolic sine of x. This is the value y for \
 which the hyperbolic sine equals x.')
 
 def atan(x):
+    prec = precision.value
+    if prec is not None:
+        return _inv_scale_angle(_dm.atan(_d(x), prec))
     return _inv_scale_angle(math.atan(x))
 atan.__doc__ = _(
 'atan(x), return the arc tangent of x. This is the angle for which the tangent \
 is x. Defined for all x')
 
 def atanh(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.atanh(_d(x), prec)
     return math.atanh(x)
 atanh.__doc__ = _(
 'atanh(x), return the arc hyperbolic tangent of x. This is the value y for \
@@ -178,68 +540,73 @@ b10bin.__doc__ = _(
 'b10bin(x), interpret a number written in base 10 as binary, e.g.: \
 b10bin(10111) = 23,')
 
+def binomial(n, k):
+    TYPES = (types.IntType, types.LongType)
+    if type(n) not in TYPES or type(k) not in TYPES:
+        raise ValueError(_('Binomial coefficient only defined for integers'))
+    return _intmath.binomial(n, k)
+binomial.__doc__ = _(
+'binomial(n, k), return the binomial coefficient of n and k. This is the \
+number of ways to choose k items out of n, given by n! / (k! * (n - k)!).')
+
 def ceil(x):
+    if precision.value is not None:
+        return _to_integral(x, _ROUND_CEILING)
     return math.ceil(float(x))
 ceil.__doc__ = _('ceil(x), return the smallest integer larger than x.')
 
 def cos(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.cos(_scale_angle(x), prec)
     return math.cos(_scale_angle(x))
 cos.__doc__ = _(
 'cos(x), return the cosine of x. This is the x-coordinate on the unit circle \
 at the angle x')
 
 def cosh(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.cosh(_d(x), prec)
     return math.cosh(x)
 cosh.__doc__ = _(
 'cosh(x), return the hyperbolic cosine of x. Given by (exp(x) + exp(-x)) / 2')
 
 def div(x, y):
-    if y == 0 or y == 0.0:
-        raise ValueError(_('Can not divide by zero'))
+    handler = _DIV_HANDLERS.get((type(x), type(y)), None)
+    if handler is None:
+        handler = _resolve_handler(_DIV_HANDLERS, _resolve_div, x, y)
+    return handler(x, y)
 
-    if is_int(x) and float(abs(x)) < 1e12 and \
-            is_int(y) and float(abs(y)) < 1e12:
-        return _Rational(x, y)
-
-    if isinstance(x, _Decimal) or isinstance(y, _Decimal):
-        x = _d(x)
-        y = _d(y)
-
-    return x / y
-
-def _do_gcd(a, b):
-    if b == 0:
-        return a
-    else:
-        return _do_gcd(b, a % b)
+def divisors(n):
+    n = _int_arg(n)
+    if n == 0:
+        raise ValueError(_('Divisors only defined for n != 0'))
+    return ", ".join(["%d" % d for d in _intmath.divisors(operator.abs(n))])
+divisors.__doc__ = _(
+'divisors(n), return the positive integers that divide n without remainder. \
+For example: divisors(12) = 1, 2, 3, 4, 6, 12')
 
 def gcd( a, b):
     TYPES = (types.IntType, types.LongType)
     if type(a) not in TYPES or type(b) not in TYPES:
         raise ValueError(_('Invalid argument'))
-    return _do_gcd(a, b)
+    return _gcd(a, b)
 gcd.__doc__ = _(
 'gcd(a, b), determine the greatest common denominator of a and b. \
 For example, the biggest factor that is shared by the numbers 15 and 18 is 3.')
 
 def exp(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.exp(_d(x), prec)
     return math.exp(float(x))
 exp.__doc__ = _('exp(x), return the natural exponent of x. Given by e^x')
 
 def factorial(n):
     if type(n) not in (types.IntType, types.LongType):
         raise ValueError(_('Factorial only defined for integers'))
-
-    if n == 0:
-        return 1
-
-    n = long(n)
-    res = long(n)
-    while n > 2:
-        res *= n - 1
-        n -= 1
-
-    return res
+    return _intmath.factorial(n)
 factorial.__doc__ = _(
 'factorial(n), return the factorial of n. \
 Given by n * (n - 1) * (n - 2) * ...')
@@ -249,36 +616,34 @@ def fac(x):
 fac.__doc__ = _(
 'fac(x), return the factorial of x. Given by x * (x - 1) * (x - 2) * ...')
 
+def _int_arg(x):
+    '''Return <x> as an int or long, raise ValueError if not integral.'''
+    if not is_int(x):
+        raise ValueError(_('Only defined for integers'))
+    return int(x)
+
 def factorize(x):
     if not is_int(x):
         return 0
 
-    factors = []
-    num = x
-    i = 2
-    while i <= math.sqrt(num):
-        if num % i == 0:
-            factors.append(i)
-            num /= i
-            i = 2
-        elif i == 2:
-            i += 1
-        else:
-            i += 2
-    factors.append(num)
+    x = int(x)
+    if -2 < x < 2:
+        return "1 * %d" % x
+    factors = _intmath.factorize(operator.abs(x))
+    if x < 0:
+        factors.insert(0, -1)
 
     if len(factors) == 1:
         return "1 * %d" % x
     else:
-        ret = "%d" % factors[0]
-        for fac in factors[1:]:
-            ret += " * %d" % fac
-        return ret
+        return " * ".join(["%d" % fac for fac in factors])
 factorize.__doc__ = (
 'factorize(x), determine the prime factors that together form x. \
 For examples: 15 = 3 * 5.')
 
 def floor(x):
+    if precision.value is not None:
+        return _to_integral(x, _ROUND_FLOOR)
     return math.floor(float(x))
 floor.__doc__ = _('floor(x), return the largest integer smaller than x.')
 
@@ -302,7 +667,18 @@ def is_int(n):
     return e >= 0
 is_int.__doc__ = ('is_int(n), determine whether n is an integer.')
 
+def is_prime(n):
+    if not is_int(n):
+        return False
+    return _intmath.is_prime(int(n))
+is_prime.__doc__ = _(
+'is_prime(n), determine whether n is a prime number, which means it is only \
+divisible by 1 and itself.')
+
 def ln(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.ln(_d(x), prec)
     if float(x) > 0:
         return math.log(float(x))
     else:
@@ -312,8 +688,11 @@ ln.__doc__ = _(
 exponent exp() equals x. Defined for x >= 0.')
 
 def log10(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.log10(_d(x), prec)
     if float(x) > 0:
-        return math.log(float(x))
+        return math.log10(float(x))
     else:
         raise ValueError(_('Logarithm(x) only defined for x > 0'))
 log10.__doc__ = _(
@@ -330,34 +709,31 @@ mod.__doc__ = _(
 after dividing x by y.')
 
 def mul(x, y):
-    if isinstance(x, _Decimal) or isinstance(y, _Decimal):
-        x = _d(x)
-        y = _d(y)
-    return x * y
+    handler = _MUL_HANDLERS.get((type(x), type(y)), None)
+    if handler is None:
+        handler = _resolve_handler(_MUL_HANDLERS, _resolve_mul, x, y)
+    return handler(x, y)
 mul.__doc__ = _('mul(x, y), return x * y')
 
 def negate(x):
     return -x
 negate.__doc__ = _('negate(x), return -x')
 
+def nextprime(n):
+    return _intmath.nextprime(_int_arg(n))
+nextprime.__doc__ = _(
+'nextprime(n), return the smallest prime number larger than n.')
+
 def Or(x, y):
     return x | y
 Or.__doc__ = _(
 'Or(x, y), logical or. Returns True if x or y is True, else returns False')
 
 def pow(x, y):
-    if is_int(y):
-        if is_int(x):
-            return long(x) ** int(y)
-        elif hasattr(x, '__pow__'):
-            return x ** y
-        else:
-            return float(x) ** int(y)
-    else:
-        if isinstance(x, _Decimal) or isinstance(y, _Decimal):
-            x = _d(x)
-            y = _d(y)
-        return _d(math.pow(float(x), float(y)))
+    handler = _POW_HANDLERS.get((type(x), type(y)), None)
+    if handler is None:
+        handler = _resolve_handler(_POW_HANDLERS, _resolve_pow, x, y)
+    return handler(x, y)
 pow.__doc__ = _('pow(x, y), return x to the power y (x**y)')
 
 def rand_float():
@@ -372,32 +748,42 @@ rand_int.__doc__ = _(
 <maxval> is an optional argument and is set to 65535 by default.')
 
 def round(x):
-    return math.round(float(x))
+    if precision.value is not None:
+        return _to_integral(x, _ROUND_HALF_UP)
+    return _builtin_round(float(x))
 round.__doc__ = _('round(x), return the integer nearest to x.')
 
 def shift_left(x, y):
-    if is_int(x) and is_int(y):
-        return _d(int(x) << int(y))
-    else:
-        raise ValueError(_('Bitwise operations only apply to integers'))
+    handler = _SHIFT_LEFT_HANDLERS.get((type(x), type(y)), None)
+    if handler is None:
+        handler = _resolve_handler(_SHIFT_LEFT_HANDLERS, _resolve_shift_left,
+                               x, y)
+    return handler(x, y)
 shift_left.__doc__ = _(
 'shift_left(x, y), shift x by y bits to the left (multiply by 2 per bit)')
 
 def shift_right(x, y):
-    if is_int(x) and is_int(y):
-        return _d(int(x) >> int(y))
-    else:
-        raise ValueError(_('Bitwise operations only apply to integers'))
+    handler = _SHIFT_RIGHT_HANDLERS.get((type(x), type(y)), None)
+    if handler is None:
+        handler = _resolve_handler(_SHIFT_RIGHT_HANDLERS, _resolve_shift_right,
+                               x, y)
+    return handler(x, y)
 shift_right.__doc__ = _(
 'shift_right(x, y), shift x by y bits to the right (divide by 2 per bit)')
 
 def sin(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.sin(_scale_angle(x), prec)
     return math.sin(_scale_angle(x))
 sin.__doc__ = _(
 'sin(x), return the sine of x. This is the y-coordinate on the unit circle at \
 the angle x')
 
 def sinh(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.sinh(_d(x), prec)
     return math.sinh(x)
 sinh.__doc__ = _(
 'sinh(x), return the hyperbolic sine of x. Given by (exp(x) - exp(-x)) / 2')
@@ -405,11 +791,14 @@ sinh.__doc__ = _(
 def sinc(x):
     if float(x) == 0.0:
         return 1
-    return sin(x) / x
+    return div(sin(x), x)
 sinc.__doc__ = _(
 'sinc(x), return the sinc of x. This is given by sin(x) / x.')
 
 def sqrt(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.sqrt(_d(x), prec)
     return math.sqrt(float(x))
 sqrt.__doc__ = _(
 'sqrt(x), return the square root of x. This is the value for which the square \
@@ -420,13 +809,16 @@ def square(x):
 square.__doc__ = _('square(x), return x * x')
 
 def sub(x, y):
-    if isinstance(x, _Decimal) or isinstance(y, _Decimal):
-        x = _d(x)
-        y = _d(y)
-    return x - y
+    handler = _SUB_HANDLERS.get((type(x), type(y)), None)
+    if handler is None:
+        handler = _resolve_handler(_SUB_HANDLERS, _resolve_sub, x, y)
+    return handler(x, y)
 sub.__doc__ = _('sub(x, y), return x - y')
 
 def tan(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.tan(_scale_angle(x), prec)
     return math.tan(_scale_angle(x))
 tan.__doc__ = _(
 'tan(x), return the tangent of x. This is the slope of the line from the origin \
@@ -434,10 +826,22 @@ of the unit circle to the point on the unit circle defined by the angle x. Given
 by sin(x) / cos(x)')
 
 def tanh(x):
+    prec = precision.value
+    if prec is not None:
+        return _dm.tanh(_d(x), prec)
     return math.tanh(x)
 tanh.__doc__ = _(
 'tanh(x), return the hyperbolic tangent of x. Given by sinh(x) / cosh(x)')
 
+def totient(n):
+    n = _int_arg(n)
+    if n < 1:
+        raise ValueError(_('Totient only defined for n >= 1'))
+    return _intmath.totient(n)
+totient.__doc__ = _(
+'totient(n), return Euler\'s totient of n: the number of integers from 1 to n \
+that have no common factor with n.')
+
 def xor(x, y):
     return x ^ y
 xor.__doc__ = _(
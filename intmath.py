@@ -0,0 +1,419 @@
+# intmath.py, functions on (big) integers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Integer functions built on a cached table of primes.
+
+is_prime() uses the sieve for small numbers and Miller-Rabin above that.
+factorize() divides out the primes below TRIAL_LIMIT and splits what
+remains with Pollard's rho method in Brent's variant. Factorizations are
+memoized, so that divisors(), totient() and repeated calls with the same
+number are cheap.
+
+factorial() uses the prime swing algorithm: n! = ((n // 2)!)**2 * swing(n),
+where the swing number n! / ((n // 2)!)**2 is a product of primes <= n with
+small exponents that follow from the digits of n in base p. binomial()
+builds C(n, k) from its prime factorization in the same way. The factors
+are multiplied as a balanced tree, so that most multiplications are
+between numbers of similar size, for which long multiplication is fastest.
+'''
+
+import bisect
+
+from gettext import gettext as _
+
+from rational import gcd
+from lrucache import LRUCache
+
+# The sieve grows at least to this limit
+_MIN_SIEVE = 1024
+
+# Sorted list of the primes up to _sieve_limit[0]
+_primes = []
+_sieve_limit = [0]
+
+def bit_length(n):
+    '''Return the number of bits of abs(n).'''
+    if n == 0:
+        return 0
+    return len(bin(n)) - (n < 0 and 3 or 2)
+
+def isqrt(n):
+    '''Return the integer square root of n >= 0.'''
+    if n < 0:
+        raise ValueError(_('Square root only defined for x >= 0'))
+    if n == 0:
+        return 0
+    # Newton's method, starting above the root
+    x = 1 << ((bit_length(n) + 1) // 2)
+    while True:
+        y = (x + n // x) >> 1
+        if y >= x:
+            return x
+        x = y
+
+def _extend_sieve(n):
+    '''Sieve the primes up to at least <n>, doubling the previous limit.'''
+
+    limit = max(n, 2 * _sieve_limit[0], _MIN_SIEVE)
+
+    # Odd numbers only: sieve[i] is set if 2 * i + 1 is prime
+    half = (limit + 1) // 2
+    sieve = bytearray([1]) * half
+    sieve[0] = 0
+    i = 1
+    while True:
+        p = 2 * i + 1
+        start = p * p // 2
+        if start >= half:
+            break
+        if sieve[i]:
+            sieve[start::p] = bytearray(len(xrange(start, half, p)))
+        i += 1
+
+    primes = [2]
+    primes.extend([2 * i + 1 for i in xrange(half) if sieve[i]])
+    _primes[:] = primes
+    _sieve_limit[0] = limit
+
+def primes_up_to(n):
+    '''Return a list of the primes <= <n>.'''
+    if n > _sieve_limit[0]:
+        _extend_sieve(n)
+    return _primes[:bisect.bisect_right(_primes, n)]
+
+def product(factors, lo=0, hi=None):
+    '''Return the product of factors[lo:hi], multiplied as a balanced tree.'''
+    if hi is None:
+        hi = len(factors)
+    if hi - lo <= 8:
+        ret = 1
+        for i in xrange(lo, hi):
+            ret *= factors[i]
+        return ret
+    mid = (lo + hi) // 2
+    return product(factors, lo, mid) * product(factors, mid, hi)
+
+_SMALL_FACTORIALS = [1]
+for _i in range(1, 30):
+    _SMALL_FACTORIALS.append(_SMALL_FACTORIALS[-1] * _i)
+
+# Below this n multiplying one factor at a time is faster
+_MIN_SWING = 320
+
+def _swing(n):
+    '''Return the swing number n! / ((n // 2)!)**2.'''
+
+    primes = primes_up_to(n)
+    root = isqrt(n)
+    factors = []
+
+    # The exponent of p is the number of odd quotients n // p**i
+    i = 0
+    while primes[i] <= root:
+        p = primes[i]
+        q = n
+        f = 1
+        while True:
+            q //= p
+            if q == 0:
+                break
+            if q & 1:
+                f *= p
+        if f > 1:
+            factors.append(f)
+        i += 1
+
+    # Above the root there is one quotient: n // p. It is 2 for primes in
+    # (n / 3, n / 2] and 1 above n / 2.
+    third = bisect.bisect_right(primes, n // 3)
+    for j in xrange(i, third):
+        p = primes[j]
+        if (n // p) & 1:
+            factors.append(p)
+    factors.extend(primes[bisect.bisect_right(primes, n // 2):])
+
+    return product(factors)
+
+def factorial(n):
+    '''Return n! for integer n >= 0.'''
+    if n < 0:
+        raise ValueError(_('Factorial only defined for n >= 0'))
+    if n < len(_SMALL_FACTORIALS):
+        return _SMALL_FACTORIALS[n]
+    if n < _MIN_SWING:
+        ret = _SMALL_FACTORIALS[-1]
+        for i in xrange(len(_SMALL_FACTORIALS), n + 1):
+            ret *= i
+        return ret
+    half = factorial(n // 2)
+    return half * half * _swing(n)
+
+# Above this n binomial() divides the product of n - k + 1 .. n by k!
+# instead of sieving the primes up to n.
+_MAX_BINOMIAL_SIEVE = 10000000
+
+# The division takes time quadratic in the size of k!, about a second at
+# this many bits. binomial() refuses larger k for n above the sieve limit.
+MAX_BINOMIAL_DIVISOR_BITS = 1000000
+
+def binomial(n, k):
+    '''
+    Return the binomial coefficient C(n, k) for integers n >= 0, k. Raises
+    ValueError if n is above the sieve limit and k is too large.
+    '''
+
+    if n < 0:
+        raise ValueError(_('Binomial coefficient only defined for n >= 0'))
+    if k < 0 or k > n:
+        return 0
+    k = min(k, n - k)
+
+    if k < 64:
+        ret = 1
+        for i in xrange(1, k + 1):
+            ret = ret * (n - k + i) // i
+        return ret
+
+    if n > _MAX_BINOMIAL_SIEVE:
+        # k * bit_length(k) is slightly above the size of k!
+        if k * bit_length(k) > MAX_BINOMIAL_DIVISOR_BITS:
+            raise ValueError(_('Number too large to calculate'))
+        return product(xrange(n - k + 1, n + 1)) // factorial(k)
+
+    # Kummer: the exponent of p is the number of borrows when subtracting
+    # k from n in base p.
+    primes = primes_up_to(n)
+    root = isqrt(n)
+    factors = []
+    i = 0
+    while primes[i] <= root:
+        p = primes[i]
+        (nn, kk) = (n, k)
+        borrow = 0
+        f = 1
+        while nn:
+            b = kk % p + borrow
+            if nn % p < b:
+                f *= p
+                borrow = 1
+            else:
+                borrow = 0
+            nn //= p
+            kk //= p
+        if f > 1:
+            factors.append(f)
+        i += 1
+
+    # Above the root there is a single digit, with a borrow if
+    # n % p < k % p. That always holds for primes in (n - k, n], and never
+    # for primes in (n / 2, n - k].
+    half = bisect.bisect_right(primes, n // 2)
+    for j in xrange(i, half):
+        p = primes[j]
+        if n % p < k % p:
+            factors.append(p)
+    factors.extend(primes[bisect.bisect_right(primes, n - k):])
+
+    return product(factors)
+
+# Miller-Rabin with these bases is exact below _MILLER_RABIN_LIMIT. Above
+# it more bases are used, and a composite passes with a probability below
+# 4**-20.
+_MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+_MILLER_RABIN_LIMIT = 3317044064679887385961981
+_MILLER_RABIN_EXTRA_BASES = (43, 47, 53, 59, 61, 67, 71)
+
+# factorize() divides by the primes below this limit before using rho
+TRIAL_LIMIT = 1000
+
+# Maximum number of rho steps per factor, enough for factors of about 12
+# digits. Larger factors take too long to find.
+MAX_RHO_STEPS = 1 << 21
+
+# divisors() refuses numbers with more divisors than this
+MAX_DIVISORS = 100000
+
+def _miller_rabin(n):
+    '''Return whether odd n > 41 is a (probable) prime.'''
+    d = n - 1
+    s = 0
+    while not d & 1:
+        d >>= 1
+        s += 1
+
+    bases = _MILLER_RABIN_BASES
+    if n >= _MILLER_RABIN_LIMIT:
+        bases += _MILLER_RABIN_EXTRA_BASES
+    for a in bases:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for i in xrange(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+def is_prime(n):
+    '''
+    Return whether integer <n> is a prime. The answer is certain below
+    3.3 * 10**24, above that it is right with overwhelming probability.
+    '''
+
+    if n < 2:
+        return False
+    if n <= _sieve_limit[0]:
+        i = bisect.bisect_left(_primes, n)
+        return i < len(_primes) and _primes[i] == n
+    for p in _MILLER_RABIN_BASES:
+        if n % p == 0:
+            return n == p
+    return _miller_rabin(n)
+
+def nextprime(n):
+    '''Return the smallest prime larger than integer <n>.'''
+    if n < 2:
+        return 2
+    n += 1 + (n & 1)
+    while not is_prime(n):
+        n += 2
+    return n
+
+def _rho(n):
+    '''
+    Return a nontrivial factor of the composite <n>, which has no factors
+    below TRIAL_LIMIT, or None if none was found in MAX_RHO_STEPS.
+    '''
+
+    # Brent's variant of Pollard's rho: y runs through y**2 + c (mod n),
+    # and the differences with x, saved at powers of two, are multiplied
+    # so that gcd() is only needed once per 128 steps.
+    for c in xrange(1, 10):
+        y = 2
+        r = 1
+        q = 1
+        g = 1
+        while g == 1:
+            if r > MAX_RHO_STEPS:
+                return None
+            x = y
+            for i in xrange(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for i in xrange(min(128, r - k)):
+                    y = (y * y + c) % n
+                    q = q * (x - y) % n
+                g = gcd(q, n)
+                k += 128
+            r *= 2
+
+        if g == n:
+            # The batch contained all factors, redo it one step at a time
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = gcd(x - ys, n)
+        if g != n:
+            return g
+    return None
+
+_factor_cache = LRUCache(256)
+
+def clear_factor_cache():
+    _factor_cache.clear()
+
+def factorize(n):
+    '''
+    Return the prime factors of integer n >= 1 in increasing order, each
+    repeated as often as it divides n. Raises ValueError if a factor could
+    not be found within MAX_RHO_STEPS.
+    '''
+
+    if n < 1:
+        raise ValueError(_('Factorization only defined for n >= 1'))
+    ret = _factor_cache.get(n, None)
+    if ret is not None:
+        return list(ret)
+
+    factors = []
+    m = n
+    for p in primes_up_to(TRIAL_LIMIT):
+        if p * p > m:
+            break
+        while m % p == 0:
+            factors.append(p)
+            m //= p
+
+    # What remains has no factors below TRIAL_LIMIT
+    stack = []
+    if m > 1:
+        stack.append(m)
+    while stack:
+        m = stack.pop()
+        if m < TRIAL_LIMIT * TRIAL_LIMIT or is_prime(m):
+            factors.append(m)
+            continue
+        d = _rho(m)
+        if d is None:
+            raise ValueError(_('Number too large to factorize'))
+        stack.append(d)
+        stack.append(m // d)
+
+    factors.sort()
+    _factor_cache.set(n, tuple(factors))
+    return factors
+
+def factor_powers(n):
+    '''Return the prime factorization of n >= 1 as a list of (p, e).'''
+    ret = []
+    for p in factorize(n):
+        if ret and ret[-1][0] == p:
+            ret[-1][1] += 1
+        else:
+            ret.append([p, 1])
+    return [tuple(i) for i in ret]
+
+def divisors(n):
+    '''
+    Return the divisors of integer n >= 1 in increasing order. Raises
+    ValueError if there are more than MAX_DIVISORS.
+    '''
+
+    factors = factor_powers(n)
+    count = 1
+    for (p, e) in factors:
+        count *= e + 1
+    if count > MAX_DIVISORS:
+        raise ValueError(_('Too many divisors'))
+
+    ret = [1]
+    for (p, e) in factors:
+        powers = [p ** i for i in xrange(1, e + 1)]
+        ret += [d * q for d in ret for q in powers]
+    ret.sort()
+    return ret
+
+def totient(n):
+    '''Return Euler's totient of n >= 1, the number of k <= n coprime to n.'''
+    ret = 1
+    for (p, e) in factor_powers(n):
+        ret *= (p - 1) * p ** (e - 1)
+    return ret
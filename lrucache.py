@@ -0,0 +1,131 @@
+# lrucache.py, size-bounded least recently used cache
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Indices into the entries of the linked list
+_PREV = 0
+_NEXT = 1
+_KEY = 2
+_VALUE = 3
+
+class LRUCache:
+    '''
+    Dictionary-like cache holding at most <max_items> entries. If <max_size>
+    is given, the total size of the values, as determined by <sizeof>, is
+    limited as well. When full, the least recently used entries are
+    evicted. Entries are kept in a circular doubly linked list so that all
+    operations are O(1).
+
+    hits, misses and evictions count what happened since the last clear().
+    '''
+
+    def __init__(self, max_items=256, max_size=None, sizeof=len):
+        self.max_items = max_items
+        self.max_size = max_size
+        self._sizeof = sizeof
+        self.clear()
+
+    def clear(self):
+        self._map = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _is_full(self):
+        if len(self._map) > self.max_items:
+            return True
+        return self.max_size is not None and self.size > self.max_size
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def _unlink(self, entry):
+        entry[_PREV][_NEXT] = entry[_NEXT]
+        entry[_NEXT][_PREV] = entry[_PREV]
+
+    def _link_front(self, entry):
+        root = self._root
+        entry[_PREV] = root
+        entry[_NEXT] = root[_NEXT]
+        root[_NEXT][_PREV] = entry
+        root[_NEXT] = entry
+
+    def get(self, key, default=None):
+        '''Return the value for <key> and mark it as most recently used.'''
+        entry = self._map.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._unlink(entry)
+        self._link_front(entry)
+        return entry[_VALUE]
+
+    def set(self, key, value):
+        '''Store <value> under <key>, evicting old entries if required.'''
+        entry = self._map.get(key, None)
+        if entry is not None:
+            self._unlink(entry)
+            if self.max_size is not None:
+                self.size -= self._sizeof(entry[_VALUE])
+            entry[_VALUE] = value
+        else:
+            entry = [None, None, key, value]
+            self._map[key] = entry
+        self._link_front(entry)
+        if self.max_size is not None:
+            self.size += self._sizeof(value)
+
+        while self._is_full():
+            self.evict()
+
+    def remove(self, key):
+        '''Remove <key> from the cache, if present.'''
+        entry = self._map.pop(key, None)
+        if entry is not None:
+            self._unlink(entry)
+            if self.max_size is not None:
+                self.size -= self._sizeof(entry[_VALUE])
+
+    def evict(self):
+        '''Remove the least recently used entry and return its key.'''
+        entry = self._root[_PREV]
+        if entry is self._root:
+            return None
+        self._unlink(entry)
+        del self._map[entry[_KEY]]
+        if self.max_size is not None:
+            self.size -= self._sizeof(entry[_VALUE])
+        self.evictions += 1
+        return entry[_KEY]
+
+    def get_stats(self):
+        '''Return a dictionary with cache statistics.'''
+        return {
+            'items': len(self._map),
+            'max_items': self.max_items,
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -21,7 +21,7 @@
 import types
 import inspect
 import math
-from decimal import Decimal
+from decimal import Decimal, Context, getcontext
 from rational import Rational
 import random
 
@@ -57,6 +57,10 @@ class MathLib:
     FORMAT_EXPONENT = 1
     FORMAT_SCIENTIFIC = 2
 
+    # Converting all digits of an integer takes time quadratic in their
+    # number, so larger integers are formatted from their leading digits.
+    EXACT_INT_BITS = 20000
+
     def __init__(self):
         self.set_format_type(self.FORMAT_SCIENTIFIC)
         self.set_digit_limit(9)
@@ -150,9 +154,72 @@ class MathLib:
         ret = self._BASE_FUNC_MAP[base](long(n))
         return ret.rstrip('L')
 
+    def int_to_decimal(self, n):
+        '''
+        Return integer <n> as a Decimal. Integers with more than
+        EXACT_INT_BITS bits are rounded to 10 more digits than digit_limit,
+        which is enough to format them.
+        '''
+
+        bits = len('%x' % n) * 4
+        if bits <= self.EXACT_INT_BITS:
+            return Decimal(n)
+
+        # n = m * 2**shift, m keeping somewhat more than prec digits
+        prec = self.digit_limit + 10
+        shift = bits - int(prec * 3.33) - 16
+        ctx = Context(prec=prec)
+        if n < 0:
+            m = -(-n >> shift)
+        else:
+            m = n >> shift
+        return ctx.multiply(Decimal(m), ctx.power(Decimal(2), shift))
+
+    def rational_to_decimal(self, n):
+        '''
+        Return Rational <n> as a Decimal with digit_limit significant digits,
+        truncated. The digits are computed with integer arithmetic, so they
+        are exact for fractions of any size and do not depend on the
+        precision of the Decimal context.
+        '''
+
+        (num, den) = (n.n, n.d)
+        if den == 1:
+            return Decimal(num)
+        sign = ''
+        if num < 0:
+            sign = '-'
+            num = -num
+
+        # Estimate the decimal exponent from the number of hex digits, then
+        # scale so that the integer quotient has at least digit_limit digits
+        exp = int((len('%x' % num) - len('%x' % den)) * 4 * math.log10(2))
+        shift = self.digit_limit + 2 - exp
+        while True:
+            if shift >= 0:
+                q = num * 10 ** shift // den
+            else:
+                q = num // (den * 10 ** -shift)
+            digits = str(q)
+            if len(digits) >= self.digit_limit:
+                break
+            shift += self.digit_limit + 1 - len(digits)
+
+        exp = len(digits) - self.digit_limit - shift
+        return Decimal('%s%sE%d' % (sign, digits[:self.digit_limit], exp))
+
     def format_decimal(self, n):
         if self.chop_zeros:
-            n = n.normalize()
+            (sign, digits, exp) = n.as_tuple()
+            if len(digits) > getcontext().prec:
+                # normalize() would round to the context precision
+                zeros = 0
+                while zeros < len(digits) - 1 and digits[-1 - zeros] == 0:
+                    zeros += 1
+                if zeros > 0:
+                    n = Decimal((sign, digits[:-zeros], exp + zeros))
+            else:
+                n = n.normalize()
         (sign, digits, exp) = n.as_tuple()
         if len(digits) > self.digit_limit:
             exp += len(digits) - self.digit_limit
@@ -160,7 +227,7 @@ class MathLib:
         if len(digits) < self.digit_limit:
             exp -= self.digit_limit - len(digits)
             digits += (0,) * (self.digit_limit - len(digits))
-            print exp, digits
+            _logger.debug('Padded digits: %r, exponent %d', digits, exp)
         if sign:
             res = "-"
         else:
@@ -223,9 +290,11 @@ class MathLib:
         elif type(n) is types.FloatType:
             n = self.d(n)
         elif type(n) is types.LongType:
-            n = self.d(n)
+            if self.integer_base != 10:
+                return self.format_int(n)
+            n = self.int_to_decimal(n)
         elif isinstance(n, Rational):
-            n = self.d(Decimal(n.n) / Decimal(n.d))
+            n = self.rational_to_decimal(n)
         elif not isinstance(n, Decimal):
             return _('Error: unsupported type')
 
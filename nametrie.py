@@ -0,0 +1,104 @@
+# nametrie.py, prefix tree for completing names
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Indices into the nodes of the tree
+_CHILDREN = 0
+_TERMINAL = 1
+
+class NameTrie:
+    '''
+    Prefix tree of names, each with a rank. find() returns the names
+    starting with a prefix in O(length of prefix + size of the results),
+    ordered by rank, then length, then alphabetically.
+
+    version is incremented on every change, so that callers can cache
+    results.
+    '''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._root = [{}, False]
+        self._ranks = {}
+        self.version = 0
+
+    def __len__(self):
+        return len(self._ranks)
+
+    def __contains__(self, name):
+        return name in self._ranks
+
+    def add(self, name, rank=0):
+        '''Add <name>, or change its rank if it already exists.'''
+
+        self.version += 1
+        if name in self._ranks:
+            self._ranks[name] = rank
+            return
+
+        node = self._root
+        for ch in name:
+            child = node[_CHILDREN].get(ch, None)
+            if child is None:
+                child = [{}, False]
+                node[_CHILDREN][ch] = child
+            node = child
+        node[_TERMINAL] = True
+        self._ranks[name] = rank
+
+    def remove(self, name):
+        '''Remove <name>, if present.'''
+
+        if name not in self._ranks:
+            return
+        self.version += 1
+        del self._ranks[name]
+
+        path = [self._root]
+        for ch in name:
+            path.append(path[-1][_CHILDREN][ch])
+        path[-1][_TERMINAL] = False
+
+        # Drop nodes that no longer lead to a name
+        for i in range(len(name), 0, -1):
+            node = path[i]
+            if node[_TERMINAL] or node[_CHILDREN]:
+                break
+            del path[i - 1][_CHILDREN][name[i - 1]]
+
+    def find(self, prefix):
+        '''Return the names starting with <prefix>, best ranked first.'''
+
+        node = self._root
+        for ch in prefix:
+            node = node[_CHILDREN].get(ch, None)
+            if node is None:
+                return []
+
+        names = []
+        stack = [(node, prefix)]
+        while stack:
+            (node, name) = stack.pop()
+            if node[_TERMINAL]:
+                names.append(name)
+            for (ch, child) in node[_CHILDREN].iteritems():
+                stack.append((child, name + ch))
+
+        ranks = self._ranks
+        ret = [(ranks[name], len(name), name) for name in names]
+        ret.sort()
+        return [name for (rank, length, name) in ret]
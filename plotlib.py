@@ -19,22 +19,159 @@
 #    2007-09-04: rwh, first version
 
 import types
+import os
+import time
+import hashlib
+import StringIO
 
 import logging
 _logger = logging.getLogger('PlotLib')
 
+import functions
+import vecfunctions
+from lrucache import LRUCache
+
 USE_MPL = True
 
+_INF = float('inf')
+_NAN = float('nan')
+
 def format_float(x):
     return ('%.2f' % x).rstrip('0').rstrip('.')
 
+class PlotCache:
+    """
+    Cache of produced plots, keyed by a hash of everything that determines
+    the plot. Plots are kept in memory up to <max_size> bytes and, once a
+    directory is set, also on disk up to <max_disk_size> bytes.
+    """
+
+    def __init__(self, max_size=4*1024*1024, max_disk_size=16*1024*1024):
+        self._memory = LRUCache(max_items=256, max_size=max_size)
+        self._dir = None
+        self.max_disk_size = max_disk_size
+
+    def set_directory(self, path):
+        """Keep plots on disk in directory <path>, None to disable."""
+
+        if path is not None and not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError, e:
+                _logger.error('Unable to create plot cache directory: %s', e)
+                path = None
+        self._dir = path
+
+    def get_key(self, *parts):
+        """Return the key for a plot determined by <parts>."""
+        data = u'\n'.join([unicode(p) for p in parts])
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def _get_filename(self, key):
+        return os.path.join(self._dir, key + '.svg')
+
+    def get(self, key):
+        """Return the svg data of plot <key>, or None."""
+
+        svg = self._memory.get(key)
+        if svg is not None or self._dir is None:
+            return svg
+
+        fn = self._get_filename(key)
+        try:
+            f = open(fn, 'rb')
+            try:
+                svg = f.read()
+            finally:
+                f.close()
+            os.utime(fn, None)
+        except (IOError, OSError):
+            return None
+
+        self._memory.set(key, svg)
+        return svg
+
+    def set(self, key, svg):
+        """Store svg data <svg> for plot <key>."""
+
+        self._memory.set(key, svg)
+        if self._dir is None:
+            return
+
+        fn = self._get_filename(key)
+        try:
+            f = open(fn + '.tmp', 'wb')
+            try:
+                f.write(svg)
+            finally:
+                f.close()
+            os.rename(fn + '.tmp', fn)
+        except (IOError, OSError), e:
+            _logger.error('Unable to write plot cache: %s', e)
+            return
+
+        self._trim_directory()
+
+    def _trim_directory(self):
+        """Remove the least recently used plots if the directory is full."""
+
+        files = []
+        total = 0
+        for name in os.listdir(self._dir):
+            if not name.endswith('.svg'):
+                continue
+            fn = os.path.join(self._dir, name)
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, fn))
+            total += st.st_size
+
+        files.sort()
+        while total > self.max_disk_size and len(files) > 0:
+            mtime, size, fn = files.pop(0)
+            try:
+                os.remove(fn)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        self._memory.clear()
+
+    def get_stats(self):
+        return self._memory.get_stats()
+
 class _PlotBase:
     """Class to generate an svg plot for a function.
     Evaluation of values is done using the EqnParser class."""
 
+    # Sample adaptively instead of at equally spaced points
+    ADAPTIVE = True
+
+    # Deviation from a straight line, relative to the range of the curve,
+    # above which an interval is subdivided
+    TOLERANCE = 0.002
+
+    # Change in value, relative to the range of the curve, above which an
+    # interval is considered steep and checked for discontinuities
+    JUMP_TOLERANCE = 0.05
+
+    # Maximum number of bisections to confirm a discontinuity
+    JUMP_STEPS = 5
+
+    # Without budget left to bisect, an interval is a discontinuity if its
+    # slope is this many times the slopes of the neighbouring intervals
+    STEP_RATIO = 4
+
     def __init__(self, parser):
         self.svg_data = ""
         self.parser = parser
+        self.cache = PlotCache()
+        self._last_plot = None
+        self._point_error = None
+        self._eval_state = None
 
     def get_svg(self):
         return self.svg_data
@@ -42,28 +179,271 @@ class _PlotBase:
     def set_svg(self, data):
         self.svg_data = data
 
-    def evaluate(self, eqn, var, range, points=100):
+    def _to_float(self, val):
+        '''Convert an evaluation result to a float, None if not finite.'''
+        try:
+            val = float(val)
+        except Exception:
+            return None
+        if val != val or val in (_INF, -_INF):
+            return None
+        return val
+
+    def evaluate_points(self, eqn, var, xs, vectorize=True):
+        '''
+        Evaluate <eqn> for all values <xs> of variable <var>. Returns a list
+        of floats, with None where the equation is not defined. Other errors,
+        such as undefined variables or exceeding a budget, are raised.
+        NumPy is used if available and <vectorize> is True.
+        '''
+
+        if len(xs) == 0:
+            return []
+
+        # Imported here, astparser imports this module
+        from astparser import RuntimeError, BudgetError, UndefinedError
+
+        if vecfunctions.HAVE_NUMPY and vectorize:
+            ys = self.parser.evaluate_vector(eqn, var, xs)
+            if ys is not None:
+                if self._eval_state is not None:
+                    self._eval_state.charge(len(xs))
+                return [self._to_float(y) for y in ys.tolist()]
+
         x_old = self.parser.get_var(var)
+        ys = []
+        try:
+            for x in xs:
+                self.parser.set_var(var, x)
+                try:
+                    y = self.parser.evaluate(eqn, self._eval_state)
+                    ys.append(self._to_float(y))
+                except (BudgetError, UndefinedError):
+                    raise
+                except RuntimeError, e:
+                    # Outside the domain of the equation, e.g. log(x) at 0
+                    _logger.debug('No value at %s=%r: %s', var, x, e)
+                    if self._point_error is None:
+                        self._point_error = e
+                    ys.append(None)
+        finally:
+            self.parser.set_var(var, x_old)
+        return ys
+
+    def evaluate_uniform(self, eqn, var, range, points=100):
+        '''Evaluate <eqn> at <points> equally spaced values of <var>.'''
+
+        x0 = float(range[0])
+        d = (float(range[1]) - x0) / (points - 1)
+        xs = [x0 + i * d for i in xrange(points)]
+        return zip(xs, self.evaluate_points(eqn, var, xs))
+
+    def _get_yscale(self, ys):
+        '''
+        Return the typical range of the values in <ys>, ignoring outliers
+        such as values close to a pole.
+        '''
+
+        ys = sorted([y for y in ys if y is not None])
+        if len(ys) == 0:
+            return 1.0
+        n = len(ys) - 1
+        scale = ys[int(n * 0.9)] - ys[int(n * 0.1)]
+        if scale <= 0:
+            scale = ys[-1] - ys[0]
+        if scale <= 0:
+            scale = max(abs(ys[0]), 1.0)
+        return scale
+
+    def _find_refinements(self, xs, ys, yscale, min_dx):
+        '''
+        Return the indices of intervals (xs[i], xs[i + 1]) that should be
+        subdivided, most important first.
+        '''
+
+        prio = {}
+        def flag(i, p):
+            if xs[i + 1] - xs[i] > min_dx and p > prio.get(i, 0):
+                prio[i] = p
+
+        for i in xrange(len(xs) - 1):
+            y0, y1 = ys[i], ys[i + 1]
+            if y0 is None or y1 is None:
+                # Locate the edge of the domain
+                if y0 is not None or y1 is not None:
+                    flag(i, _INF)
+                continue
+
+            # Steep intervals
+            dy = abs(y1 - y0) / yscale
+            if dy > self.JUMP_TOLERANCE:
+                flag(i, dy)
+
+            # Curvature: deviation of the middle point from the chord
+            if i == 0 or ys[i - 1] is None:
+                continue
+            x0, x1, x2 = xs[i - 1], xs[i], xs[i + 1]
+            ya = ys[i - 1]
+            dev = abs(y0 - (ya + (y1 - ya) * (x1 - x0) / (x2 - x0))) / yscale
+            if dev > self.TOLERANCE:
+                flag(i - 1, dev)
+                flag(i, dev)
+
+        ret = prio.keys()
+        ret.sort(key=lambda i: prio[i], reverse=True)
+        return ret
+
+    def _is_jump(self, eqn, var, x0, y0, x1, y1, yscale, budget):
+        '''
+        Determine whether there is a discontinuity between x0 and x1 by
+        bisecting towards the half that carries the change in value. For a
+        continuous function the change is shared between both halves once
+        the interval is small enough.
+
+        Returns (is_jump, x of the jump, evaluations used). is_jump is None
+        if the budget ran out before this could be decided.
+        '''
+
+        used = 0
+        for step in xrange(self.JUMP_STEPS):
+            if used >= budget:
+                # Out of budget: a sign change between large values is most
+                # likely a pole
+                if y0 * y1 < 0 and min(abs(y0), abs(y1)) > yscale:
+                    return (True, (x0 + x1) / 2, used)
+                return (None, (x0 + x1) / 2, used)
+
+            xm = (x0 + x1) / 2
+            ym = self.evaluate_points(eqn, var, [xm])[0]
+            used += 1
+            if ym is None:
+                return (True, xm, used)
+
+            dy = abs(y1 - y0)
+            if abs(ym - y0) >= abs(y1 - ym):
+                x1, y1 = xm, ym
+                part = abs(ym - y0)
+            else:
+                x0, y0 = xm, ym
+                part = abs(y1 - ym)
+            if part < 0.75 * dy:
+                return (False, xm, used)
+
+        return (True, (x0 + x1) / 2, used)
+
+    def _is_step(self, xs, ys, i):
+        '''
+        Return whether the slope of interval (xs[i], xs[i + 1]) is more than
+        STEP_RATIO times that of the neighbouring intervals, as it is at a
+        discontinuity that could not be bisected.
+        '''
+
+        slope = abs(ys[i + 1] - ys[i]) / (xs[i + 1] - xs[i])
+        for j in (i - 1, i + 1):
+            if j < 0 or j + 1 >= len(xs) or \
+                    ys[j] is None or ys[j + 1] is None:
+                continue
+            dy = abs(ys[j + 1] - ys[j])
+            if slope <= self.STEP_RATIO * dy / (xs[j + 1] - xs[j]):
+                return False
+        return True
+
+    def evaluate_adaptive(self, eqn, var, range, points=100):
+        '''
+        Evaluate <eqn> for variable <var> in <range>, using at most <points>
+        evaluations. A coarse grid is refined where the curve bends or is
+        steep. Returns a list of (x, y) pairs, where y is None at points
+        where the curve is interrupted: outside the domain of the equation
+        or at a discontinuity such as a pole.
+        '''
+
+        x0, x1 = float(range[0]), float(range[1])
+        n = max(points / 4, min(points, 9))
+        if x0 == x1 or n >= points:
+            return self.evaluate_uniform(eqn, var, range, points)
+
+        d = (x1 - x0) / (n - 1)
+        xs = [x0 + i * d for i in xrange(n)]
+        ys = self.evaluate_points(eqn, var, xs)
+        yscale = self._get_yscale(ys)
+        min_dx = abs(x1 - x0) / (points * 16)
+
+        # Keep part of the budget to check discontinuities
+        budget = points - n
+        refine_budget = budget - budget / 4
+        while refine_budget > 0:
+            todo = self._find_refinements(xs, ys, yscale, min_dx)
+            if len(todo) == 0:
+                break
+            todo = sorted(todo[:refine_budget])
+            xms = [(xs[i] + xs[i + 1]) / 2 for i in todo]
+            yms = self.evaluate_points(eqn, var, xms)
+            budget -= len(xms)
+            refine_budget -= len(xms)
+
+            for j in xrange(len(todo) - 1, -1, -1):
+                xs.insert(todo[j] + 1, xms[j])
+                ys.insert(todo[j] + 1, yms[j])
+
+        # Find discontinuities, biggest jumps first
+        jumps = []
+        for i in xrange(len(xs) - 1):
+            if ys[i] is not None and ys[i + 1] is not None:
+                dy = abs(ys[i + 1] - ys[i]) / yscale
+                if dy > self.JUMP_TOLERANCE:
+                    jumps.append((dy, i))
+        jumps.sort(reverse=True)
+
+        gaps = []
+        for dy, i in jumps:
+            isjump, x, used = self._is_jump(eqn, var, xs[i], ys[i],
+                                            xs[i + 1], ys[i + 1], yscale,
+                                            budget)
+            budget -= used
+            if isjump is None:
+                isjump = self._is_step(xs, ys, i)
+            if isjump:
+                gaps.append((i, x))
+
+        vals = zip(xs, ys)
+        gaps.sort(reverse=True)
+        for i, x in gaps:
+            vals.insert(i + 1, (x, None))
+
+        return vals
+
+    def evaluate(self, eqn, var, range, points=100):
+        '''
+        Evaluate <eqn> to be plotted, see evaluate_adaptive(). If ADAPTIVE
+        is False the points are equally spaced. Raises the error of the
+        first point if the equation can not be evaluated at any point, and
+        a BudgetError if all evaluations together exceed the budgets of the
+        parser.
+        '''
 
         if type(eqn) in (types.StringType, types.UnicodeType):
             eqn = self.parser.parse(eqn)
 
-        res = []
-        d = float((range[1] - range[0])) / (points - 1)
-        x = range[0]
-        while points > 0:
-            self.parser.set_var(var, x)
-            ret = self.parser.evaluate(eqn)
-            if ret is not None:
-                v = float(ret)
+        # All evaluations for the plot share the evaluation budgets
+        self._point_error = None
+        self._eval_state = self.parser.new_eval_state()
+        try:
+            if self.ADAPTIVE:
+                vals = self.evaluate_adaptive(eqn, var, range, points)
             else:
-                v = 0
-            res.append((x, v))
-            x += d
-            points -= 1
-
-        self.parser.set_var(var, x_old)
-        return res
+                vals = self.evaluate_uniform(eqn, var, range, points)
+        finally:
+            self._eval_state = None
+
+        # Not defined anywhere in the range: report why. Vectorized
+        # evaluation gives nan instead of an error.
+        if len(vals) > 0 and \
+                len([y for (x, y) in vals if y is not None]) == 0:
+            if self._point_error is None:
+                self.evaluate_points(eqn, var, [vals[0][0]], vectorize=False)
+            if self._point_error is not None:
+                raise self._point_error
+        return vals
 
     def export_plot(self, fn):
         f = open(fn, "w")
@@ -78,7 +458,7 @@ class _PlotBase:
         '''
         Plot function <eqn>.
 
-        kwargs can contain: 'points'
+        kwargs can contain: 'points', the maximum number of evaluations
 
         The last item in kwargs is interpreted as the variable that should
         be varied.
@@ -98,6 +478,18 @@ class _PlotBase:
         for var, range in kwargs.iteritems():
             _logger.info('Plot range for var %s: %r', var, range)
 
+        if type(eqn) in (types.StringType, types.UnicodeType):
+            eqn = self.parser.parse(eqn)
+
+        key = self.get_cache_key(eqn, var, range, points)
+        if key is not None:
+            svg = self.cache.get(key)
+            if svg is not None:
+                _logger.debug('Using cached plot %s', key)
+                self.set_svg(svg)
+                self._last_plot = None
+                return svg
+
         vals = self.evaluate(eqn, var, range, points=points)
         _logger.debug('vals are %r', vals)
         svg = self.produce_plot(vals, xlabel=var, ylabel='f(x)')
@@ -106,60 +498,142 @@ class _PlotBase:
 
 #        self.export_plot("/tmp/calculate_graph.svg")
         if type(svg) is types.UnicodeType:
-            return svg.encode('utf-8')
+            svg = svg.encode('utf-8')
+        if key is not None:
+            self.cache.set(key, svg)
+        return svg
+
+    def get_cache_key(self, eqn, var, range, points):
+        """
+        Return the plot cache key for plotting <eqn>, or None if the plot
+        can not be cached because it is random.
+        """
+
+        tree_key = self.parser.get_tree_key(eqn, exclude=(var,))
+        if tree_key is None:
+            return None
+        return self.cache.get_key(self.__class__.__name__, tree_key, var,
+                                  repr(range), points, self.ADAPTIVE,
+                                  repr(functions.angle_scaling.value),
+                                  repr(functions.precision.value),
+                                  repr(functions.exact_division.value),
+                                  repr(functions.rational_bit_limit.value),
+                                  getattr(self, 'PRECISION', ''))
+
+class SVGWriter:
+    """
+    Class to write svg elements, either to a file object or, if no file
+    object is given, to a buffer that can be read with getvalue().
+    Coordinates are written with <precision> digits after the dot.
+    """
+
+    def __init__(self, out=None, precision=2):
+        self._parts = []
+        if out is None:
+            self.write = self._parts.append
         else:
-            return svg
+            self.write = out.write
+        self._coord_fmt = '%%.%df' % precision
+
+    def getvalue(self):
+        return ''.join(self._parts)
+
+    def format_coord(self, val):
+        ret = self._coord_fmt % val
+        if '.' in ret:
+            ret = ret.rstrip('0').rstrip('.')
+        if ret == '-0':
+            ret = '0'
+        return ret
+
+    def start(self, width, height):
+        self.write('<?xml version="1.0" standalone="no"?>\n')
+        self.write('<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n')
+        self.write('<svg width="%d" height="%d" version="1.1" xmlns="http://www.w3.org/2000/svg">\n' % (width, height))
+
+    def finish(self):
+        self.write('</svg>')
+
+    def line(self, c0, c1, col):
+        fmt = self.format_coord
+        self.write('<line style="stroke:%s;stroke-width:1" x1="%s" y1="%s" x2="%s" y2="%s" />\n' % (col, fmt(c0[0]), fmt(c0[1]), fmt(c1[0]), fmt(c1[1])))
+
+    def path(self, coords, col):
+        """Write a line through <coords> as compact path data."""
+        fmt = self.format_coord
+        points = ['%s %s' % (fmt(x), fmt(y)) for (x, y) in coords]
+        if len(points) == 0:
+            return
+        self.write('<path style="fill:none;stroke:%s;stroke-width:1" d="M%s' % (col, points[0]))
+        if len(points) > 1:
+            self.write('L')
+            self.write(' '.join(points[1:]))
+        self.write('" />\n')
+
+    def text(self, c, text, rotate=0):
+        if type(text) is types.UnicodeType:
+            text = text.encode('utf-8')
+        fmt = self.format_coord
+
+        self.write('<text x="%s" y="%s"' % (fmt(c[0]), fmt(c[1])))
+        if rotate != 0:
+            self.write(' transform="rotate(%d)"' % (rotate))
+        self.write('>%s</text>\n' % (text))
 
 class CustomPlot(_PlotBase):
 
+    # Number of digits after the dot in coordinates
+    PRECISION = 2
+
     def __init__(self, parser):
         _PlotBase.__init__(self, parser)
 
         self.set_size(0, 0)
+        self._writer = None
+        self._buffered = True
 
     def set_size(self, width, height):
         self.width = width
         self.height = height
 
-    def create_image(self):
-        self.svg_data = '<?xml version="1.0" standalone="no"?>\n'
-        self.svg_data += '<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n'
-        self.svg_data += '<svg width="%d" height="%d" version="1.1" xmlns="http://www.w3.org/2000/svg">\n' % (self.width, self.height)
+    def create_image(self, out=None):
+        """
+        Start a new image, written to file object <out> if given, else
+        kept in svg_data once finished.
+        """
+        self._writer = SVGWriter(out, self.PRECISION)
+        self._buffered = out is None
+        self._writer.start(self.width, self.height)
 
     def finish_image(self):
-        self.svg_data += '</svg>'
+        self._writer.finish()
+        if self._buffered:
+            self.svg_data = self._writer.getvalue()
+        self._writer = None
 
     def plot_line(self, c0, c1, col):
         c0 = self.rcoords_to_coords(c0)
         c1 = self.rcoords_to_coords(c1)
-        self.svg_data += '<line style="stroke:%s;stroke-width:1" x1="%f" y1="%f" x2="%f" y2="%f" />\n' % (col, c0[0], c0[1], c1[0], c1[1])
+        self._writer.line(c0, c1, col)
 
     def plot_polyline(self, coords, col):
-        self.svg_data += '<polyline style="fill:none;stroke:%s;stroke-width:1" points="' % (col)
-        for c in coords:
-            c = self.rcoords_to_coords(c)
-            self.svg_data += '%f,%f ' % (c[0], c[1])
-        self.svg_data += '" />\n'
+        self._writer.path([self.rcoords_to_coords(c) for c in coords], col)
 
     def add_text(self, c, text, rotate=0):
-        if type(text) is types.UnicodeType:
-            text = text.encode('utf-8')
-        c = self.rcoords_to_coords(c)
-
-        self.svg_data += '<text x="%f" y="%f"' % (c[0], c[1])
-        if rotate != 0:
-            self.svg_data += ' transform="rotate(%d)"' % (rotate)
-
-        self.svg_data += '>%s</text>\n' % (text)
+        self._writer.text(self.rcoords_to_coords(c), text, rotate)
 
     def determine_bounds(self, vals):
         self.minx = self.miny = 1e99
         self.maxx = self.maxy = -1e99
         for (x, y) in vals:
             self.minx = min(float(x), self.minx)
-            self.miny = min(float(y), self.miny)
             self.maxx = max(float(x), self.maxx)
-            self.maxy = max(float(y), self.maxy)
+            if y is not None:
+                self.miny = min(float(y), self.miny)
+                self.maxy = max(float(y), self.maxy)
+
+        if self.miny > self.maxy:
+            self.miny = self.maxy = 0.0
 
         if self.minx == self.maxx:
             x_space = 0.5
@@ -186,14 +660,20 @@ class CustomPlot(_PlotBase):
         return ret
 
     def add_curve(self, vals):
+        """Add a curve, which is interrupted at points without a value."""
         self.determine_bounds(vals)
 
         c = []
         for v in vals:
-            c.append(self.vals_to_rcoords(v))
+            if v[1] is not None:
+                c.append(self.vals_to_rcoords(v))
+            elif len(c) > 0:
+                self.plot_polyline(c, "blue")
+                c = []
 #        print 'coords: %r' % c
 
-        self.plot_polyline(c, "blue")
+        if len(c) > 0:
+            self.plot_polyline(c, "blue")
 
     def get_label_vals(self, startx, endx, n, opts=()):
         """Return label values"""
@@ -206,8 +686,10 @@ class CustomPlot(_PlotBase):
         F = 0.8
         NOL = 4 # maximum no of labels
 
-        y_coords = sorted([i[1] for i in val])
+        y_coords = sorted([i[1] for i in val if i[1] is not None])
         x_coords = sorted([i[0] for i in val])
+        if len(y_coords) == 0:
+            y_coords = [0.0]
 
         max_y = max(y_coords)
         min_y = min(y_coords)
@@ -251,10 +733,16 @@ class CustomPlot(_PlotBase):
         self.add_text((-0.50, 0.045), labely, rotate=-90)
 
     def produce_plot(self, vals, *args, **kwargs):
-        """Produce an svg plot."""
+        """
+        Produce an svg plot. If a file object is passed as 'out' the plot
+        is written to it directly.
+        """
+
+        out = kwargs.pop('out', None)
+        self._last_plot = (vals, kwargs)
 
         self.set_size(250, 250)
-        self.create_image()
+        self.create_image(out)
 
         self.draw_axes(kwargs.get('xlabel', ''), kwargs.get('ylabel', ''), vals)
 
@@ -264,17 +752,46 @@ class CustomPlot(_PlotBase):
 
         return self.svg_data
 
+    def export_plot(self, fn):
+        """Write the last plot to file <fn>, without buffering it."""
+
+        if self._last_plot is None:
+            _PlotBase.export_plot(self, fn)
+            return
+
+        vals, kwargs = self._last_plot
+        f = open(fn, "w")
+        try:
+            self.produce_plot(vals, out=f, **kwargs)
+        finally:
+            f.close()
+
 class MPLPlot(_PlotBase):
+    """
+    Plot back-end using matplotlib. matplotlib is only imported when the
+    first plot is produced; a single figure is reused for all plots.
+    """
 
     def __init__(self, parser):
         _PlotBase.__init__(self, parser)
+        self._figure = None
+        self._canvas = None
+
+    def _get_figure(self):
+        if self._figure is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_svg import FigureCanvasSVG
+            self._figure = Figure(figsize=(5, 5))
+            self._canvas = FigureCanvasSVG(self._figure)
+        return self._figure
 
     def produce_plot(self, vals, **kwargs):
+        # matplotlib interrupts the line at nan values
         x = [c[0] for c in vals]
         y = [c[1] for c in vals]
+        y = [v is None and _NAN or v for v in y]
 
-        fig = pylab.figure()
-        fig.set_size_inches(5, 5)
+        fig = self._get_figure()
         ax = fig.add_subplot(111)
 
         ax.plot(x, y, 'r-')
@@ -283,20 +800,60 @@ class MPLPlot(_PlotBase):
         ax.set_ylabel(kwargs.get('ylabel', ''))
 
         data = StringIO.StringIO()
-        fig.savefig(data)
+        try:
+            self._canvas.print_svg(data)
+        finally:
+            # Release the lines and axes until the next plot
+            fig.clf()
         return data.getvalue()
 
-if USE_MPL:
+def _have_mpl():
+    """Return whether matplotlib can be used; imports it."""
+
+    if not USE_MPL:
+        return False
     try:
-        import matplotlib as mpl
-        mpl.use('svg')
-        from matplotlib import pylab
-        import StringIO
-        Plot = MPLPlot
-        _logger.debug('Using matplotlib as plotting back-end')
+        import matplotlib
+        return True
     except ImportError:
-        USE_MPL = False
+        return False
+
+class Plot(_PlotBase):
+    """
+    Plot front-end that selects the back-end when the first plot is
+    produced, so that starting up does not pay for importing matplotlib:
+    MPLPlot if matplotlib is available, CustomPlot otherwise.
+    """
+
+    def __init__(self, parser):
+        _PlotBase.__init__(self, parser)
+        self._backend = None
+        self.backend_load_time = None
+
+    def get_backend(self):
+        if self._backend is None:
+            start = time.time()
+            if _have_mpl():
+                self._backend = MPLPlot(self.parser)
+                _logger.debug('Using matplotlib as plotting back-end')
+            else:
+                self._backend = CustomPlot(self.parser)
+                _logger.debug('Using custom plotting back-end')
+            self._backend.cache = self.cache
+            self.backend_load_time = time.time() - start
+        return self._backend
+
+    def get_svg(self):
+        return self.get_backend().get_svg()
+
+    def set_svg(self, data):
+        self.get_backend().set_svg(data)
 
-if not USE_MPL:
-    Plot = CustomPlot
-    _logger.debug('Using custom plotting back-end')
+    def export_plot(self, fn):
+        self.get_backend().export_plot(fn)
+
+    def produce_plot(self, vals, *args, **kwargs):
+        return self.get_backend().produce_plot(vals, *args, **kwargs)
+
+    def plot(self, eqn, **kwargs):
+        return self.get_backend().plot(eqn, **kwargs)
@@ -18,6 +18,7 @@
 #    2007-07-03: rwh, first version
 
 import types
+import operator
 from decimal import Decimal
 
 import logging
@@ -25,115 +26,465 @@ _logger = logging.getLogger('Rational')
 
 from gettext import gettext as _
 
-class Rational:
+_INT_TYPES = (types.IntType, types.LongType, types.BooleanType)
+
+def gcd(a, b):
+    '''Return the greatest common divisor of a and b, always >= 0.'''
+    while b:
+        a, b = b, a % b
+    if a < 0:
+        return -a
+    return a
+
+def _iroot(x, k):
+    '''Return the integer k-th root of x >= 0, rounded down.'''
+
+    if x < 2:
+        return x
+    bits = len('%x' % x) * 4
+    if k >= bits:
+        return 1
+
+    # Start above the root, Newton's method then decreases monotonically
+    y = 1 << ((bits + k - 1) // k)
+    while True:
+        z = ((k - 1) * y + x // y ** (k - 1)) // k
+        if z >= y:
+            return y
+        y = z
+
+def _decimal_pair(x):
+    '''Return finite Decimal <x> as an exact (numerator, denominator) pair.'''
+
+    (sign, digits, exp) = x.as_tuple()
+    n = long(''.join([str(digit) for digit in digits]) or 0)
+    if sign:
+        n = -n
+    if exp >= 0:
+        return (n * 10 ** exp, 1)
+    return (n, 10 ** -exp)
+
+def _exact_pair(x):
+    '''
+    Return <x> as an exact (numerator, denominator) pair, or None if it is
+    not an integer, Rational or finite Decimal.
+    '''
+
+    if type(x) in _INT_TYPES:
+        return (x, 1)
+    elif isinstance(x, Rational):
+        return x._pair()
+    elif isinstance(x, Decimal) and not x.is_nan() and not x.is_infinite():
+        return _decimal_pair(x)
+    return None
+
+def _make(n, d, reduced):
+    ret = object.__new__(Rational)
+    ret._n = n
+    ret._d = d
+    ret._reduced = reduced
+    return ret
+
+class Rational(object):
+    '''
+    Exact fraction n/d of integers.
+
+    Results of arithmetic are computed in lowest terms directly, operands
+    given to the constructor are only reduced when n or d is first needed.
+    Operations with integers and other Rationals are exact, operations with
+    a Decimal return a Decimal and operations with a float return a float.
+    Instances should be treated as immutable, they can be used as
+    dictionary keys and hash like the equal integer or float.
+    '''
+
+    __slots__ = ('_n', '_d', '_reduced')
 
     def __init__(self, n=None, d=None):
-        self.n = 0
-        self.d = 0
+        self._n = 0
+        self._d = 1
+        self._reduced = True
 
         if n is not None:
             self.set(n, d)
 
     def set(self, n, d=None):
-        if d is not None:
-            self.n = long(n)
-            self.d = long(d)
-        elif type(n) is types.TupleType or type(n) is types.ListType:
-            self.n = long(rval[0])
-            self.d = long(rval[1])
-        elif type(n) == types.StringType:
+        '''
+        Set the value to n/d. n can also be a (n, d) tuple or list, or a
+        string like '3/4'. n and d may be integers, integral floats,
+        Decimals or Rationals.
+        '''
+
+        if d is None:
+            if type(n) in (types.TupleType, types.ListType):
+                (n, d) = n
+            elif type(n) in (types.StringType, types.UnicodeType):
+                parts = n.split('/')
+                if len(parts) > 2:
+                    raise ValueError(_('Invalid fraction: %s') % n)
+                n = Decimal(parts[0].strip())
+                if len(parts) == 2:
+                    d = Decimal(parts[1].strip())
+            if d is None:
+                d = 1
+
+        if type(n) in _INT_TYPES and type(d) in _INT_TYPES:
+            if d == 0:
+                raise ZeroDivisionError(_('Can not divide by zero'))
+            self._n = n
+            self._d = d
+            self._reduced = False
             return
 
-        self._simplify()
+        (a, b) = self._convert(n)
+        (c, e) = self._convert(d)
+        if c == 0:
+            raise ZeroDivisionError(_('Can not divide by zero'))
+        self._n = a * e
+        self._d = b * c
+        self._reduced = False
+
+    def _convert(self, x):
+        pair = _exact_pair(x)
+        if pair is not None:
+            return pair
+        if type(x) is types.FloatType:
+            return x.as_integer_ratio()
+        raise TypeError(_('Can not convert %r to a fraction') % (x,))
+
+    def _normalize(self):
+        n, d = self._n, self._d
+        if d < 0:
+            n, d = -n, -d
+        g = gcd(n, d)
+        if g != 1:
+            n //= g
+            d //= g
+        self._n = n
+        self._d = d
+        self._reduced = True
+
+    def _pair(self):
+        if not self._reduced:
+            self._normalize()
+        return (self._n, self._d)
+
+    def _get_n(self):
+        if not self._reduced:
+            self._normalize()
+        return self._n
+
+    def _get_d(self):
+        if not self._reduced:
+            self._normalize()
+        return self._d
+
+    n = property(_get_n, doc='Numerator, in lowest terms')
+    d = property(_get_d, doc='Denominator, in lowest terms, always > 0')
 
     def __str__(self):
-        if self.d == 1 or self.d == 0:
-            return "%d" % (self.n)
+        (n, d) = self._pair()
+        if d == 1:
+            return "%d" % (n)
         else:
-            return "%d/%d" % (self.n, self.d)
-           
+            return "%d/%d" % (n, d)
+
+    def __repr__(self):
+        (n, d) = self._pair()
+        return 'Rational(%d, %d)' % (n, d)
+
+    def __reduce__(self):
+        return (Rational, self._pair())
+
     def __float__(self):
-        return float(self.n) / float(self.d)
+        # True division of longs is correctly rounded, even for operands
+        # that do not fit in a float
+        return operator.truediv(self._n, self._d)
 
-    def gcd(self, a, b):
-        if b == 0:
-            return a
-        else:
-            return self.gcd(b, a % b)
+    def __int__(self):
+        (n, d) = self._pair()
+        if n < 0:
+            return -(-n // d)
+        return n // d
 
-    def _simplify(self):
-        if self.d == 0:
-            return
+    __long__ = __int__
+    __trunc__ = __int__
 
-        if self.n == self.d:
-            self.n = long(1)
-            self.d = long(1)
-        else:
-            gcd = self.gcd(self.n, self.d)
-            self.n /= gcd
-            self.d /= gcd
+    def __nonzero__(self):
+        return self._n != 0
+
+    def to_decimal(self):
+        '''Return the value as a Decimal, rounded to the context precision.'''
+        return Decimal(self._n) / Decimal(self._d)
+
+    def __hash__(self):
+        (n, d) = self._pair()
+        if d == 1:
+            return hash(n)
+        try:
+            f = float(self)
+            if f.as_integer_ratio() == (n, d):
+                return hash(f)
+        except OverflowError:
+            pass
+        return hash((n, d))
+
+    def _cmp(self, other):
+        '''
+        Return a number < 0, 0 or > 0 if self is smaller than, equal to or
+        larger than <other>, or None if they can not be compared.
+        '''
+
+        if type(other) in _INT_TYPES:
+            (a, b) = self._pair()
+            return a - b * other
+        elif isinstance(other, Rational):
+            (a, b) = self._pair()
+            (c, d) = other._pair()
+            return a * d - b * c
+        elif isinstance(other, Decimal):
+            if other.is_nan():
+                return None
+            elif other.is_infinite():
+                return other < 0 and 1 or -1
+            (a, b) = self._pair()
+            (c, d) = _decimal_pair(other)
+            return a * d - b * c
+        elif type(other) is types.FloatType:
+            if other != other:
+                return None
+            elif other in (float('inf'), float('-inf')):
+                return other < 0 and 1 or -1
+            (a, b) = self._pair()
+            (c, d) = other.as_integer_ratio()
+            return a * d - b * c
+        return None
+
+    def __eq__(self, other):
+        ret = self._cmp(other)
+        if ret is None:
+            if isinstance(other, (Decimal, types.FloatType)):
+                return False
+            return NotImplemented
+        return ret == 0
+
+    def __ne__(self, other):
+        ret = self.__eq__(other)
+        if ret is NotImplemented:
+            return ret
+        return not ret
+
+    def __lt__(self, other):
+        ret = self._cmp(other)
+        if ret is None:
+            if isinstance(other, (Decimal, types.FloatType)):
+                return False
+            return NotImplemented
+        return ret < 0
+
+    def __le__(self, other):
+        ret = self._cmp(other)
+        if ret is None:
+            if isinstance(other, (Decimal, types.FloatType)):
+                return False
+            return NotImplemented
+        return ret <= 0
+
+    def __gt__(self, other):
+        ret = self._cmp(other)
+        if ret is None:
+            if isinstance(other, (Decimal, types.FloatType)):
+                return False
+            return NotImplemented
+        return ret > 0
+
+    def __ge__(self, other):
+        ret = self._cmp(other)
+        if ret is None:
+            if isinstance(other, (Decimal, types.FloatType)):
+                return False
+            return NotImplemented
+        return ret >= 0
 
     def __add__(self, rval):
         if isinstance(rval, Rational):
-            ret = Rational(self.n * rval.d + self.d * rval.n, self.d * rval.d)
-        elif type(rval) is types.IntType or type(rval) is types.LongType:
-            ret = Rational(self.n + self.d * rval, self.d)
-        else:
-            ret = float(self) + rval
-        return ret
+            (a, b) = self._pair()
+            (c, d) = rval._pair()
+            g = gcd(b, d)
+            if g == 1:
+                return _make(a * d + b * c, b * d, True)
+            s = b // g
+            t = a * (d // g) + c * s
+            if t == 0:
+                return _make(0, 1, True)
+            g2 = gcd(t, g)
+            return _make(t // g2, s * (d // g2), True)
+        elif type(rval) in _INT_TYPES:
+            (a, b) = self._pair()
+            return _make(a + b * rval, b, True)
+        elif isinstance(rval, Decimal):
+            return self.to_decimal() + rval
+        elif type(rval) is types.FloatType:
+            return float(self) + rval
+        return NotImplemented
 
-    def __radd__(self, lval):
-        return self.__add__(lval)
+    __radd__ = __add__
 
     def __sub__(self, rval):
         if isinstance(rval, Rational):
-            ret = Rational(self.n * rval.d - self.d * rval.n, self.d * rval.d)
-        elif type(rval) is types.IntType or type(rval) is types.LongType:
-            ret = Rational(self.n - self.d * rval, self.d)
-        else:
-            ret = float(self) - rval
-        return ret
+            return self.__add__(-rval)
+        elif type(rval) in _INT_TYPES:
+            (a, b) = self._pair()
+            return _make(a - b * rval, b, True)
+        elif isinstance(rval, Decimal):
+            return self.to_decimal() - rval
+        elif type(rval) is types.FloatType:
+            return float(self) - rval
+        return NotImplemented
 
     def __rsub__(self, lval):
-        return -self.__sub__(lval)
+        if type(lval) in _INT_TYPES:
+            (a, b) = self._pair()
+            return _make(b * lval - a, b, True)
+        elif isinstance(lval, Decimal):
+            return lval - self.to_decimal()
+        elif type(lval) is types.FloatType:
+            return lval - float(self)
+        return NotImplemented
 
     def __mul__(self, rval):
         if isinstance(rval, Rational):
-            ret = Rational(self.n * rval.n, self.d * rval.d)
-        elif type(rval) is types.IntType or type(rval) is types.LongType:
-            ret = Rational(self.n * rval, self.d)
+            (a, b) = self._pair()
+            (c, d) = rval._pair()
+            if a == 0 or c == 0:
+                return _make(0, 1, True)
+            g1 = gcd(a, d)
+            g2 = gcd(c, b)
+            return _make((a // g1) * (c // g2), (b // g2) * (d // g1), True)
+        elif type(rval) in _INT_TYPES:
+            (a, b) = self._pair()
+            g = gcd(rval, b)
+            return _make(a * (rval // g), b // g, True)
         elif isinstance(rval, Decimal):
-            ret = rval * Decimal(str(float(self)))
-        else:
-            ret = rval * float(self)
-        return ret
+            return self.to_decimal() * rval
+        elif type(rval) is types.FloatType:
+            return float(self) * rval
+        return NotImplemented
+
+    __rmul__ = __mul__
 
-    def __rmul__(self, lval):
-        return self.__mul__(lval)
+    def _inverse(self):
+        (n, d) = self._pair()
+        if n == 0:
+            raise ZeroDivisionError(_('Can not divide by zero'))
+        if n < 0:
+            return _make(-d, -n, True)
+        return _make(d, n, True)
 
     def __div__(self, rval):
         if isinstance(rval, Rational):
-            ret = Rational(self.n * rval.d, self.d * rval.n)
-        elif type(rval) is types.IntType or type(rval) is types.LongType:
-            ret = Rational(self.n, self.d * rval)
-        else:
-            ret = float(self) / rval
-        return ret
+            return self.__mul__(rval._inverse())
+        elif type(rval) in _INT_TYPES:
+            if rval == 0:
+                raise ZeroDivisionError(_('Can not divide by zero'))
+            (a, b) = self._pair()
+            g = gcd(a, rval)
+            if rval < 0:
+                g = -g
+            return _make(a // g, b * (rval // g), True)
+        elif isinstance(rval, Decimal):
+            return self.to_decimal() / rval
+        elif type(rval) is types.FloatType:
+            return float(self) / rval
+        return NotImplemented
 
     def __rdiv__(self, lval):
-        return self.__div__(lval)
+        if type(lval) in _INT_TYPES:
+            return self._inverse().__mul__(lval)
+        elif isinstance(lval, Decimal):
+            return lval / self.to_decimal()
+        elif type(lval) is types.FloatType:
+            return lval / float(self)
+        return NotImplemented
+
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
 
     def __neg__(self):
-        return Rational(-self.n, self.d)
+        (n, d) = self._pair()
+        return _make(-n, d, True)
+
+    def __pos__(self):
+        return self
 
     def __abs__(self):
-        self.n = abs(self.n)
-        self.d = abs(self.d)
+        (n, d) = self._pair()
+        if n < 0:
+            return _make(-n, d, True)
+        return self
+
+    def _pow_int(self, exp):
+        (n, d) = self._pair()
+        if exp < 0:
+            if n == 0:
+                raise ZeroDivisionError(_('Can not divide by zero'))
+            (n, d, exp) = (d, n, -exp)
+            if d < 0:
+                (n, d) = (-n, -d)
+        return _make(n ** exp, d ** exp, True)
+
+    def _root(self, k):
+        '''Return the exact k-th root as a Rational, or None.'''
+        (n, d) = self._pair()
+        if n < 0:
+            if k % 2 == 0:
+                return None
+            root = self.__neg__()._root(k)
+            if root is None:
+                return None
+            return root.__neg__()
+
+        rn = _iroot(n, k)
+        if rn ** k != n:
+            return None
+        rd = _iroot(d, k)
+        if rd ** k != d:
+            return None
+        return _make(rn, rd, True)
 
     def __pow__(self, rval):
-        if type(rval) is types.IntType or type(rval) is types.LongType:
-            ret = Rational(self.n ** rval, self.d ** rval)
-        else:
-            ret = float(self.n) ** rval / float(self.d) ** rval
+        '''
+        Integer exponents give an exact result. For fractional exponents p/q
+        the result is exact if the q-th root of self is a fraction, and a
+        Decimal otherwise.
+        '''
+
+        if type(rval) in _INT_TYPES:
+            return self._pow_int(rval)
+        elif type(rval) is types.FloatType:
+            return float(self) ** rval
+
+        pair = _exact_pair(rval)
+        if pair is None:
+            if isinstance(rval, Decimal):
+                return self.to_decimal() ** rval
+            return NotImplemented
+
+        (p, q) = pair
+        if q == 1:
+            return self._pow_int(p)
+        root = self._root(q)
+        if root is not None:
+            return root._pow_int(p)
+
+        if isinstance(rval, Rational):
+            rval = rval.to_decimal()
+        return self.to_decimal() ** rval
 
-        return ret
+    def __rpow__(self, lval):
+        if type(lval) in _INT_TYPES:
+            return _make(lval, 1, True).__pow__(self)
+        elif isinstance(lval, Decimal):
+            return lval ** self.to_decimal()
+        elif type(lval) is types.FloatType:
+            return lval ** float(self)
+        return NotImplemented
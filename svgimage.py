@@ -20,37 +20,161 @@
 import logging
 _logger = logging.getLogger('SVGImage')
 
+import re
+import hashlib
+
 import gtk
 import rsvg
 
+from lrucache import LRUCache
+
+# Maximum number of bytes of rendered images kept in memory
+PIXBUF_CACHE_SIZE = 16 * 1024 * 1024
+
+def _pixbuf_size(pixbuf):
+    return pixbuf.get_rowstride() * pixbuf.get_height()
+
+# Rendered images, keyed by svg content hash and render size, shared by all
+# SVGImage objects.
+_pixbuf_cache = LRUCache(max_items=256, max_size=PIXBUF_CACHE_SIZE,
+                         sizeof=_pixbuf_size)
+
+# Find the size of an svg image without parsing it completely
+_SIZE_RE = re.compile(r'<svg\s[^>]*?\b(width|height)="([0-9.]+)(px|pt)?"')
+_SIZE_RE2 = re.compile(r'\b(width|height)="([0-9.]+)(px|pt)?"')
+
+# Pixels per point, as used by rsvg (90 dpi)
+_PT_SIZE = 1.25
+
 class SVGImage:
+    """
+    An svg image that is only rasterized when it is first displayed. The
+    pixbuf is dropped again when the image is unmapped; rendered pixbufs are
+    kept in a cache with a size limit.
+    """
 
     def __init__(self, fn=None, data=None):
+        self._svg_data = None
+        self._hash = None
+        self._image = None
+        self._render_size = None
+
         if fn is not None:
             self.load(fn)
         elif data is not None:
             self.load_data(data)
 
     def get_image(self):
+        """Return a gtk.Image that renders the svg when it is displayed."""
+
+        if self._image is None:
+            self._image = gtk.Image()
+            self._image.set_alignment(0.5, 0)
+            self._image.connect('unmap', self._unmap_cb)
+
+            size = self.get_size()
+            if size is not None:
+                # Render once the image becomes visible
+                self._image.set_size_request(*size)
+                self._image.connect('expose-event', self._expose_cb)
+            else:
+                self._image.connect('map', self._map_cb)
+
         return self._image
 
     def get_svg_data(self):
         return self._svg_data
 
+    def get_hash(self):
+        if self._hash is None:
+            self._hash = hashlib.sha1(self._svg_data).hexdigest()
+        return self._hash
+
+    def get_size(self):
+        """
+        Return the size in pixels as specified in the svg data, or the
+        render size if set. Returns None if the size is not known.
+        """
+
+        if self._render_size is not None:
+            return self._render_size
+
+        m = _SIZE_RE.search(self._svg_data[:4096])
+        if m is None:
+            return None
+        tag = self._svg_data[m.start():self._svg_data.find('>', m.start())]
+        size = {}
+        for (key, val, unit) in _SIZE_RE2.findall(tag):
+            val = float(val)
+            if unit == 'pt':
+                val *= _PT_SIZE
+            size[key] = int(val + 0.5)
+        if 'width' not in size or 'height' not in size:
+            return None
+        return (size['width'], size['height'])
+
+    def set_render_size(self, width, height):
+        """Render the image at a fixed size instead of its own size."""
+
+        self._render_size = (width, height)
+        if self._image is not None:
+            self._image.set_size_request(width, height)
+            self._image.clear()
+            self._image.queue_draw()
+
+    def get_pixbuf(self):
+        """Return the rendered image, from the cache if possible."""
+
+        key = (self.get_hash(), self._render_size)
+        pixbuf = _pixbuf_cache.get(key)
+        if pixbuf is None:
+            pixbuf = self._render_pixbuf()
+            _pixbuf_cache.set(key, pixbuf)
+        return pixbuf
+
+    def _render_pixbuf(self):
+        _logger.debug('Rendering svg %s', self.get_hash())
+        handle = rsvg.Handle(data=self._svg_data)
+        pixbuf = handle.get_pixbuf()
+        if self._render_size is not None:
+            pixbuf = pixbuf.scale_simple(self._render_size[0],
+                    self._render_size[1], gtk.gdk.INTERP_BILINEAR)
+        return pixbuf
+
+    def _show_pixbuf(self):
+        if self._image.get_storage_type() == gtk.IMAGE_EMPTY:
+            self._image.set_from_pixbuf(self.get_pixbuf())
+
+    def _expose_cb(self, widget, event):
+        self._show_pixbuf()
+        return False
+
+    def _map_cb(self, widget):
+        self._show_pixbuf()
+
+    def _unmap_cb(self, widget):
+        # Hidden, e.g. by the history filter: the cache may keep the pixbuf
+        widget.clear()
+
     def render_svg(self):
-        self._handle = rsvg.Handle(data=self._svg_data)
-        self._pixbuf = self._handle.get_pixbuf()
-        self._image = gtk.Image()
-        self._image.set_from_pixbuf(self._pixbuf)
-        self._image.set_alignment(0.5, 0)
-        return self._image
-        
+        """Render the image now and return the gtk.Image showing it."""
+        image = self.get_image()
+        image.set_from_pixbuf(self.get_pixbuf())
+        return image
+
     def load(self, fn):
         f = open(fn, 'rb')
         self._svg_data = f.read()
         f.close()
-        return self.render_svg()
+        return self._set_data_changed()
 
     def load_data(self, svgdat):
         self._svg_data = svgdat
-        return self.render_svg()
+        return self._set_data_changed()
+
+    def _set_data_changed(self):
+        self._hash = None
+        if self._image is not None:
+            self._image.clear()
+            self._image.queue_draw()
+        return self.get_image()
@@ -0,0 +1,483 @@
+# test_astparser.py, tests for the equation parser
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from decimal import Decimal
+
+from astparser import AstParser, BudgetError, Const, ParserError, \
+        HelpIndex, UndefinedError, get_plugin_registry
+from rational import Rational
+import functions
+import vecfunctions
+
+class _ParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = AstParser()
+
+    def set_label(self, name, eqn):
+        self.parser.set_var(name, self.parser.parse(eqn))
+
+    def evaluate(self, eqn):
+        return self.parser.evaluate(eqn)
+
+class FoldTest(_ParserTest):
+
+    def test_fold_constants(self):
+        tree = self.parser.parse('2*pi+1')
+        self.assertTrue(isinstance(tree.value, Const))
+        self.assertEqual(self.evaluate(tree), self.evaluate('pi*2+1'))
+
+    def test_fold_pure_functions(self):
+        self.assertTrue(isinstance(self.parser.parse('sqrt(4)+1').value,
+                                   Const))
+        self.assertFalse(isinstance(self.parser.parse('sin(1)').value, Const))
+        self.assertFalse(isinstance(self.parser.parse('rand_float()').value,
+                                    Const))
+
+    def test_partial_fold(self):
+        tree = self.parser.parse('x+2*3')
+        self.assertTrue(isinstance(tree.value.right, Const))
+        self.assertEqual(tree.value.right.value, 6)
+
+    def test_errors_not_folded(self):
+        self.assertFalse(isinstance(self.parser.parse('1/0').value, Const))
+        try:
+            self.evaluate('1/0')
+        except ParserError, e:
+            self.assertEqual(e.get_range(), (1, 2))
+        else:
+            self.fail('ParserError not raised')
+
+    def test_folded_names_used(self):
+        self.evaluate('1+2*pi')
+        self.assertEqual(self.parser.get_last_used_vars(), ['pi'])
+        self.assertEqual(self.parser.get_var_used_ofs('pi'), 4)
+
+    def test_no_optimize(self):
+        self.parser.OPTIMIZE = False
+        self.assertFalse(isinstance(self.parser.parse('2*3').value, Const))
+        self.assertEqual(self.evaluate('2*3'), 6)
+
+    def test_redefined_constant(self):
+        self.set_label('b', '2*pi')
+        self.parser.set_var('pi', 3)
+        self.assertEqual(self.evaluate('2*pi'), 6)
+        self.assertEqual(self.evaluate('b'), 6)
+
+    def test_redefined_function(self):
+        self.set_label('b', 'sqrt(4)+1')
+        self.parser.set_var('sqrt', self.parser.parse('2'))
+        self.assertRaises(Exception, self.evaluate, 'b')
+
+    def test_precision_refolds_labels(self):
+        self.set_label('b', '2*pi')
+        self.parser.set_precision(30)
+        try:
+            self.assertTrue(isinstance(self.evaluate('b'), Decimal))
+        finally:
+            self.parser.set_precision(None)
+        self.assertTrue(isinstance(self.evaluate('b'), float))
+
+class DivisionTest(_ParserTest):
+
+    def tearDown(self):
+        self.parser.set_division_mode(False, 4096)
+
+    def test_exact_division(self):
+        self.parser.set_division_mode(True, None)
+        self.assertEqual(self.evaluate('10**20/3'), Rational(10**20, 3))
+
+    def test_bit_limit(self):
+        self.parser.set_division_mode(True, 64)
+        self.assertTrue(isinstance(self.evaluate('10**30/7'), Decimal))
+
+    def test_cutoff(self):
+        self.assertEqual(self.evaluate('1/3'), Rational(1, 3))
+        self.assertTrue(isinstance(self.evaluate('10**13/3'), Decimal))
+        self.assertEqual(self.evaluate('10**20/10**19'), 10)
+
+    def test_mode_change_refolds(self):
+        self.set_label('a', '10**20/3')
+        self.assertTrue(isinstance(self.evaluate('10**20/3'), Decimal))
+        self.assertTrue(isinstance(self.evaluate('a'), Decimal))
+        self.parser.set_division_mode(True, None)
+        self.assertEqual(self.evaluate('10**20/3'), Rational(10**20, 3))
+        self.assertEqual(self.evaluate('a'), Rational(10**20, 3))
+        self.parser.set_division_mode(False, 4096)
+        self.assertTrue(isinstance(self.evaluate('a'), Decimal))
+
+    def test_user_variables(self):
+        self.assertRaises(ParserError, self.evaluate, 'exact_division')
+        self.parser.set_var('exact_division', 1)
+        self.parser.set_var('rational_bit_limit', self.parser.parse('2'))
+        self.parser.set_division_mode(True, 128)
+        self.assertEqual(functions.exact_division.value, True)
+        self.assertEqual(functions.rational_bit_limit.value, 128)
+        self.assertEqual(self.evaluate('exact_division'), 1)
+
+class PrecisionTest(_ParserTest):
+
+    def tearDown(self):
+        self.parser.set_precision(None)
+
+    def test_digits(self):
+        self.parser.set_precision(40)
+        pi = self.evaluate('pi')
+        self.assertTrue(isinstance(pi, Decimal))
+        self.assertTrue(str(pi).startswith(
+            '3.14159265358979323846264338327950288419'))
+        self.assertTrue(isinstance(self.evaluate('sqrt(2)'), Decimal))
+
+    def test_floats(self):
+        self.parser.set_precision(15)
+        self.assertEqual(functions.precision.value, None)
+        self.assertTrue(isinstance(self.evaluate('sqrt(2)'), float))
+
+    def test_user_variable(self):
+        self.set_label('precision', '2+3')
+        self.parser.set_precision(30)
+        self.assertEqual(functions.precision.value,
+                         30 + AstParser.PRECISION_GUARD_DIGITS)
+        self.assertEqual(self.evaluate('precision'), 5)
+        self.assertTrue(isinstance(self.evaluate('sqrt(2)'), Decimal))
+
+@unittest.skipIf(not vecfunctions.HAVE_NUMPY, 'NumPy is not available')
+class VectorTest(_ParserTest):
+
+    def test_values(self):
+        tree = self.parser.parse('a*x+sqrt(x)')
+        self.parser.set_var('a', 2)
+        ys = self.parser.evaluate_vector(tree, 'x', [1.0, 4.0, -1.0])
+        self.assertEqual(list(ys[:2]), [3.0, 10.0])
+        self.assertTrue(ys[2] != ys[2])
+
+    def test_same_as_scalar(self):
+        xs = [0.5, 1.0, 2.5]
+        for eqn in ('sin(x)*x', 'exp(-x)+x^2', '1/x-ln(x)', 'abs(x-1)'):
+            tree = self.parser.parse(eqn)
+            ys = self.parser.evaluate_vector(tree, 'x', xs)
+            for (x, y) in zip(xs, ys):
+                self.parser.set_var('x', x)
+                self.assertAlmostEqual(y, float(self.evaluate(tree)))
+
+    def test_not_vectorizable(self):
+        tree = self.parser.parse('factorize(x)')
+        self.assertTrue(self.parser.evaluate_vector(tree, 'x', [2]) is None)
+
+    def test_closure_cached(self):
+        tree = self.parser.parse('a*x')
+        self.set_label('a', 'b+1')
+        self.parser.set_var('b', 1)
+        self.assertEqual(list(self.parser.evaluate_vector(tree, 'x', [3])),
+                         [6.0])
+        func = tree._compiled_vector['x']
+
+        # Names are looked up again, the closure is reused
+        self.parser.set_var('b', 2)
+        self.assertEqual(list(self.parser.evaluate_vector(tree, 'x', [3])),
+                         [9.0])
+        self.assertTrue(tree._compiled_vector['x'] is func)
+
+        self.parser.set_var('a', 'text')
+        self.assertTrue(self.parser.evaluate_vector(tree, 'x', [3]) is None)
+
+class CompileTest(_ParserTest):
+
+    def test_operators(self):
+        self.assertEqual(self.evaluate('1+2*3'), 7)
+        self.assertEqual(self.evaluate('2^10'), 1024)
+        self.assertEqual(self.evaluate('-(4)+7%3'), -3)
+        self.assertEqual(self.evaluate('1<2'), True)
+        self.assertEqual(self.evaluate('(1,2)'), (1, 2))
+        self.assertEqual(self.evaluate('sqrt(16)'), 4)
+
+    def test_compiled_once(self):
+        self.parser.set_var('y', 4)
+        tree = self.parser.parse('y*y+1')
+        self.assertEqual(self.evaluate(tree), 17)
+        func = tree._compiled
+
+        # Variables are looked up when evaluating
+        self.parser.set_var('y', 5)
+        self.assertEqual(self.evaluate(tree), 26)
+        self.assertTrue(tree._compiled is func)
+
+    def test_used_vars(self):
+        self.parser.set_var('y', 4)
+        self.evaluate('2+y*y')
+        self.assertEqual(self.parser.get_last_used_vars(), ['y'])
+        self.assertEqual(self.parser.get_var_used_ofs('y'), 2)
+
+    def test_undefined(self):
+        try:
+            self.evaluate('1+abc')
+        except UndefinedError, e:
+            self.assertEqual(e.get_range(), (2, 5))
+        else:
+            self.fail('UndefinedError not raised')
+
+class ParseCacheTest(_ParserTest):
+
+    def test_cached_tree(self):
+        tree = self.parser.parse('1+x')
+        self.assertTrue(self.parser.parse('1+x') is tree)
+        stats = self.parser.get_parse_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        self.parser.clear_parse_cache()
+        self.assertFalse(self.parser.parse('1+x') is tree)
+
+    def test_cached_error(self):
+        self.assertRaises(ParserError, self.parser.parse, '2+*')
+        self.assertRaises(ParserError, self.parser.parse, '2+*')
+        self.assertEqual(self.parser.get_parse_cache_stats()['hits'], 1)
+
+    def test_bounded(self):
+        for i in range(AstParser.PARSE_CACHE_SIZE + 10):
+            self.parser.parse('x+%d' % i)
+        stats = self.parser.get_parse_cache_stats()
+        self.assertEqual(stats['items'], AstParser.PARSE_CACHE_SIZE)
+        self.assertEqual(stats['evictions'], 10)
+
+class LabelTest(_ParserTest):
+
+    def test_dependents(self):
+        self.set_label('a', 'x+1')
+        self.set_label('b', 'a*2')
+        self.set_label('c', 'a+b')
+        self.assertEqual(self.parser.get_label_dependents('a'), ['b', 'c'])
+        self.assertEqual(self.parser.get_label_dependents('x'), ['a'])
+
+    def test_recompute(self):
+        self.parser.set_var('x', 1)
+        self.set_label('a', 'x+1')
+        self.set_label('b', 'a*2')
+        self.assertEqual(self.evaluate('b'), 4)
+        self.parser.set_var('x', 2)
+        self.assertEqual(self.evaluate('b'), 6)
+        self.set_label('a', 'x*10')
+        self.assertEqual(self.evaluate('b'), 40)
+
+    def test_cached(self):
+        self.parser.set_var('x', 1)
+        self.set_label('a', 'x+1')
+        self.evaluate('a')
+        self.assertTrue(self.parser._label_values.has_key('a'))
+        self.set_label('r', 'rand_float()+a')
+        self.evaluate('r')
+        self.assertFalse(self.parser._label_values.has_key('r'))
+
+    def test_cycle(self):
+        self.set_label('a', 'b+1')
+        tree = self.parser.parse('1+a')
+        self.assertEqual(self.parser.get_label_cycle_ofs('b', tree), 2)
+        self.assertRaises(ParserError, self.parser.set_var, 'b', tree)
+        self.assertEqual(self.parser.get_label_cycle_ofs('c', tree), None)
+
+class EvaluateManyTest(_ParserTest):
+
+    def test_labels_and_ans(self):
+        results = list(self.parser.evaluate_many(
+            [('a', '2+3'), ('', 'a*2'), ('', 'Ans+1')]))
+        self.assertEqual(results, [('a', 5), ('', 10), ('', 11)])
+        self.assertEqual(self.evaluate('a'), 5)
+
+    def test_errors(self):
+        results = list(self.parser.evaluate_many(
+            [('a', '1/0'), ('', '2+*'), ('', 'a')]))
+        for (label, res) in results:
+            self.assertTrue(isinstance(res, ParserError))
+        self.assertTrue(self.parser.get_var('a') is None)
+
+    def test_no_assign(self):
+        results = list(self.parser.evaluate_many([('a', '1')],
+                                                 assign_labels=False))
+        self.assertEqual(results, [('a', 1)])
+        self.assertTrue(self.parser.get_var('a') is None)
+        self.assertTrue(self.parser.get_var('Ans') is None)
+
+class BudgetTest(_ParserTest):
+
+    def setUp(self):
+        _ParserTest.setUp(self)
+        self.parser.set_var('x', 1)
+
+    def test_steps(self):
+        self.parser.MAX_STEPS = 50
+        self.assertEqual(self.evaluate('+'.join(['x'] * 10)), 10)
+        self.assertRaises(BudgetError, self.evaluate, '+'.join(['x'] * 100))
+        self.parser.MAX_STEPS = None
+        self.assertEqual(self.evaluate('+'.join(['x'] * 100)), 100)
+
+    def test_shared_state(self):
+        self.parser.MAX_STEPS = 50
+        state = self.parser.new_eval_state()
+        eqn = self.parser.parse('+'.join(['x'] * 10))
+        self.assertEqual(self.parser.evaluate(eqn, state), 10)
+        self.assertRaises(BudgetError,
+                          lambda: [self.parser.evaluate(eqn, state)
+                                   for i in range(10)])
+        self.assertEqual(self.evaluate(eqn), 10)
+
+    def test_result_size(self):
+        self.assertRaises(BudgetError, self.evaluate, '2**(10**8)')
+        self.assertRaises(BudgetError, self.evaluate, 'factorial(10**7)')
+        self.parser.MAX_RESULT_BITS = None
+        self.assertEqual(len(str(self.evaluate('2**100000'))), 30103)
+
+    def test_deep_labels(self):
+        self.set_label('l0', '1')
+        for i in range(1, 200):
+            self.set_label('l%d' % i, 'l%d+1' % (i - 1))
+        self.assertEqual(self.evaluate('l199'), 200)
+        self.set_label('l0', '2')
+        self.assertEqual(self.evaluate('l199'), 201)
+
+    def test_deep_uncached_labels(self):
+        self.set_label('r0', 'rand_float()')
+        for i in range(1, 150):
+            self.set_label('r%d' % i, 'r%d+1' % (i - 1))
+        self.assertTrue(self.evaluate('r50') > 50)
+        self.assertRaises(BudgetError, self.evaluate, 'r149')
+
+class ProfileTest(_ParserTest):
+
+    def get_counts(self):
+        ret = {}
+        for (kind, name, count, t) in self.parser.profiler.get_stats():
+            ret[(kind, name)] = count
+        return ret
+
+    def test_counts(self):
+        self.parser.set_var('x', 2)
+        self.set_label('a', 'sin(x)+x*3')
+        self.parser.set_profiling(True)
+        self.assertTrue(self.parser.is_profiling())
+        for i in range(5):
+            self.evaluate('a+sqrt(x)')
+        counts = self.get_counts()
+        self.assertEqual(counts[('function', 'sqrt')], 5)
+        self.assertEqual(counts[('label', 'a')], 5)
+        self.assertEqual(counts[('node', 'BinOp')], 15)
+
+    def test_off(self):
+        self.parser.set_var('x', 2)
+        self.evaluate('sqrt(x)')
+        self.assertEqual(self.get_counts(), {})
+        self.parser.set_profiling(True)
+        self.evaluate('sqrt(x)')
+        self.parser.set_profiling(False)
+        self.evaluate('sqrt(x)')
+        self.assertEqual(self.get_counts()[('function', 'sqrt')], 1)
+        self.parser.set_profiling(True)
+        self.assertEqual(self.get_counts(), {})
+
+    def test_help(self):
+        self.parser.set_var('x', 2)
+        text = self.evaluate('profile(1)')
+        self.assertTrue(text.startswith('Profiling is on'))
+        self.evaluate('sqrt(x)+ln(x)')
+        text = self.evaluate('profile(0)')
+        self.assertTrue(text.startswith('Profiling is off'))
+        self.assertTrue('function ln: 1 calls' in text)
+        self.assertTrue('function ln' in self.evaluate('help(profile)'))
+
+class RegistryTest(_ParserTest):
+
+    def test_shared(self):
+        registry = get_plugin_registry()
+        self.assertTrue(get_plugin_registry() is registry)
+        self.assertTrue(u'sqrt' in registry.pure_funcs)
+        self.assertTrue(u'pi' in registry.foldable)
+        self.assertTrue(u'rand_int' in registry.random_funcs)
+        self.assertFalse(u'rand_int' in registry.pure_funcs)
+
+    def test_settings_excluded(self):
+        registry = get_plugin_registry()
+        for name in functions._SETTINGS:
+            self.assertFalse(name in registry.namespace)
+            self.assertRaises(UndefinedError, self.evaluate, name)
+
+    def test_parsers_independent(self):
+        other = AstParser()
+        self.parser.set_var('pi', 3)
+        self.assertEqual(self.evaluate('pi'), 3)
+        self.assertAlmostEqual(other.evaluate('pi'), 3.14159265)
+        self.assertAlmostEqual(get_plugin_registry().namespace['pi'],
+                               3.14159265)
+
+class HelpTest(_ParserTest):
+
+    def setUp(self):
+        _ParserTest.setUp(self)
+        self.index = HelpIndex({
+            'sqrt': 'sqrt(x), return the square root of x',
+            'square': 'square(x), return x to the power of 2',
+            'exp': 'exp(x), return e to the power of x',
+        })
+
+    def test_index(self):
+        self.assertEqual(self.index.get_names(), ['exp', 'sqrt', 'square'])
+        self.assertEqual(self.index.find_prefix('sq'), ['sqrt', 'square'])
+        self.assertEqual(self.index.find_prefix('x'), [])
+        self.assertEqual(self.index.get_text('nothere'), None)
+
+    def test_search(self):
+        self.assertEqual(self.index.search('power root'),
+                         ['exp', 'sqrt', 'square'])
+        self.assertEqual(self.index.search('square power'),
+                         ['square', 'exp', 'sqrt'])
+        self.assertEqual(self.index.search('of x'), [])
+
+    def test_suggest(self):
+        self.assertEqual(self.index.suggest('sq'), ['sqrt', 'square'])
+        self.assertEqual(self.index.suggest('esp'), ['exp'])
+        self.assertEqual(self.index.suggest('zzzz'), [])
+
+    def test_help(self):
+        self.assertEqual(self.evaluate('help(sqr)'),
+                         self.evaluate('help(sqrt)'))
+        self.assertTrue('asinh' in self.evaluate('help(asi)'))
+        self.assertTrue('is_prime' in self.evaluate('help("prime")'))
+        self.assertTrue('sinh' in self.evaluate('help(sinn)'))
+        self.parser.add_help('mytopic', 'A topic added later')
+        self.assertEqual(self.evaluate('help(mytopic)'),
+                         'A topic added later')
+
+class CompletionTest(_ParserTest):
+
+    def test_names(self):
+        self.assertEqual(self.parser.get_names('sin'), ['sin', 'sinc', 'sinh'])
+        self.assertTrue('physics.c' in self.parser.get_names('physics.'))
+        self.assertEqual(self.parser.get_names('zq'), [])
+        self.parser.set_var('sinus', 3)
+        self.assertEqual(self.parser.get_names('sin')[0], 'sinus')
+
+    def test_next_name(self):
+        self.parser.set_var('sinus', 3)
+        self.assertEqual(self.parser.get_next_name('sin'), 'sinus')
+        self.assertEqual(self.parser.get_next_name('sin', 'sinus'), 'sin')
+        self.assertEqual(self.parser.get_next_name('sin', 'sinh'), 'sinus')
+        self.assertEqual(self.parser.get_next_name('zq'), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# test_benchmark.py, tests for the microbenchmark suite
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import benchmark
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_benchmarks_run(self):
+        names = [name for (name, setup) in benchmark.BENCHMARKS]
+        self.assertEqual(len(names), len(set(names)))
+        for (name, setup) in benchmark.BENCHMARKS:
+            func = setup()
+            # The slowest ones only need to set up
+            if not name.endswith('.100000'):
+                func()
+
+    def test_run_pattern(self):
+        results = benchmark.run_benchmarks(['^parse\\.int$'], repeat=1,
+                                           min_time=0.001)
+        self.assertEqual(results.keys(), ['parse.int'])
+        self.assertTrue(results['parse.int'] > 0)
+
+    def test_compare(self):
+        ret = benchmark.compare_results({'a': 1.2, 'b': 1.0, 'c': 1.0},
+                                        {'a': 1.0, 'b': 1.0}, 0.1)
+        self.assertEqual([r[0] for r in ret], ['a', 'b'])
+        self.assertEqual([r[4] for r in ret], [True, False])
+
+    @unittest.skipIf(benchmark.json is None, 'json is not available')
+    def test_baseline(self):
+        dir = tempfile.mkdtemp()
+        try:
+            fn = os.path.join(dir, 'baseline.json')
+            benchmark.save_baseline(fn, {'a': 1.5e-6})
+            self.assertEqual(benchmark.load_baseline(fn), {'a': 1.5e-6})
+        finally:
+            shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    unittest.main()
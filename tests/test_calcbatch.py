@@ -0,0 +1,89 @@
+# test_calcbatch.py, tests for the command line batch evaluator
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import StringIO
+import subprocess
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from calcbatch import BatchEvaluator, LatencyHistogram, json
+
+INPUT = u'a: 2+3\n# comment\n\na*2\n1/\n'
+
+def _lines(text):
+    return enumerate(text.splitlines(), 1)
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.out = StringIO.StringIO()
+
+    def test_text(self):
+        batch = BatchEvaluator(self.out)
+        batch.process(_lines(INPUT))
+        lines = self.out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('a: 2+3 = 5'))
+        self.assertTrue(lines[1].startswith('a*2 = 10'))
+        self.assertTrue(lines[2].startswith('1/ ! '))
+        self.assertEqual((batch.lines, batch.errors), (3, 1))
+
+    @unittest.skipIf(json is None, 'json is not available')
+    def test_json(self):
+        batch = BatchEvaluator(self.out, 'json')
+        batch.process(_lines(INPUT))
+        objs = [json.loads(l) for l in self.out.getvalue().splitlines()]
+        self.assertEqual([o['line'] for o in objs], [1, 4, 5])
+        self.assertEqual(objs[0]['label'], 'a')
+        self.assertEqual(objs[1]['label'], None)
+        self.assertTrue(objs[1]['result'].startswith('10'))
+        self.assertEqual(objs[2]['range'], [2, 3])
+        self.assertTrue('result' not in objs[2])
+
+    def test_stats(self):
+        batch = BatchEvaluator(self.out)
+        self.assertEqual(batch.get_stats()['lines_per_sec'], 0.0)
+        batch.process(_lines(INPUT))
+        stats = batch.get_stats()
+        self.assertEqual(stats['lines'], 3)
+        self.assertTrue(stats['p50'] <= stats['p99'] <= stats['max'])
+
+    def test_exit_status(self):
+        script = os.path.join(os.path.dirname(__file__), '..', 'calcbatch.py')
+        for (text, ret) in (('1+1\n', 0), ('1+\n', 1)):
+            p = subprocess.Popen([sys.executable, script],
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            out = p.communicate(text)[0]
+            self.assertEqual(p.returncode, ret)
+            self.assertEqual(len(out.splitlines()), 1)
+
+class LatencyTest(unittest.TestCase):
+
+    def test_percentile(self):
+        h = LatencyHistogram()
+        self.assertEqual(h.percentile(50), 0.0)
+        for i in range(1, 101):
+            h.add(i * 1e-4)
+        self.assertEqual(h.count, 100)
+        self.assertEqual(h.percentile(100), 1e-2)
+        p50 = h.percentile(50)
+        self.assertTrue(50e-4 <= p50 < 50e-4 * 1.13)
+
+if __name__ == '__main__':
+    unittest.main()
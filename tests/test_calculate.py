@@ -0,0 +1,111 @@
+# test_calculate.py, tests for the activity's equation processing
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from astparser import AstParser, ParserError
+
+# The activity needs gtk and sugar
+try:
+    import calculate
+except ImportError:
+    calculate = None
+
+class _Entry:
+
+    def __init__(self, text):
+        self._text = text
+
+    def get_text(self):
+        return self._text
+
+class _Activity:
+    '''The parts of the activity that process() uses, without a worker.'''
+
+    worker = None
+
+    def __init__(self, text, label=''):
+        self.text_entry = _Entry(text)
+        self.label_entry = _Entry(label)
+        self.parser = AstParser()
+        self.shown = None
+
+    def get_ans_equation(self, s):
+        return None
+
+    def show_result(self, s, label, res, tree=None, tree_eqn=None):
+        self.shown = (s, label, res, tree)
+
+class _ResultActivity(_Activity):
+    '''The parts of the activity that show_result() uses for an error.'''
+
+    color = None
+    ml = None
+
+    def __init__(self):
+        _Activity.__init__(self, '')
+        self.error_eqn = None
+        self.vars = {}
+
+    def get_owner_id(self):
+        return 'owner'
+
+    def set_error_equation(self, eqn):
+        self.error_eqn = eqn
+
+    def set_var(self, name, value):
+        self.vars[name] = value
+
+    def add_equation(self, *args, **kwargs):
+        return calculate.Calculate.add_equation.im_func(self, *args, **kwargs)
+
+@unittest.skipIf(calculate is None, 'gtk or sugar is not available')
+class ProcessTest(unittest.TestCase):
+
+    def process(self, text, label=''):
+        act = _Activity(text, label)
+        calculate.Calculate.process.im_func(act)
+        return act.shown
+
+    def test_result(self):
+        (s, label, res, tree) = self.process('1+2', 'a')
+        self.assertEqual(res, 3)
+        self.assertTrue(tree is not None)
+
+    def test_syntax_error(self):
+        (s, label, res, tree) = self.process('2+*')
+        self.assertTrue(isinstance(res, ParserError))
+        self.assertTrue(tree is None)
+
+@unittest.skipIf(calculate is None, 'gtk or sugar is not available')
+class ShowResultTest(unittest.TestCase):
+
+    def test_label_error(self):
+        act = _ResultActivity()
+        act.parser.set_var('a', act.parser.parse('b+1'))
+        tree = act.parser.parse('a+1')
+        calculate.Calculate.show_result.im_func(act, u'a+1', u'b', 3,
+                                                tree=tree)
+        self.assertTrue(isinstance(act.error_eqn.result, ParserError))
+        self.assertEqual(act.vars, {})
+        self.assertTrue(act.parser.get_var('b') is None)
+
+if __name__ == '__main__':
+    unittest.main()
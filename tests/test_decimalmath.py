@@ -0,0 +1,94 @@
+# test_decimalmath.py, tests for the arbitrary precision functions
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from decimal import Decimal, Context
+
+import decimalmath as dm
+
+PREC = 50
+
+# Reference values to 50 significant digits
+REFERENCE = (
+    (dm.pi, None, '3.1415926535897932384626433832795028841971693993751'),
+    (dm.e, None, '2.7182818284590452353602874713526624977572470937000'),
+    (dm.ln2, None, '0.69314718055994530941723212145817656807550013436026'),
+    (dm.sin, 1, '0.84147098480789650665250232163029899962256306079837'),
+    (dm.cos, 1, '0.54030230586813971740093660744297660373231042061792'),
+    (dm.tan, 1, '1.5574077246549022305069748074583601730872507723815'),
+    (dm.atan, 1, '0.78539816339744830961566084581987572104929234984378'),
+    (dm.asin, '0.5',
+     '0.52359877559829887307710723054658381403286156656252'),
+    (dm.sinh, 1, '1.1752011936438014568823818505956008151557179813341'),
+    (dm.sqrt, 2, '1.4142135623730950488016887242096980785696718753769'),
+    )
+
+class DecimalMathTest(unittest.TestCase):
+
+    def test_reference(self):
+        for (func, arg, expected) in REFERENCE:
+            if arg is None:
+                ret = func(PREC)
+            else:
+                ret = func(Decimal(arg), PREC)
+            self.assertEqual(str(ret), expected, func.__name__)
+
+    def test_decimal_functions(self):
+        # Decimal rounds these correctly
+        context = Context(prec=PREC)
+        for x in ('2', '0.001', '123.456', '-3.5', '1e-30'):
+            x = Decimal(x)
+            self.assertEqual(dm.exp(x, PREC), context.exp(x))
+            if x > 0:
+                self.assertEqual(dm.ln(x, PREC), context.ln(x))
+                self.assertEqual(dm.log10(x, PREC), context.log10(x))
+                self.assertEqual(dm.sqrt(x, PREC), context.sqrt(x))
+
+    def test_identities(self):
+        context = Context(prec=PREC - 2)
+        for x in ('0.5', '3', '-10', '1e-20', '100.25'):
+            x = Decimal(x)
+            s = dm.sin(x, PREC)
+            c = dm.cos(x, PREC)
+            one = context.plus(s * s + c * c)
+            self.assertEqual(one, 1)
+            self.assertEqual(context.plus(dm.tan(x, PREC)),
+                             context.divide(s, c))
+            self.assertEqual(context.plus(dm.asinh(dm.sinh(x, PREC), PREC)),
+                             context.plus(x))
+
+    def test_precision(self):
+        for func in (dm.exp, dm.sin, dm.atan, dm.ln):
+            short = func(Decimal(7), 30)
+            ref = func(Decimal(7), 80)
+            self.assertEqual(len(short.as_tuple()[1]), 30)
+            self.assertEqual(short, Context(prec=30).plus(ref))
+        self.assertEqual(dm.pi(20), Context(prec=20).plus(dm.pi(PREC)))
+
+    def test_domain(self):
+        self.assertRaises(ValueError, dm.ln, Decimal(0), PREC)
+        self.assertRaises(ValueError, dm.sqrt, Decimal(-1), PREC)
+        self.assertRaises(ValueError, dm.asin, Decimal(2), PREC)
+        self.assertRaises(ValueError, dm.power, Decimal(-2), Decimal('0.5'),
+                          PREC)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# test_evalworker.py, tests for the evaluation worker process
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import pickle
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from astparser import AstParser, BudgetError, ParseError, UndefinedError
+from mathlib import MathLib
+import functions
+
+# The worker needs gobject
+try:
+    import evalworker
+except ImportError:
+    evalworker = None
+
+@unittest.skipIf(evalworker is None, 'gobject is not available')
+class WorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ml = MathLib()
+        self.parser = AstParser(self.ml)
+        self.saved = (functions.angle_scaling.value,
+                      functions.exact_division.value,
+                      functions.rational_bit_limit.value)
+        self.settings = {
+            'angle_scaling': functions.angle_scaling.value,
+            'digit_limit': self.ml.digit_limit,
+            'exact_division': functions.exact_division.value,
+            'rational_bit_limit': functions.rational_bit_limit.value,
+        }
+
+    def tearDown(self):
+        (functions.angle_scaling.value, exact, bits) = self.saved
+        self.parser.set_division_mode(exact, bits)
+
+    def evaluate(self, eqn, label=u'', alt_eqn=None):
+        return evalworker._worker_evaluate(self.parser, self.ml, 1, eqn,
+                                           label, alt_eqn, self.settings)
+
+    def unpack(self, ret):
+        self.assertEqual(ret[0], 'error')
+        return evalworker._unpack_error(pickle.loads(pickle.dumps(ret[2])))
+
+    def test_result(self):
+        self.assertEqual(self.evaluate('1+2'), ('result', 1, 3))
+        self.assertEqual(self.evaluate('1+2', alt_eqn='4'), ('result', 1, 4))
+
+    def test_set_var(self):
+        evalworker._worker_set_var(self.parser, 'a', '2*b', True)
+        evalworker._worker_set_var(self.parser, 'b', 5, False)
+        self.assertEqual(self.evaluate('a+1'), ('result', 1, 11))
+
+    def test_errors(self):
+        e = self.unpack(self.evaluate('1+'))
+        self.assertTrue(isinstance(e, ParseError))
+        e = self.unpack(self.evaluate('1+nothere'))
+        self.assertTrue(isinstance(e, UndefinedError))
+        self.assertEqual(e.get_range(), (2, 9))
+
+        e = self.unpack(self.evaluate('10**10**10'))
+        self.assertTrue(isinstance(e, BudgetError))
+
+    def test_label_cycle(self):
+        evalworker._worker_set_var(self.parser, 'b', 1, False)
+        evalworker._worker_set_var(self.parser, 'a', 'b+1', True)
+        e = self.unpack(self.evaluate('a*2', label=u'b'))
+        self.assertTrue('recursion' in str(e))
+
+    def test_settings(self):
+        self.settings['exact_division'] = not self.saved[1]
+        self.evaluate('1/3')
+        self.assertEqual(functions.exact_division.value, not self.saved[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# test_functions.py, tests for the plug-in functions
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from decimal import Decimal
+
+from rational import Rational
+import functions
+
+VALUES = [3, 3L, -2.5, Decimal('1.5'), Rational(1, 3), True]
+
+class DispatchTest(unittest.TestCase):
+
+    def check_op(self, name):
+        op = getattr(functions, name)
+        generic = getattr(functions, '_%s_generic' % name)
+        for x in VALUES:
+            for y in VALUES:
+                ret = op(x, y)
+                expected = generic(x, y)
+                self.assertEqual(type(ret), type(expected),
+                                 '%s(%r, %r)' % (name, x, y))
+                self.assertEqual(ret, expected, '%s(%r, %r)' % (name, x, y))
+
+    def test_add(self):
+        self.check_op('add')
+
+    def test_sub(self):
+        self.check_op('sub')
+
+    def test_mul(self):
+        self.check_op('mul')
+
+    def test_div(self):
+        self.check_op('div')
+        self.assertRaises(ValueError, functions.div, 1, 0)
+        self.assertRaises(ValueError, functions.div, 1.0, 0.0)
+        self.assertRaises(ValueError, functions.div, Rational(1, 2), 0)
+
+    def test_pow(self):
+        self.assertEqual(functions.pow(3, 4), 81)
+        self.assertEqual(functions.pow(Rational(2, 3), 2), Rational(4, 9))
+        self.assertAlmostEqual(float(functions.pow(3, Rational(1, 3))),
+                               3 ** (1.0 / 3))
+        self.assertAlmostEqual(float(functions.pow(2, 0.5)), 2 ** 0.5)
+
+    def test_shift(self):
+        self.assertEqual(functions.shift_left(3, 2), 12)
+        self.assertEqual(functions.shift_right(3L, 1), 1)
+        self.assertEqual(functions.shift_left(4.0, 1), 8)
+        self.assertRaises(ValueError, functions.shift_left, 1.5, 1)
+
+    def test_handler_cached(self):
+        functions.add(Rational(1, 2), 2.5)
+        self.assertTrue((Rational, float) in functions._ADD_HANDLERS)
+
+    def test_bit_limit(self):
+        x = Rational(1, 3 ** 2000)
+        self.assertTrue(isinstance(functions.mul(x, x), Decimal))
+        self.assertTrue(isinstance(functions.add(x, 1), Rational))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# test_intmath.py, tests for the integer functions
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import intmath
+
+def _naive_factorial(n):
+    ret = 1
+    for i in xrange(2, n + 1):
+        ret *= i
+    return ret
+
+def _naive_binomial(n, k):
+    ret = 1
+    for i in xrange(1, k + 1):
+        ret = ret * (n - k + i) // i
+    return ret
+
+class FactorialTest(unittest.TestCase):
+
+    def test_factorial(self):
+        for n in range(0, 40) + [319, 320, 321, 1000, 4097]:
+            self.assertEqual(intmath.factorial(n), _naive_factorial(n))
+        self.assertRaises(ValueError, intmath.factorial, -1)
+
+    def test_binomial(self):
+        for n in (0, 1, 10, 63, 64, 65, 200, 1001):
+            for k in range(-1, n + 2, max(1, n // 17)):
+                if 0 <= k <= n:
+                    expected = _naive_binomial(n, k)
+                else:
+                    expected = 0
+                self.assertEqual(intmath.binomial(n, k), expected,
+                                 'binomial(%d, %d)' % (n, k))
+        self.assertRaises(ValueError, intmath.binomial, -1, 0)
+
+    def test_binomial_large_n(self):
+        n = intmath._MAX_BINOMIAL_SIEVE + 12345
+        self.assertEqual(intmath.binomial(n, 100), _naive_binomial(n, 100))
+        self.assertEqual(intmath.binomial(n, n - 70),
+                         _naive_binomial(n, 70))
+        self.assertRaises(ValueError, intmath.binomial, n, 10 ** 5)
+
+class PrimeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.max_rho_steps = intmath.MAX_RHO_STEPS
+        intmath.clear_factor_cache()
+
+    def tearDown(self):
+        intmath.MAX_RHO_STEPS = self.max_rho_steps
+        intmath.clear_factor_cache()
+
+    def test_is_prime(self):
+        primes = set(intmath.primes_up_to(10000))
+        for n in range(-2, 10001):
+            self.assertEqual(intmath.is_prime(n), n in primes)
+        self.assertTrue(intmath.is_prime(2 ** 89 - 1))
+        self.assertTrue(intmath.is_prime(2 ** 127 - 1))
+
+    def test_pseudoprimes(self):
+        # Carmichael number, strong pseudoprime to bases 2, 3, 5, 7, and to
+        # all prime bases up to 41
+        for n in (561, 3215031751, 3317044064679887385961981):
+            self.assertFalse(intmath.is_prime(n), n)
+
+    def test_nextprime(self):
+        self.assertEqual(intmath.nextprime(-5), 2)
+        self.assertEqual(intmath.nextprime(2), 3)
+        self.assertEqual(intmath.nextprime(13), 17)
+        self.assertEqual(intmath.nextprime(2 ** 89 - 2), 2 ** 89 - 1)
+
+    def test_factorize(self):
+        self.assertEqual(intmath.factorize(1), [])
+        self.assertEqual(intmath.factorize(360), [2, 2, 2, 3, 3, 5])
+        self.assertEqual(intmath.factorize(1000000007 * 998244353),
+                         [998244353, 1000000007])
+        self.assertEqual(intmath.factorize(2 ** 64 + 1),
+                         [274177, 67280421310721])
+        self.assertEqual(intmath.factor_powers(360), [(2, 3), (3, 2), (5, 1)])
+        self.assertRaises(ValueError, intmath.factorize, 0)
+
+    def test_factor_cache(self):
+        factors = intmath.factorize(360)
+        factors.append(7)
+        self.assertEqual(intmath.factorize(360), [2, 2, 2, 3, 3, 5])
+
+    def test_rho_steps(self):
+        n = 1000000007 * 998244353
+        intmath.MAX_RHO_STEPS = 16
+        self.assertRaises(ValueError, intmath.factorize, n)
+        intmath.MAX_RHO_STEPS = self.max_rho_steps
+        self.assertEqual(len(intmath.factorize(n)), 2)
+
+class DivisorTest(unittest.TestCase):
+
+    def test_divisors(self):
+        self.assertEqual(intmath.divisors(1), [1])
+        self.assertEqual(intmath.divisors(12), [1, 2, 3, 4, 6, 12])
+        self.assertEqual(len(intmath.divisors(2**10 * 3**4)), 55)
+
+    def test_too_many_divisors(self):
+        # The product of the first 20 primes has 2**20 divisors
+        n = 1
+        for p in intmath.primes_up_to(71):
+            n *= p
+        self.assertRaises(ValueError, intmath.divisors, n)
+
+    def test_totient(self):
+        self.assertEqual(intmath.totient(1), 1)
+        self.assertEqual(intmath.totient(36), 12)
+        self.assertEqual(intmath.totient(97), 96)
+
+if __name__ == '__main__':
+    unittest.main()
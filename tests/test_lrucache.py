@@ -0,0 +1,71 @@
+# test_lrucache.py, tests for the LRU cache
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lrucache import LRUCache
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_evict_least_recent(self):
+        cache = LRUCache(max_items=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_stats(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.get('a')
+        self.assertEqual(cache.get('b', 5), 5)
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        cache.clear()
+        self.assertEqual(cache.get_stats()['hits'], 0)
+
+    def test_replace_and_remove(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.set('a', 2)
+        self.assertEqual(cache.get('a'), 2)
+        cache.remove('a')
+        cache.remove('a')
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.evict(), None)
+
+    def test_max_size(self):
+        cache = LRUCache(max_size=10)
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'x' * 4)
+        cache.set('c', 'x' * 4)
+        self.assertFalse('a' in cache)
+        self.assertEqual(cache.size, 8)
+        cache.set('b', 'x')
+        self.assertEqual(cache.size, 5)
+        cache.remove('c')
+        self.assertEqual(cache.size, 1)
+
+if __name__ == '__main__':
+    unittest.main()
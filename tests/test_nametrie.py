@@ -0,0 +1,60 @@
+# test_nametrie.py, tests for the prefix tree of names
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from nametrie import NameTrie
+
+class NameTrieTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trie = NameTrie()
+        for name in ('sin', 'sinh', 'sinc', 'sqrt', 'cos'):
+            self.trie.add(name)
+
+    def test_find(self):
+        self.assertEqual(self.trie.find('si'), ['sin', 'sinc', 'sinh'])
+        self.assertEqual(self.trie.find('sinh'), ['sinh'])
+        self.assertEqual(self.trie.find('t'), [])
+        self.assertEqual(len(self.trie.find('')), 5)
+
+    def test_rank(self):
+        self.trie.add('sinus', -1)
+        self.trie.add('sinh', 1)
+        self.assertEqual(self.trie.find('sin'),
+                         ['sinus', 'sin', 'sinc', 'sinh'])
+        self.assertEqual(len(self.trie), 6)
+
+    def test_remove(self):
+        version = self.trie.version
+        self.trie.remove('sin')
+        self.assertTrue(self.trie.version > version)
+        self.assertFalse('sin' in self.trie)
+        self.assertEqual(self.trie.find('sin'), ['sinc', 'sinh'])
+        self.trie.remove('sqrt')
+        self.assertEqual(self.trie.find('sq'), [])
+        self.assertEqual(self.trie.find('s'), ['sinc', 'sinh'])
+
+        version = self.trie.version
+        self.trie.remove('nothere')
+        self.assertEqual(self.trie.version, version)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+# test_plotlib.py, tests for the svg plot generator
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import shutil
+import StringIO
+import subprocess
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from astparser import AstParser, BudgetError, ParserError
+import plotlib
+from plotlib import CustomPlot, Plot, PlotCache, SVGWriter
+import vecfunctions
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.plot = CustomPlot(AstParser())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_export_keeps_svg(self):
+        svg = self.plot.plot('x*x', x=(-2, 2))
+        self.assertTrue(svg.endswith('</svg>'))
+
+        fn = os.path.join(self.dir, 'plot.svg')
+        self.plot.export_plot(fn)
+        self.assertEqual(self.plot.get_svg(), svg)
+
+        f = open(fn)
+        try:
+            self.assertEqual(f.read(), svg)
+        finally:
+            f.close()
+
+class SVGWriterTest(unittest.TestCase):
+
+    def test_format_coord(self):
+        w = SVGWriter(precision=2)
+        self.assertEqual(w.format_coord(1.234), '1.23')
+        self.assertEqual(w.format_coord(5.0), '5')
+        self.assertEqual(w.format_coord(-0.001), '0')
+        self.assertEqual(w.format_coord(0.5), '0.5')
+
+    def test_path(self):
+        w = SVGWriter()
+        w.path([], '#000')
+        self.assertEqual(w.getvalue(), '')
+        w.path([(0, 0), (1, 2.5)], '#00f')
+        self.assertTrue('d="M0 0L1 2.5"' in w.getvalue())
+
+    def test_stream(self):
+        out = StringIO.StringIO()
+        w = SVGWriter(out)
+        w.start(10, 10)
+        w.text((1, 1), u'\xe9')
+        w.finish()
+        self.assertEqual(w.getvalue(), '')
+        self.assertTrue(out.getvalue().endswith('</svg>'))
+        self.assertTrue('\xc3\xa9' in out.getvalue())
+
+    def test_streamed_plot(self):
+        plot = CustomPlot(AstParser())
+        vals = plot.evaluate('sin(x)', 'x', (-3, 3))
+        svg = plot.produce_plot(vals, xlabel='x', ylabel='f(x)')
+        out = StringIO.StringIO()
+        plot.produce_plot(vals, out=out, xlabel='x', ylabel='f(x)')
+        self.assertEqual(out.getvalue(), svg)
+
+class SamplingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.plot = CustomPlot(AstParser())
+
+    def count_joined_steps(self, vals):
+        count = 0
+        for (x0, y0), (x1, y1) in zip(vals, vals[1:]):
+            if y0 is not None and y1 is not None and y0 != y1:
+                count += 1
+        return count
+
+    def test_steps_are_broken(self):
+        for points in (40, 100):
+            vals = self.plot.evaluate('floor(x)', 'x', (-5, 5), points)
+            self.assertEqual(self.count_joined_steps(vals), 0)
+
+    def test_smooth_curve(self):
+        vals = self.plot.evaluate('x**3', 'x', (-5, 5), 40)
+        self.assertEqual([x for (x, y) in vals if y is None], [])
+
+    def test_pole_is_broken(self):
+        vals = self.plot.evaluate('1/x', 'x', (-1, 1), 40)
+        for (x0, y0), (x1, y1) in zip(vals, vals[1:]):
+            if y0 is not None and y1 is not None:
+                self.assertFalse(y0 < 0 < y1)
+
+    def test_point_budget(self):
+        for eqn in ('1/x', 'sin(1/x)', 'floor(x)', 'x'):
+            vals = self.plot.evaluate(eqn, 'x', (-1, 1), 40)
+            self.assertTrue(len([y for (x, y) in vals if y is not None]) <= 40)
+
+    def test_refines_bends(self):
+        vals = self.plot.evaluate('x^10', 'x', (0, 1), 40)
+        xs = [x for (x, y) in vals]
+        self.assertEqual(xs, sorted(xs))
+        self.assertTrue(len([x for x in xs if x >= 0.5]) >
+                        2 * len([x for x in xs if x < 0.5]))
+
+    def test_no_values(self):
+        self.assertRaises(ParserError, self.plot.evaluate, 'ln(-1-x*x)',
+                          'x', (-2, 2))
+        self.assertRaises(ParserError, self.plot.evaluate, 'y*x', 'x',
+                          (-2, 2))
+
+class PlotCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_plot_is_cached(self):
+        plot = CustomPlot(AstParser())
+        svg = plot.plot('x*x', x=(0, 1))
+        self.assertEqual(plot.plot('x*x', x=(0, 1)), svg)
+        self.assertEqual(plot.cache.get_stats()['hits'], 1)
+        plot.plot('x*x', x=(0, 2))
+        self.assertEqual(plot.cache.get_stats()['items'], 2)
+
+    def test_random_not_cached(self):
+        plot = CustomPlot(AstParser())
+        tree = plot.parser.parse('rand_float()*x')
+        self.assertEqual(plot.get_cache_key(tree, 'x', (0, 1), 10), None)
+
+    def test_disk(self):
+        cache = PlotCache()
+        cache.set_directory(self.dir)
+        key = cache.get_key('a', 1)
+        cache.set(key, '<svg/>')
+
+        cache = PlotCache()
+        cache.set_directory(self.dir)
+        self.assertEqual(cache.get(key), '<svg/>')
+        self.assertEqual(cache.get(cache.get_key('b')), None)
+
+    def test_disk_trim(self):
+        cache = PlotCache(max_disk_size=15)
+        cache.set_directory(self.dir)
+        for i in range(3):
+            cache.set(cache.get_key(i), '<svg>%d</svg>' % i)
+        self.assertEqual(len(os.listdir(self.dir)), 1)
+
+class CacheKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = AstParser()
+        self.plot = CustomPlot(self.parser)
+        self.tree = self.parser.parse('x/3')
+
+    def tearDown(self):
+        self.parser.set_precision(None)
+        self.parser.set_division_mode(False, 4096)
+
+    def get_key(self):
+        return self.plot.get_cache_key(self.tree, 'x', (-2, 2), 100)
+
+    def test_precision(self):
+        key = self.get_key()
+        self.parser.set_precision(30)
+        self.assertNotEqual(self.get_key(), key)
+
+    def test_division_mode(self):
+        key = self.get_key()
+        self.parser.set_division_mode(True, 4096)
+        key2 = self.get_key()
+        self.assertNotEqual(key2, key)
+        self.parser.set_division_mode(True, None)
+        self.assertNotEqual(self.get_key(), key2)
+
+class BudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = AstParser()
+        self.plot = CustomPlot(self.parser)
+        self.have_numpy = vecfunctions.HAVE_NUMPY
+
+    def tearDown(self):
+        vecfunctions.HAVE_NUMPY = self.have_numpy
+
+    def test_total_steps(self):
+        # Each point is well within the budget, all of them are not
+        self.parser.MAX_STEPS = 5000
+        self.plot.ADAPTIVE = False
+        self.assertRaises(BudgetError, self.plot.evaluate, 'x*x+x*2+1', 'x',
+                          (-2, 2), points=6000)
+        self.assertEqual(len(self.plot.evaluate('x*x+x*2+1', 'x', (-2, 2),
+                                                points=100)), 100)
+
+    def test_total_steps_without_numpy(self):
+        vecfunctions.HAVE_NUMPY = False
+        self.test_total_steps()
+
+class BackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.use_mpl = plotlib.USE_MPL
+
+    def tearDown(self):
+        plotlib.USE_MPL = self.use_mpl
+
+    def test_lazy_backend(self):
+        plot = Plot(AstParser())
+        self.assertEqual(plot._backend, None)
+        self.assertEqual(plot.backend_load_time, None)
+
+    def test_custom_backend(self):
+        plotlib.USE_MPL = False
+        plot = Plot(AstParser())
+        svg = plot.plot('x*x', x=(0, 1))
+        self.assertTrue(isinstance(plot.get_backend(), CustomPlot))
+        self.assertTrue(plot.get_backend().cache is plot.cache)
+        self.assertEqual(plot.get_svg(), svg)
+
+    def test_no_matplotlib_on_import(self):
+        code = 'import sys; import plotlib; ' \
+               'sys.exit("matplotlib" in sys.modules)'
+        ret = subprocess.call([sys.executable, '-c', code],
+                              cwd=os.path.join(os.path.dirname(__file__), '..'))
+        self.assertEqual(ret, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# test_rational.py, tests for exact fractions
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import pickle
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from decimal import Decimal
+
+from rational import Rational, gcd
+
+class RationalTest(unittest.TestCase):
+
+    def test_normalize(self):
+        x = Rational(6, -4)
+        self.assertEqual((x.n, x.d), (-3, 2))
+        self.assertEqual(repr(Rational(0, -5)), 'Rational(0, 1)')
+        self.assertEqual(str(Rational(4, 2)), '2')
+        self.assertEqual(str(x), '-3/2')
+        self.assertEqual(gcd(-12, 18), 6)
+
+    def test_construct(self):
+        self.assertEqual(Rational('3/4'), Rational(3, 4))
+        self.assertEqual(Rational('0.25'), Rational(1, 4))
+        self.assertEqual(Rational(0.5), Rational(1, 2))
+        self.assertEqual(Rational(Decimal('1.5'), Rational(1, 2)), 3)
+        self.assertEqual(Rational((2, 8)), Rational(1, 4))
+        self.assertRaises(ZeroDivisionError, Rational, 1, 0)
+        self.assertRaises(ValueError, Rational, '1/2/3')
+        self.assertRaises(TypeError, Rational, 1, object())
+
+    def test_arithmetic(self):
+        a = Rational(1, 6)
+        b = Rational(1, 3)
+        self.assertEqual(repr(a + b), 'Rational(1, 2)')
+        self.assertEqual(repr(a - b), 'Rational(-1, 6)')
+        self.assertEqual(repr(a * b), 'Rational(1, 18)')
+        self.assertEqual(repr(a / b), 'Rational(1, 2)')
+        self.assertEqual(repr(1 - a), 'Rational(5, 6)')
+        self.assertEqual(repr(2 / b), 'Rational(6, 1)')
+        self.assertEqual(repr(-a), 'Rational(-1, 6)')
+        self.assertEqual(repr(abs(-a)), 'Rational(1, 6)')
+        self.assertEqual(a + b - Rational(1, 2), 0)
+
+    def test_mixed_types(self):
+        x = Rational(1, 2)
+        self.assertEqual(x + 0.25, 0.75)
+        self.assertTrue(type(x + 0.25) is float)
+        self.assertEqual(x + Decimal('0.25'), Decimal('0.75'))
+        self.assertTrue(isinstance(x * Decimal(2), Decimal))
+        self.assertEqual(repr(x + True), 'Rational(3, 2)')
+        self.assertEqual(repr(True - x), 'Rational(1, 2)')
+        self.assertEqual(repr(Rational(True, 3)), 'Rational(1, 3)')
+
+    def test_pow(self):
+        self.assertEqual(repr(Rational(2, 3) ** -2), 'Rational(9, 4)')
+        self.assertEqual(repr(Rational(4, 9) ** Rational(1, 2)),
+                         'Rational(2, 3)')
+        self.assertEqual(repr(8 ** Rational(2, 3)), 'Rational(4, 1)')
+        root = Rational(2) ** Rational(1, 2)
+        self.assertTrue(isinstance(root, Decimal))
+        self.assertAlmostEqual(float(root), 2 ** 0.5)
+
+    def test_compare(self):
+        x = Rational(1, 3)
+        self.assertTrue(x < 0.34)
+        self.assertTrue(x > Decimal('0.333'))
+        self.assertTrue(x < float('inf'))
+        self.assertFalse(x == float('nan'))
+        self.assertTrue(x != Rational(1, 2))
+        self.assertTrue(Rational(1, 1) == True)
+        self.assertEqual(Rational(2, 4), Rational(1, 2))
+        self.assertNotEqual(x, 'x')
+
+    def test_hash(self):
+        self.assertEqual(hash(Rational(4, 2)), hash(2))
+        self.assertEqual(hash(Rational(1, 2)), hash(0.5))
+        self.assertEqual(hash(Rational(2, 6)), hash(Rational(1, 3)))
+        d = {Rational(1, 2): 1}
+        self.assertEqual(d[0.5], 1)
+
+    def test_conversions(self):
+        self.assertEqual(int(Rational(-7, 2)), -3)
+        self.assertEqual(int(Rational(7, 2)), 3)
+        self.assertAlmostEqual(float(Rational(10 ** 400, 3 * 10 ** 399)),
+                               10.0 / 3)
+        self.assertEqual(Rational(1, 4).to_decimal(), Decimal('0.25'))
+        self.assertFalse(Rational(0, 3))
+        x = pickle.loads(pickle.dumps(Rational(2, 6)))
+        self.assertEqual(repr(x), 'Rational(1, 3)')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# test_svgimage.py, tests for lazily rendered svg images
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Rendering needs gtk and rsvg
+try:
+    import svgimage
+except ImportError:
+    svgimage = None
+
+SVG = '<?xml version="1.0"?>\n<svg width="%s" height="%s" version="1.1" ' \
+      'xmlns="http://www.w3.org/2000/svg">\n' \
+      '<line x1="0" y1="0" x2="10" y2="10" style="stroke:#000" />\n</svg>'
+
+@unittest.skipIf(svgimage is None, 'gtk or rsvg is not available')
+class SVGImageTest(unittest.TestCase):
+
+    def test_size(self):
+        image = svgimage.SVGImage(data=SVG % ('250', '100'))
+        self.assertEqual(image.get_size(), (250, 100))
+        image = svgimage.SVGImage(data=SVG % ('8pt', '4.2px'))
+        self.assertEqual(image.get_size(), (10, 4))
+        image = svgimage.SVGImage(data=SVG % ('100%', '100%'))
+        self.assertEqual(image.get_size(), None)
+        image.set_render_size(20, 30)
+        self.assertEqual(image.get_size(), (20, 30))
+
+    def test_hash(self):
+        image = svgimage.SVGImage(data=SVG % (10, 10))
+        h = image.get_hash()
+        self.assertEqual(svgimage.SVGImage(data=SVG % (10, 10)).get_hash(), h)
+        image.load_data(SVG % (20, 20))
+        self.assertNotEqual(image.get_hash(), h)
+
+    def test_pixbuf_cache(self):
+        svgimage._pixbuf_cache.clear()
+        pixbuf = svgimage.SVGImage(data=SVG % (10, 10)).get_pixbuf()
+        image = svgimage.SVGImage(data=SVG % (10, 10))
+        self.assertTrue(image.get_pixbuf() is pixbuf)
+        self.assertEqual(svgimage._pixbuf_cache.get_stats()['hits'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
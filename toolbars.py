@@ -305,6 +305,7 @@ class MiscToolbar(gtk.Toolbar):
             {'icon': 'digits-9', 'html': '9'},
             {'icon': 'digits-12', 'html': '12'},
             {'icon': 'digits-15', 'html': '15'},
+            {'icon': 'digits-30', 'html': '30'},
             {'icon': 'digits-6', 'html': '6'},
         ]
         self._digits_button = IconToggleToolButton(
@@ -377,6 +378,7 @@ class MiscToolbar(gtk.Toolbar):
 
     def update_digits(self, text, calc):
         calc.ml.set_digit_limit(int(text))
+        calc.parser.set_precision(int(text))
         _logger.debug('Digit limit: %s', calc.ml.digit_limit)
 
     def update_int_base(self, text, calc):
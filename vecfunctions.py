@@ -0,0 +1,109 @@
+# vecfunctions.py, array versions of the functions available in Calculate
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+# These functions operate on NumPy arrays of floats and are used to evaluate
+# an equation for many values at once, e.g. when plotting. They follow the
+# behaviour of their counterparts in functions.py, except that invalid
+# values result in nan or inf instead of an exception.
+
+import functions
+
+try:
+    import numpy
+    HAVE_NUMPY = True
+except ImportError:
+    numpy = None
+    HAVE_NUMPY = False
+
+def _scale_angle(x):
+    return x * functions.angle_scaling.value
+
+def _inv_scale_angle(x):
+    return x / functions.angle_scaling.value
+
+def acos(x):
+    return _inv_scale_angle(numpy.arccos(x))
+
+def asin(x):
+    return _inv_scale_angle(numpy.arcsin(x))
+
+def atan(x):
+    return _inv_scale_angle(numpy.arctan(x))
+
+def cos(x):
+    return numpy.cos(_scale_angle(x))
+
+def inv(x):
+    return 1.0 / x
+
+def ln(x):
+    return numpy.log(x)
+
+def sin(x):
+    return numpy.sin(_scale_angle(x))
+
+def sinc(x):
+    x = numpy.asarray(x, dtype=float)
+    ret = numpy.sin(_scale_angle(x)) / x
+    return numpy.where(x == 0.0, 1.0, ret)
+
+def square(x):
+    return x * x
+
+def tan(x):
+    return numpy.tan(_scale_angle(x))
+
+# Map of functions.py functions to their array versions
+FUNCTIONS = {}
+
+# Map of binary operators (as functions.py functions) to array versions
+OPERATORS = {}
+
+if HAVE_NUMPY:
+    FUNCTIONS = {
+        functions.abs: numpy.fabs,
+        functions.acos: acos,
+        functions.acosh: numpy.arccosh,
+        functions.asin: asin,
+        functions.asinh: numpy.arcsinh,
+        functions.atan: atan,
+        functions.atanh: numpy.arctanh,
+        functions.ceil: numpy.ceil,
+        functions.cos: cos,
+        functions.cosh: numpy.cosh,
+        functions.exp: numpy.exp,
+        functions.floor: numpy.floor,
+        functions.inv: inv,
+        functions.ln: ln,
+        functions.log10: numpy.log10,
+        functions.negate: numpy.negative,
+        functions.sin: sin,
+        functions.sinc: sinc,
+        functions.sinh: numpy.sinh,
+        functions.sqrt: numpy.sqrt,
+        functions.square: square,
+        functions.tan: tan,
+        functions.tanh: numpy.tanh,
+    }
+
+    OPERATORS = {
+        functions.add: numpy.add,
+        functions.div: numpy.true_divide,
+        functions.mod: numpy.mod,
+        functions.mul: numpy.multiply,
+        functions.pow: numpy.power,
+        functions.sub: numpy.subtract,
+    }